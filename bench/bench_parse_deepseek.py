@@ -0,0 +1,114 @@
+"""
+Micro-benchmark di parse_deepseek_files (deepseek_parser.py).
+
+1) Verifica sul corpus di risposte registrate (bench/corpus/*.txt) che i file estratti coincidano
+   con quelli dell'implementazione originale (bench/reference_parser.py).
+2) Misura il tempo (mediana di --repeat esecuzioni) su risposte sintetiche da qualche centinaio
+   di KB a qualche MB (file in blocchi ``` più molte righe "nome.ext" di rumore) e mostra il
+   costo per KB. La verifica di linearità confronta il costo per KB delle due dimensioni più
+   grandi, dove overhead fisso e rumore del timer pesano poco: con crescita lineare resta
+   ~costante, con una quadratica raddoppia.
+
+Uso:
+    python bench/bench_parse_deepseek.py [--min-kb 256] [--max-mb 4] [--repeat 7] [--reference-max-kb 256]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from deepseek_parser import parse_deepseek_files  # noqa: E402
+from reference_parser import reference_parse_deepseek_files  # noqa: E402
+
+
+def check_corpus():
+    ok = True
+    for path in sorted(glob.glob(os.path.join(HERE, "corpus", "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        files_new, _ = parse_deepseek_files(content)
+        files_ref, _ = reference_parse_deepseek_files(content)
+        same = files_new == files_ref
+        ok = ok and same
+        print(f"  {os.path.basename(path):28} {len(files_new):3} file  {'OK' if same else 'DIVERSO'}")
+    return ok
+
+
+def synthetic_response(target_bytes):
+    """Risposta finta: blocchi di file completi alternati a righe che sembrano nomi di file."""
+    block = []
+    n = 0
+    size = 0
+    while size < target_bytes:
+        body = "\n".join(f"    value_{n}_{k} = compute('{k}.json')  # vedi config.yaml" for k in range(40))
+        part = (f"Updated module number {n}, see notes.md and v1.{n}\n"
+                f"pkg/module_{n}.py\n```python\n{body}\n```\n"
+                + "".join(f"related_{n}_{k}.txt\n" for k in range(5)))
+        block.append(part)
+        size += len(part)
+        n += 1
+    return "".join(block)
+
+
+def timed(func, content, repeat):
+    """Mediana dei tempi di `repeat` esecuzioni."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(content)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-kb", type=int, default=256, help="dimensione sintetica iniziale")
+    parser.add_argument("--max-mb", type=float, default=4.0)
+    parser.add_argument("--repeat", type=int, default=7, help="esecuzioni per dimensione (si usa la mediana)")
+    parser.add_argument("--reference-max-kb", type=int, default=256,
+                        help="dimensione massima su cui misurare anche l'implementazione originale")
+    args = parser.parse_args(argv)
+
+    print("Corpus (file estratti uguali all'originale):")
+    corpus_ok = check_corpus()
+
+    sizes = []
+    size_kb = args.min_kb
+    while size_kb <= args.max_mb * 1024:
+        sizes.append(size_kb)
+        size_kb *= 2
+    if len(sizes) < 2:
+        parser.error("servono almeno due dimensioni: --max-mb deve valere almeno il doppio di --min-kb")
+    contents = {kb: synthetic_response(kb * 1024) for kb in sizes}
+    # un giro su tutte le dimensioni per ripetizione: un rallentamento della macchina durante
+    # la misura pesa su tutte allo stesso modo invece di falsare il rapporto tra due di esse
+    times = {kb: [] for kb in sizes}
+    for _ in range(args.repeat):
+        for kb in sizes:
+            times[kb].append(timed(parse_deepseek_files, contents[kb], 1))
+
+    print("\n  dimensione   nuovo (ms)   µs/KB   originale (ms)")
+    per_kb = []
+    for kb in sizes:
+        new_s = statistics.median(times[kb])
+        per_kb.append(new_s * 1e6 / kb)
+        ref = ""
+        if kb <= args.reference_max_kb:
+            ref = f"{timed(reference_parse_deepseek_files, contents[kb], 1) * 1000:12.1f}"
+        print(f"  {kb:7} KB   {new_s * 1000:10.1f}   {per_kb[-1]:6.2f}   {ref}")
+
+    # raddoppiando la dimensione: ~1 se lineare, ~2 se quadratica
+    growth = per_kb[-1] / per_kb[-2]
+    linear = growth < 1.3
+    print(f"\nCosto per KB, ultime due dimensioni: {growth:.2f}x -> {'lineare' if linear else 'NON lineare'}")
+    return 0 if corpus_ok and linear else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
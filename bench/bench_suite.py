@@ -0,0 +1,377 @@
+"""
+Benchmark di CodeShow su repository sintetici (1k, 10k, 100k file).
+
+Genera alberi riproducibili (annidamento profondo, dimensioni miste, file binari e generati,
+cartelle ignorate) e misura le fasi del nucleo senza interfaccia (codeshow.py):
+
+    scan_cold / scan_warm     scansione con regole di ignore, senza e con indice file
+    fileset_save / _load      file_set_tony_N.json (v2, con impronte) con tutti i file di testo
+    slot_load                 lettura dei file negli slot (anteprime, binari)
+    prompt_cold / _warm       costruzione del prompt, senza e con la cache delle sezioni
+    prompt_budget             stima token e riduzione a scheletri (modalità budget)
+    parse_*                   parse_deepseek_files su risposte registrate e sintetiche grandi
+    gui_startup               (con --gui) avvio della GUI fino alle colonne, sotto display virtuale
+
+I risultati vanno in JSON (--output) e si confrontano con una baseline salvata (--baseline,
+default bench/baseline.json): esce con 1 se una fase è più lenta della tolleranza.
+
+Uso:
+    python bench/bench_suite.py [--sizes 1000,10000,100000] [--output risultati.json]
+    python bench/bench_suite.py --sizes 1000 --save-baseline
+    python bench/bench_suite.py --gui            # richiede tkinter e DISPLAY o xvfb-run
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import codeshow  # noqa: E402
+from deepseek_parser import parse_deepseek_files  # noqa: E402
+from bench_parse_deepseek import synthetic_response  # noqa: E402
+
+GUI_SCRIPT = os.path.join(ROOT, "code_show_all_directories - Working Api.py")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+TREE_MARKER = ".bench_tree.json"
+RESULTS_VERSION = 1
+NOISE_FLOOR_S = 0.005  # differenze sotto questa soglia non contano come regressioni
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+TEXT_EXTENSIONS = (".py", ".py", ".py", ".js", ".ts", ".md", ".json", ".css", ".txt")
+
+
+# ========================== ALBERI SINTETICI ==========================
+
+def _python_source(rng, n_lines):
+    lines = ["import os", "import sys", ""]
+    while len(lines) < n_lines:
+        k = len(lines)
+        lines += [f"class Model{k}:", f'    """Modello {k}."""', "",
+                  f"    def method_{k}(self, value, *args):",
+                  f"        total = value * {k} + len(args)",
+                  "        for item in args:",
+                  f"            total += hash(item) % {k + 7}",
+                  "        return total", ""]
+    return "\n".join(lines[:n_lines]) + "\n"
+
+
+def _text_source(rng, ext, n_lines):
+    if ext == ".py":
+        return _python_source(rng, n_lines)
+    if ext in (".js", ".ts"):
+        return "".join(f"export function handler{k}(req, res) {{ return res.send({k}); }}\n"
+                       for k in range(n_lines))
+    return "".join(f"riga {k}: {rng.random():.12f} lorem ipsum dolor sit amet\n" for k in range(n_lines))
+
+
+def generate_tree(base_dir, n_files, seed=0):
+    """
+    Crea in base_dir un albero di circa n_files file visibili (più cartelle ignorate):
+    directory annidate fino a 8 livelli, file di testo da poche righe a qualche centinaio di KB,
+    ~3% binari, qualche file generato e pochi file oltre MAX_FILE_BYTES (anteprima).
+    """
+    rng = random.Random(seed)
+    os.makedirs(base_dir, exist_ok=True)
+    dirs = [""]
+    n_dirs = max(4, n_files // 12)
+    for k in range(n_dirs):
+        parent = rng.choice(dirs)
+        if parent.count("/") >= 7:
+            parent = ""
+        dirs.append(f"{parent}pkg{k}/")
+    for d in dirs:
+        os.makedirs(os.path.join(base_dir, d), exist_ok=True)
+
+    total_bytes = 0
+    big_left = 3
+    for k in range(n_files):
+        d = rng.choice(dirs)
+        roll = rng.random()
+        if roll < 0.03:
+            path, data = f"{d}image_{k}.png", PNG_HEADER + rng.randbytes(rng.randint(200, 20000))
+        elif roll < 0.035:
+            path = f"{d}bundle_{k}.min.js"
+            data = ("var a=" + ",".join(str(rng.random()) for _ in range(400)) + ";").encode()
+        elif big_left and roll > 0.999:
+            big_left -= 1
+            path = f"{d}huge_{k}.log"
+            data = _text_source(rng, ".log", 40000).encode()  # ~2 MB: oltre MAX_FILE_BYTES
+        else:
+            ext = rng.choice(TEXT_EXTENSIONS)
+            n_lines = int(min(6000, rng.lognormvariate(3.5, 1.1))) + 1
+            path, data = f"{d}module_{k}{ext}", _text_source(rng, ext, n_lines).encode()
+        with open(os.path.join(base_dir, path), "wb") as f:
+            f.write(data)
+        total_bytes += len(data)
+
+    # contenuti che la scansione deve saltare
+    for d in ("node_modules/lib/dist/", "build/out/", "logs/"):
+        os.makedirs(os.path.join(base_dir, d), exist_ok=True)
+        for k in range(max(10, n_files // 50)):
+            with open(os.path.join(base_dir, d, f"skip_{k}.js"), "w") as f:
+                f.write("ignored\n")
+    with open(os.path.join(base_dir, ".gitignore"), "w") as f:
+        f.write("logs/\n*.tmp\n")
+    with open(os.path.join(base_dir, "package-lock.json"), "w") as f:
+        f.write("{}\n")
+    with open(os.path.join(base_dir, TREE_MARKER), "w") as f:
+        json.dump({"files": n_files, "seed": seed, "bytes": total_bytes}, f)
+    return total_bytes
+
+
+def ensure_tree(work_dir, n_files, seed):
+    """Riusa l’albero se già generato con gli stessi parametri (la generazione a 100k è lenta)."""
+    base_dir = os.path.join(work_dir, f"tree_{n_files}")
+    try:
+        with open(os.path.join(base_dir, TREE_MARKER)) as f:
+            info = json.load(f)
+        if info.get("files") == n_files and info.get("seed") == seed:
+            return base_dir, info["bytes"], 0.0
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(base_dir, ignore_errors=True)
+    t0 = time.perf_counter()
+    total = generate_tree(base_dir, n_files, seed)
+    return base_dir, total, time.perf_counter() - t0
+
+
+# ========================== MISURE ==========================
+
+def best_of(func, repeat):
+    """(miglior tempo, risultato dell’ultima esecuzione)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def reset_core_state():
+    """Svuota cache e stato degli slot del nucleo: ogni misura "cold" parte da zero."""
+    for state in (codeshow.truncated_files, codeshow.binary_slots, codeshow.full_content_slots,
+                  codeshow.prompt_section_cache, codeshow.section_token_cache, codeshow.skeleton_cache):
+        state.clear()
+
+
+def bench_tree(base_dir, repeat, max_slots):
+    results = {}
+
+    def scan(index):
+        files, kinds = [], {}
+
+        def emit(batch, batch_kinds):
+            files.extend(batch)
+            kinds.update(batch_kinds)
+        new_index = codeshow.scan_directory(base_dir, emit, index=index)
+        new_index.pop("reread_dirs", None)
+        return files, kinds, new_index
+
+    # scansione a freddo: una sola volta (le successive troverebbero la cache del sistema operativo
+    # comunque calda, ma almeno non l’indice)
+    seconds, (files, kinds, index) = best_of(lambda: scan(None), 1)
+    results["scan_cold"] = {"seconds": seconds, "files": len(files), "non_text": len(kinds)}
+    seconds, _ = best_of(lambda: scan(index), repeat)
+    results["scan_warm"] = {"seconds": seconds, "files": len(files)}
+
+    text_files = [rel for rel in files if rel not in kinds]
+    set_dir = tempfile.mkdtemp(prefix="codeshow_fileset_")
+    try:
+        seconds, (path, _) = best_of(
+            lambda: codeshow.write_file_set(set_dir, base_dir, text_files, index), repeat)
+        results["fileset_save"] = {"seconds": seconds, "files": len(text_files)}
+
+        def load_fileset():
+            # come load_fileset_from_path nella GUI: presenza e impronte in un solo passaggio
+            present, _, _ = codeshow.check_file_set(base_dir, codeshow.read_file_set_data(path), index)
+            return present
+        seconds, loaded = best_of(load_fileset, repeat)
+        results["fileset_load"] = {"seconds": seconds, "files": len(loaded)}
+    finally:
+        shutil.rmtree(set_dir, ignore_errors=True)
+
+    selection = sorted(text_files)[:max_slots]
+
+    def load():
+        reset_core_state()
+        return codeshow.load_slots(base_dir, selection, index=index)
+    seconds, slots = best_of(load, repeat)
+    results["slot_load"] = {"seconds": seconds, "slots": len(slots),
+                            "bytes": sum(len(s["content"]) for s in slots),
+                            "previews": len(codeshow.truncated_files)}
+
+    tail = codeshow.prompt_tail("full", slots)
+
+    def prompt_cold():
+        for state in (codeshow.prompt_section_cache, codeshow.section_token_cache):
+            state.clear()
+        for slot in slots:
+            slot["hash"] = None
+        return codeshow.build_prompt(slots, tail, "benchmark")
+    seconds, text = best_of(prompt_cold, repeat)
+    results["prompt_cold"] = {"seconds": seconds, "chars": len(text)}
+    seconds, _ = best_of(lambda: codeshow.build_prompt(slots, tail, "benchmark"), repeat)
+    results["prompt_warm"] = {"seconds": seconds, "chars": len(text)}
+
+    def budget():
+        codeshow.skeleton_cache.clear()
+        return codeshow.prompt_plan(slots, tail, "benchmark", fit_budget=True)
+    seconds, (_, report) = best_of(budget, repeat)
+    results["prompt_budget"] = {"seconds": seconds, "tokens_full": report["total_full"],
+                                "tokens": report["total"], "skeleton": len(report["skeleton"]),
+                                "omitted": len(report["omitted"])}
+    return results
+
+
+def bench_parse(repeat, max_mb):
+    results = {}
+    corpus = ""
+    for path in sorted(glob.glob(os.path.join(HERE, "corpus", "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            corpus += f.read() + "\n"
+    if corpus:
+        seconds, (files_map, _) = best_of(lambda: parse_deepseek_files(corpus), repeat)
+        results["parse_corpus"] = {"seconds": seconds, "bytes": len(corpus), "files": len(files_map)}
+    content = synthetic_response(int(max_mb * 1024 * 1024))
+    seconds, (files_map, _) = best_of(lambda: parse_deepseek_files(content), repeat)
+    results["parse_synthetic"] = {"seconds": seconds, "bytes": len(content), "files": len(files_map)}
+    return results
+
+
+def gui_command():
+    """Comando per avviare la GUI: con il DISPLAY attuale o sotto xvfb-run; None se impossibile."""
+    if importlib.util.find_spec("tkinter") is None:
+        return None, "tkinter non disponibile"
+    cmd = [sys.executable, GUI_SCRIPT]
+    if os.environ.get("DISPLAY"):
+        return cmd, None
+    xvfb = shutil.which("xvfb-run")
+    if xvfb:
+        return [xvfb, "-a"] + cmd, None
+    return None, "nessun DISPLAY e xvfb-run non trovato"
+
+
+def bench_gui(base_dir, timeout):
+    cmd, reason = gui_command()
+    if cmd is None:
+        print(f"  GUI saltata: {reason}")
+        return {}
+    env = dict(os.environ, CODESHOW_DIR=base_dir, CODESHOW_BENCH="1", CODESHOW_WATCH="off")
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout)
+    wall = time.perf_counter() - started
+    for line in proc.stdout.splitlines():
+        if line.startswith("[BENCH] "):
+            data = json.loads(line[len("[BENCH] "):])
+            return {"gui_startup": {"seconds": wall, "startup_s": data["startup_s"],
+                                    "loaded_s": data["loaded_s"],
+                                    "rebuild_columns_s": data["rebuild_columns_s"],
+                                    "slots": data["slots"]}}
+    print(f"  GUI: nessun risultato (exit {proc.returncode})\n{proc.stderr[-2000:]}")
+    return {}
+
+
+# ========================== BASELINE ==========================
+
+def compare(results, baseline, tolerance):
+    """Stampa il confronto fase per fase; ritorna le chiavi più lente della tolleranza."""
+    regressions = []
+    print(f"\n  {'fase':32} {'baseline':>10} {'attuale':>10} {'rapporto':>9}")
+    for key, entry in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"  {key:32} {'-':>10} {entry['seconds'] * 1000:8.1f}ms")
+            continue
+        ratio = entry["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        slower = (entry["seconds"] > base["seconds"] * (1 + tolerance)
+                  and entry["seconds"] - base["seconds"] > NOISE_FLOOR_S)
+        if slower:
+            regressions.append(key)
+        print(f"  {key:32} {base['seconds'] * 1000:8.1f}ms {entry['seconds'] * 1000:8.1f}ms "
+              f"{ratio:8.2f}x{'  REGRESSIONE' if slower else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="numero di file per albero, separati da virgola")
+    parser.add_argument("--work-dir", help="dove generare gli alberi (riusati fra un’esecuzione e l’altra); "
+                                           "default: cartella temporanea cancellata alla fine")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="ripetizioni per fase (si tiene il tempo migliore)")
+    parser.add_argument("--max-slots", type=int, default=10000, help="file caricati negli slot (come MAX_COLUMNS)")
+    parser.add_argument("--parse-mb", type=float, default=4.0, help="dimensione della risposta sintetica da parsare")
+    parser.add_argument("--gui", action="store_true", help="misura anche l’avvio della GUI (tkinter + display)")
+    parser.add_argument("--gui-timeout", type=float, default=600)
+    parser.add_argument("--output", "-o", help="file JSON dei risultati (default: solo a video)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="salva i risultati come nuova baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="rallentamento ammesso (0.25 = +25%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="codeshow_bench_")
+    results = {}
+    try:
+        for n_files in sizes:
+            base_dir, total_bytes, gen_s = ensure_tree(work_dir, n_files, args.seed)
+            print(f"Albero da {n_files} file ({total_bytes / 1e6:.1f} MB"
+                  + (f", generato in {gen_s:.1f}s" if gen_s else ", riusato") + ")")
+            stages = bench_tree(base_dir, args.repeat, args.max_slots)
+            if args.gui:
+                stages.update(bench_gui(base_dir, args.gui_timeout))
+            for stage, entry in stages.items():
+                results[f"{stage}@{n_files}"] = entry
+                print(f"  {stage:16} {entry['seconds'] * 1000:10.1f} ms")
+        print("Parsing delle risposte")
+        for stage, entry in bench_parse(args.repeat, args.parse_mb).items():
+            results[stage] = entry
+            print(f"  {stage:16} {entry['seconds'] * 1000:10.1f} ms  ({entry['bytes'] / 1e6:.2f} MB)")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tokenizer": codeshow.tokenizer_name,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRisultati scritti in {args.output}")
+
+    status = 0
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} fasi oltre la tolleranza del {args.tolerance:.0%}: {', '.join(regressions)}")
+            status = 1
+        else:
+            print("\nNessuna regressione rispetto alla baseline.")
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline salvata in {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
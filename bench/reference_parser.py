@@ -0,0 +1,85 @@
+"""
+Implementazione originale di parse_deepseek_files (due passate regex, quadratica nel numero di
+righe "nome.ext"), conservata solo come riferimento per bench_parse_deepseek.py.
+"""
+import re
+
+
+def reference_parse_deepseek_files(content: str):
+    """
+    Estrae un dizionario {filename -> file_content} dal testo del modello.
+    Supporta due formati comuni:
+      1) Filename su una riga + blocco ``` ... ```
+      2) Filename su una riga + corpo fino al prossimo filename o fine testo
+    Ritorna anche una stringa 'explanations' con l'eventuale testo non parsato.
+    """
+    files_map = {}
+    consumed_spans = []
+
+    # --- Passo 1: filename + fenced code block
+    # Esempio:
+    #   path/to/file.py
+    #   ```python
+    #   ...code...
+    #   ```
+    pattern_fenced = re.compile(
+        r'(?m)^\s*([^\n\r]+?\.[A-Za-z0-9]{1,10})\s*\n```[^`\n]*\n(.*?)\n```',
+        re.DOTALL
+    )
+    for m in pattern_fenced.finditer(content):
+        fname = m.group(1).strip()
+        body = m.group(2)
+        files_map[fname] = body
+        consumed_spans.append((m.start(), m.end()))
+
+    # --- Passo 2: filename + blocco plain fino al prossimo filename
+    # Ma evita di riparsare aree già consumate
+    def is_consumed(i):
+        for a, b in consumed_spans:
+            if a <= i < b:
+                return True
+        return False
+
+    # Candidati filename: linee che terminano con .ext
+    pattern_plain_header = re.compile(
+        r'(?m)^\s*([^\n\r]+?\.[A-Za-z0-9]{1,10})\s*$')
+    matches = list(pattern_plain_header.finditer(content))
+    for idx, m in enumerate(matches):
+        start = m.start()
+        if is_consumed(start):
+            continue
+        fname = m.group(1).strip()
+
+        # Limita al prossimo header non consumato
+        end_pos = len(content)
+        for j in range(idx + 1, len(matches)):
+            nxt = matches[j]
+            if is_consumed(nxt.start()):
+                continue
+            end_pos = nxt.start()
+            break
+
+        # Corpo è tra fine linea header e end_pos
+        # taglia un eventuale \n iniziale
+        body = content[m.end():end_pos]
+        if body.startswith("\n"):
+            body = body[1:]
+        body = body.strip()
+        if body:
+            files_map[fname] = body
+            consumed_spans.append((m.start(), end_pos))
+
+    # Spiegazioni = tutto ciò che non è stato consumato
+    # (per semplicità, se parsing ha trovato almeno un file, mostriamo cmq explanations=resto)
+    explanations_parts = []
+    last = 0
+    for a, b in sorted(consumed_spans):
+        if last < a:
+            explanations_parts.append(content[last:a])
+        last = b
+    if last < len(content):
+        explanations_parts.append(content[last:])
+    explanations_text = "\n".join(p.strip()
+                                  for p in explanations_parts if p.strip())
+
+    return files_map, explanations_text
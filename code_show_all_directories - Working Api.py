@@ -4,43 +4,59 @@ from tkinter import ttk, filedialog, messagebox
 import json
 import pyperclip  # Libreria per gestire la clipboard
 import requests   # per chiamare l'API DeepSeek
+import codeshow   # nucleo senza interfaccia: scansione, indice, slot, prompt, API (anche da riga di comando)
+from codeshow import (
+    FILE_KIND_BINARY, MAX_FILE_BYTES, TOKEN_BUDGET,
+    truncated_files, full_content_slots, binary_slots, sent_snapshots, prompt_cache_stats,
+    PathIndex, classify_file, file_kind_label, scan_directory, to_index_key, compute_content_hash,
+    decode_text, format_size, format_tokens, write_file_atomic, make_slot, get_slot_name, get_slot_content,
+    get_slot_hash, StringWriter, TokenCountingWriter, open_prompt_writer, describe_prompt_target,
+    write_prompt, build_prompt, prompt_tail, prompt_plan, describe_budget_report,
+    estimate_tokens, build_sent_snapshot, record_sent_snapshot, write_followup_prompt, describe_followup_stats,
+    build_chat_payload, response_text, response_usage, IncrementalFileParser, iter_stream_deltas,
+    span, traced, trace_spans,
+)
+from deepseek_client import ClientConfig, DeepSeekClient, ResponseCache  # sessione condivisa, retry, rate limit, cache
+from deepseek_parser import parse_deepseek_files  # parsing lineare delle risposte
+from deepseek_patch import EditResult, apply_edits, looks_like_patch, parse_patches  # modifiche mirate
 import re         # per parsare i blocchi file restituiti dal modello
+import queue      # passaggio risultati dai thread di lavoro al thread Tk
+import itertools
+import threading
+import time
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
 
 # ==========================
 # Configura la tua API key da .env (nessun hardcode)
 # ==========================
-
-def _load_dotenv_into_environ():
-    """Carica chiavi da un file .env nella root del progetto (se presente)."""
-    try:
-        base_dir = os.path.dirname(__file__)
-        env_path = os.path.join(base_dir, ".env")
-        if os.path.isfile(env_path):
-            with open(env_path, "r", encoding="utf-8") as f:
-                for raw_line in f:
-                    line = raw_line.strip()
-                    if not line or line.startswith("#") or "=" not in line:
-                        continue
-                    key, value = line.split("=", 1)
-                    key = key.strip()
-                    value = value.strip()
-                    if key and value and key not in os.environ:
-                        os.environ[key] = value
-    except Exception:
-        # Silenzia errori di caricamento .env; fallback a variabili d'ambiente del sistema
-        pass
-
-
-_load_dotenv_into_environ()
+codeshow.load_dotenv_into_environ()
 API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+# Endpoint configurabile (es. il server locale mock_deepseek_server.py per le prove).
+# Timeout, retry e rate limit: DEEPSEEK_CONNECT_TIMEOUT, DEEPSEEK_READ_TIMEOUT,
+# DEEPSEEK_MAX_RETRIES, DEEPSEEK_RATE_LIMIT (vedi deepseek_client.py).
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL") or "https://api.deepseek.com/v1/chat/completions"
+deepseek_client = None  # DeepSeekClient condiviso (pool di connessioni), creato al primo "Esegui"
 
 # Variabili globali
-MAX_COLUMNS = 100
+MAX_COLUMNS = 10000  # gli slot sono virtualizzati: solo quelli visibili hanno widget Tk
 COLUMN_TEXT_HEIGHT = 15  # era 20: -25% di altezza per mostrare le Output preference
-columns = []
+COLUMN_WIDTH_PX = 360    # larghezza minima di una colonna (adattata alla prima creata)
+COLUMN_GAP_PX = 6
+COLUMN_OVERSCAN = 2      # colonne realizzate oltre il bordo visibile, per lato
+columns = []  # modello: un dict per slot, nell'ordine delle colonne (vedi MODELLO SLOT)
+slots_by_id = {}
+slot_seq = 0  # contatore per gli id degli slot ("fileN")
+active_column_widgets = []  # colonne Tk associate a uno slot visibile
+free_column_widgets = []    # colonne Tk nascoste, pronte per essere riciclate
+column_pitch = COLUMN_WIDTH_PX + COLUMN_GAP_PX
+column_pitch_measured = False
+column_view_pending = False
 file_paths = {}
-truncated_files = {}
 truncated_files_label = None
 # Frame delle opzioni prompt (verrà creato più avanti)
 prompt_mode_frame = None
@@ -53,13 +69,92 @@ selected_files = set()  # file selezionati dall’utente
 selected_dir = ""
 file_set_dir = ""  # <selected_dir>/file_set
 
+UI_QUEUE_POLL_MS = 30      # intervallo di drenaggio della coda UI
+UI_QUEUE_BUDGET_S = 0.03   # tempo massimo per tick speso a processare la coda
+
+ui_queue = queue.Queue()   # (callable, args) da eseguire sul thread Tk
+scan_in_progress = False
+scan_listeners = []        # callback(batch, done) registrate (es. "Gestisci File")
+scan_stop_event = None
+selection_from_user = False  # True se la selezione arriva da file_set o da "OK"
+fileset_drifted_files = []   # file dell’ultimo file_set caricato cambiati dopo il suo salvataggio
+fileset_recheck_path = None  # file_set caricato all’avvio, da ricontrollare a fine scansione
+
+file_index = None
+
+file_kinds = {}  # rel_path -> tipo, solo per i file NON di testo (binari o generati)
+path_index = None  # PathIndex dei file trovati (albero e ricerca di "Gestisci File")
+
+# Monitoraggio dei file aperti negli slot (inotify su Linux, altrimenti poll di size/mtime).
+# CODESHOW_WATCH: "auto" (default), "inotify", "poll" oppure "off".
+WATCH_MODE = os.getenv("CODESHOW_WATCH", "auto").lower()
+WATCH_POLL_INTERVAL_S = 2.0
+WATCH_COALESCE_S = 0.1
+file_watcher = None
+stale_files = set()     # file_path_var degli slot cambiati su disco dopo il caricamento
+slot_file_stats = {}    # file_path_var -> (size, mtime_ns) al momento del caricamento
+# Slot modificati rispetto al disco: "Salva Tutti" scrive solo questi (in parallelo, atomicamente).
+slot_saved_hashes = {}  # file_path_var -> hash del contenuto com’era su disco (caricamento/salvataggio)
+dirty_slots = set()     # file_path_var degli slot con modifiche non salvate
+SAVE_WORKERS = 8
+save_in_progress = False
+save_all_button = None
+
+
+budget_mode_var = None
+budget_report_label = None
+api_conversation = []      # messaggi user/assistant della sessione DeepSeek in corso
+followup_mode_var = None
+last_prompt_report = None
+# Chiamata DeepSeek in corso (thread di lavoro), None se nessuna
+deepseek_request = None
+DEEPSEEK_PROGRESS_MS = 200
+# Streaming SSE della risposta (attivabile dalla UI; default da CODESHOW_STREAM=1)
+DEEPSEEK_STREAM = os.getenv("CODESHOW_STREAM", "0").lower() in ("1", "true", "yes", "on")
+stream_mode_var = None
+# Cache su disco delle risposte (<selected_dir>/.codeshow/responses), LRU per dimensione.
+RESPONSE_CACHE_ENABLED = os.getenv("CODESHOW_RESPONSE_CACHE", "1").lower() not in ("0", "false", "no", "off")
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv("CODESHOW_RESPONSE_CACHE_MB", "50")) * 1024 * 1024)
+response_cache = None
+response_cache_var = None
+response_cache_label = None
+# Caricamento progressivo degli slot: i file vengono letti e decodificati su un pool di thread
+# (prima quelli visibili) e i contenuti grandi entrano nelle Text a pezzi, così la finestra resta
+# reattiva. CODESHOW_IO_WORKERS = letture contemporanee.
+FILE_IO_WORKERS = max(1, int(os.getenv("CODESHOW_IO_WORKERS", "8")))
+file_io_pool = None
+slot_encodings = {}            # file_path_var -> codifica del file letto (i salvataggi la conservano)
+TEXT_INSERT_CHUNK = 64 * 1024  # caratteri inseriti in una Text per tick
+pending_slot_loads = {}        # file_path_var -> (path, max_bytes) ancora da leggere, in ordine di arrivo
+slot_loads_inflight = {}       # file_path_var -> (Future, path) delle letture in corso sul pool di I/O
+slot_loads_total = 0           # slot accodati dall’ultima volta che la coda era vuota (barra di avanzamento)
+slot_loads_scheduled = False
+slot_loads_started = 0.0
+load_progress_frame = None
+load_progress_bar = None
+load_progress_label = None
+# Pannello "Prestazioni" (tempi degli span, vedi TRACCIAMENTO in codeshow.py); CODESHOW_TRACE=1
+# attiva il tracciamento dall’avvio.
+PERF_REFRESH_MS = 500
+perf_panel_body = None
+perf_panel_open = False
+perf_toggle_button = None
+perf_tree = None
+perf_status_label = None
+trace_var = None
+perf_seen_spans = None  # ultimo span mostrato: il pannello si ridisegna solo se ne arrivano di nuovi
+# Benchmark dell’avvio (bench/bench_suite.py --gui): CODESHOW_DIR evita il dialogo di scelta e
+# con CODESHOW_BENCH=1 l’app stampa i tempi dopo la prima scansione e si chiude.
+BENCH_STARTUP = os.getenv("CODESHOW_BENCH", "0") == "1"
+process_started = time.perf_counter()
+
 
 # ========================== FUNZIONI SUPPORTO FILE_SET ==========================
 
 def ensure_file_set_dir():
     """Assicura che esista la cartella <selected_dir>/file_set."""
     global file_set_dir
-    file_set_dir = os.path.join(selected_dir, "file_set")
+    file_set_dir = codeshow.file_set_dir_for(selected_dir)
     if not os.path.isdir(file_set_dir):
         try:
             os.makedirs(file_set_dir, exist_ok=True)
@@ -68,39 +163,16 @@ def ensure_file_set_dir():
                 "Errore", f"Impossibile creare la cartella file_set:\n{e}")
 
 
-def list_existing_file_sets():
-    """Ritorna lista di tuple (path_assoluto, N) dei file_set esistenti, ordinati per N crescente."""
+def list_file_set_entries():
+    """Voci dell’indice dei file_set (n, name, created, count), per N crescente."""
     if not os.path.isdir(file_set_dir):
         return []
-    result = []
-    for name in os.listdir(file_set_dir):
-        # pattern: file_set_tony_N.json
-        if name.startswith("file_set_tony_") and name.lower().endswith(".json"):
-            # rimuove prefisso e ".json"
-            middle = name[len("file_set_tony_"):-5]
-            try:
-                n = int(middle)
-                result.append((os.path.join(file_set_dir, name), n))
-            except ValueError:
-                continue
-    result.sort(key=lambda x: x[1])  # per N crescente
-    return result
-
-
-def get_next_fileset_index():
-    """Restituisce N successivo per il prossimo salvataggio (1 se nessuno esiste)."""
-    items = list_existing_file_sets()
-    if not items:
-        return 1
-    return items[-1][1] + 1
+    return codeshow.load_file_set_index(file_set_dir)["sets"]
 
 
 def get_latest_fileset_path():
     """Restituisce (path, N) dell’ultimo file_set, oppure (None, None) se non presente."""
-    items = list_existing_file_sets()
-    if not items:
-        return None, None
-    return items[-1]
+    return codeshow.latest_file_set(file_set_dir)
 
 
 def save_current_selection_as_fileset(selected_rel_paths):
@@ -108,16 +180,8 @@ def save_current_selection_as_fileset(selected_rel_paths):
     Salva l’insieme dei file selezionati (percorsi RELATIVI) in file_set/file_set_tony_N.json.
     """
     ensure_file_set_dir()
-    n = get_next_fileset_index()
-    out_path = os.path.join(file_set_dir, f"file_set_tony_{n}.json")
-    data = {
-        "base_dir": selected_dir,
-        "files": sorted(selected_rel_paths)
-    }
     try:
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return out_path, n
+        return codeshow.write_file_set(file_set_dir, selected_dir, selected_rel_paths, file_index)
     except Exception as e:
         messagebox.showerror(
             "Errore", f"Impossibile salvare il file_set:\n{e}")
@@ -127,23 +191,23 @@ def save_current_selection_as_fileset(selected_rel_paths):
 def load_fileset_from_path(path):
     """
     Carica un file_set da path, filtra i file che non esistono più e aggiorna selected_files.
+    I file cambiati dopo il salvataggio del set finiscono in fileset_drifted_files.
     """
-    global selected_files
+    global selected_files, fileset_drifted_files
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        rels = data.get("files", [])
-        # Tieni solo quelli che esistono ancora
-        filtered = []
-        for rel in rels:
-            abs_path = os.path.join(selected_dir, rel)
-            if os.path.isfile(abs_path):
-                filtered.append(rel)
+        # Tieni solo quelli che esistono ancora e confronta le impronte salvate (vedi check_file_set)
+        filtered, drifted, missing = codeshow.check_file_set(
+            selected_dir, codeshow.read_file_set_data(path), file_index)
         if not filtered:
             messagebox.showwarning(
                 "File set vuoto", "Nessuno dei file salvati esiste più.")
             return False
         selected_files = set(filtered)
+        fileset_drifted_files = drifted
+        reset_api_conversation()
+        if missing:
+            print(f"[WARN] {len(missing)} file del file_set non esistono più.")
+        report_fileset_drift(drifted)
         return True
     except Exception as e:
         messagebox.showerror(
@@ -151,214 +215,1282 @@ def load_fileset_from_path(path):
         return False
 
 
+def report_fileset_drift(drifted):
+    if drifted:
+        print(f"[WARN] {len(drifted)} file cambiati dopo il salvataggio del file_set: "
+              + ", ".join(drifted[:10]) + (" …" if len(drifted) > 10 else ""))
+
+
+def recheck_fileset_drift():
+    """
+    Dopo la scansione d’avvio: il file_set caricato automaticamente è stato confrontato con
+    l’indice della sessione precedente, ora si ripete il controllo con quello aggiornato.
+    """
+    global fileset_recheck_path, fileset_drifted_files
+    path, fileset_recheck_path = fileset_recheck_path, None
+    try:
+        _, drifted, _ = codeshow.check_file_set(selected_dir, codeshow.read_file_set_data(path), file_index)
+    except (OSError, ValueError):
+        return
+    new = [rel for rel in drifted if rel not in fileset_drifted_files]
+    fileset_drifted_files = drifted
+    report_fileset_drift(new)
+
+
 def maybe_autoload_latest_fileset():
     """
     Se esiste <selected_dir>/file_set con almeno un file_set, carica automaticamente l’ultimo.
+    Ritorna True se la selezione è stata presa da un file_set.
     """
+    global fileset_recheck_path
     ensure_file_set_dir()
     path, n = get_latest_fileset_path()
     if path:
         ok = load_fileset_from_path(path)
         if ok:
+            fileset_recheck_path = path
             print(
                 f"[INFO] Caricato automaticamente file_set più recente: file_set_tony_{n}.json")
-        else:
-            print(
-                "[WARN] Impossibile caricare automaticamente l’ultimo file_set; uso selezione completa.")
+            return True
+        print(
+            "[WARN] Impossibile caricare automaticamente l’ultimo file_set; uso selezione completa.")
     else:
         print("[INFO] Nessun file_set trovato; uso selezione completa.")
+    return False
+
+
+# ========================== INDICE FILE E CLASSIFICAZIONE ==========================
+# Scansione, classificazione e indice persistente sono in codeshow.py; qui lo stato della
+# directory scelta nella GUI.
+
+def cached_file_kind(rel_path):
+    """Tipo di un file già noto alla scansione o all’indice, altrimenti None (senza leggere il disco)."""
+    kind = file_kinds.get(rel_path)
+    if kind is not None:
+        return kind
+    if file_index:
+        entry = file_index["files"].get(to_index_key(rel_path))
+        if entry is not None and entry[3] is not None:
+            return entry[3]
+    return None
+
+
+def get_file_kind(rel_path):
+    """Tipo di un file della directory: dalla scansione se disponibile, altrimenti lo calcola."""
+    kind = cached_file_kind(rel_path)
+    if kind is not None:
+        return kind
+    return classify_file(os.path.join(selected_dir, rel_path))
+
+
+path_index = PathIndex()
+
+
+def get_cache_dir():
+    """Cartella cache del tool: <selected_dir>/.codeshow (accanto a file_set)."""
+    return codeshow.cache_dir_for(selected_dir)
+
+
+def load_file_index():
+    return codeshow.load_file_index(selected_dir)
+
+
+def save_file_index(index):
+    codeshow.save_file_index(selected_dir, index)
+
+
+def record_file_in_index(abs_path, digest, st):
+    """Aggiorna size/mtime/hash di un file appena letto (chiamata dal thread Tk)."""
+    if not file_index:
+        return
+    try:
+        rel = os.path.relpath(abs_path, selected_dir)
+    except ValueError:
+        return
+    if rel.startswith(".."):
+        return
+    key = to_index_key(rel)
+    old = file_index["files"].get(key)
+    kind = old[3] if old is not None and old[:2] == [st.st_size, st.st_mtime_ns] else None
+    file_index["files"][key] = [st.st_size, st.st_mtime_ns, digest, kind]
+
+
+# ========================== CODA UI E SCANSIONE IN BACKGROUND ==========================
+
+def post_to_ui(func, *args):
+    """Accoda una chiamata da eseguire sul thread Tk (sicuro da qualsiasi thread)."""
+    ui_queue.put((func, args))
+
+
+def process_ui_queue():
+    """Drena la coda UI entro un budget di tempo e si riprogramma con after()."""
+    deadline = time.perf_counter() + UI_QUEUE_BUDGET_S
+    while time.perf_counter() < deadline:
+        try:
+            func, args = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"[ERRORE] Callback UI fallita: {e}")
+    root.after(UI_QUEUE_POLL_MS, process_ui_queue)
+
+
+def start_background_scan():
+    """Avvia (o riavvia) la scansione di selected_dir su un thread di lavoro."""
+    global scan_in_progress, scan_stop_event
+    if scan_stop_event is not None:
+        scan_stop_event.set()
+    stop_event = threading.Event()
+    scan_stop_event = stop_event
+    scan_in_progress = True
+    all_files.clear()
+    file_kinds.clear()
+    path_index.clear()
+    base_dir = selected_dir
+
+    previous_index = file_index
+
+    def worker():
+        t0 = time.perf_counter()
+        try:
+            with span("scan") as sp:
+                new_index = scan_directory(
+                    base_dir, lambda batch, kinds: post_to_ui(_on_scan_batch, batch, kinds, stop_event),
+                    stop_event, index=previous_index)
+                if new_index is not None:
+                    sp.set(files=len(new_index["files"]), dirs_reread=new_index.get("reread_dirs", 0))
+        except Exception as e:
+            print(f"[ERRORE] Scansione directory fallita: {e}")
+            return
+        if new_index is None:
+            return
+        save_file_index(new_index)
+        post_to_ui(_on_scan_complete, new_index, time.perf_counter() - t0, stop_event)
+
+    threading.Thread(target=worker, name="codeshow-scan", daemon=True).start()
+
+
+def _on_scan_batch(batch, kinds, stop_event):
+    if stop_event is not scan_stop_event:
+        return  # lotto di una scansione superata
+    all_files.extend(batch)
+    file_kinds.update(kinds)
+    path_index.add(batch)
+    for listener in list(scan_listeners):
+        listener(batch, False)
+
+
+def _on_scan_complete(new_index, elapsed, stop_event):
+    global scan_in_progress, selected_files, file_index
+    if stop_event is not scan_stop_event:
+        return
+    # conserva gli hash calcolati dal thread Tk mentre la scansione era in corso
+    if file_index:
+        new_files = new_index["files"]
+        for key, entry in file_index["files"].items():
+            if entry[2] is None:
+                continue
+            current = new_files.get(key)
+            if current is not None and current[2] is None and current[:2] == entry[:2]:
+                current[2] = entry[2]
+    reread = new_index.pop("reread_dirs", 0)
+    file_index = new_index
+    scan_in_progress = False
+    print(f"[INFO] Scansione completata: {len(new_index['files'])} file in {elapsed:.2f}s "
+          f"({reread}/{len(new_index['dirs'])} directory rilette)")
+    if fileset_recheck_path:
+        recheck_fileset_drift()
+    if not selection_from_user:
+        # nessun file_set caricato e nessuna scelta manuale: tutti i file di testo
+        # (binari e generati restano fuori finché non vengono scelti esplicitamente)
+        selected_files = {rel for rel in all_files if rel not in file_kinds}
+        t0 = time.perf_counter()
+        rebuild_columns()
+        rebuild_s = time.perf_counter() - t0
+    else:
+        rebuild_s = None
+    for listener in list(scan_listeners):
+        listener([], True)
+    if BENCH_STARTUP:
+        root.after_idle(report_startup_bench, elapsed, rebuild_s)
+
+
+def report_startup_bench(scan_s, rebuild_s, interactive_s=None):
+    """
+    Solo con CODESHOW_BENCH=1: tempi dell’avvio su una riga JSON, poi chiude l’app.
+    interactive_s = finestra pronta dopo la scansione; loaded_s = tutti gli slot caricati.
+    """
+    root.update()
+    if interactive_s is None:
+        interactive_s = time.perf_counter() - process_started
+    if pending_slot_loads or slot_loads_inflight:
+        root.after(10, report_startup_bench, scan_s, rebuild_s, interactive_s)
+        return
+    print("[BENCH] " + json.dumps({
+        "startup_s": interactive_s, "loaded_s": time.perf_counter() - process_started, "scan_s": scan_s,
+        "rebuild_columns_s": rebuild_s, "files": len(all_files), "slots": len(columns),
+    }), flush=True)
+    on_close()
+
+
+# ========================== MONITORAGGIO MODIFICHE FILE ==========================
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+                 | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_inotify():
+    """Ritorna le funzioni inotify della libc (solo Linux), oppure None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """
+    Segnala i file aperti negli slot che cambiano su disco.
+    Usa inotify sulle directory dei file quando disponibile; i file che non si riesce a
+    osservare così vengono controllati con un poll a lotti di size/mtime.
+    on_change(set_di_path) viene chiamata dal thread del watcher con path normalizzati.
+    """
+
+    def __init__(self, on_change, mode=WATCH_MODE, poll_interval=WATCH_POLL_INTERVAL_S):
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._paths = {}       # path -> (size, mtime_ns) atteso
+        self._dir_wd = {}      # directory -> watch descriptor
+        self._wd_dir = {}
+        self._stop = threading.Event()
+        self._libc = _load_inotify() if mode in ("auto", "inotify") else None
+        self._fd = -1
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(_IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+        self._thread = None
+
+    @property
+    def uses_inotify(self):
+        return self._fd >= 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="codeshow-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def watch(self, path, stat):
+        path = os.path.normpath(path)
+        with self._lock:
+            self._paths[path] = stat
+        self._ensure_dir_watch(os.path.dirname(path))
+
+    def set_paths(self, mapping):
+        """Sostituisce l’insieme osservato con {path: (size, mtime_ns)}."""
+        mapping = {os.path.normpath(p): st for p, st in mapping.items()}
+        with self._lock:
+            self._paths = mapping
+        wanted = {os.path.dirname(p) for p in mapping}
+        for d in wanted:
+            self._ensure_dir_watch(d)
+        if self.uses_inotify:
+            with self._lock:
+                unused = [(d, wd) for d, wd in self._dir_wd.items() if d not in wanted]
+                for d, wd in unused:
+                    del self._dir_wd[d]
+                    self._wd_dir.pop(wd, None)
+            for _, wd in unused:
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _ensure_dir_watch(self, directory):
+        if not self.uses_inotify:
+            return
+        with self._lock:
+            if directory in self._dir_wd:
+                return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _INOTIFY_MASK)
+        if wd < 0:
+            return  # es. limite di watch raggiunto: questi file restano nel poll
+        with self._lock:
+            self._dir_wd[directory] = wd
+            self._wd_dir[wd] = directory
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError:
+            return set()
+        changed = set()
+        offset = 0
+        with self._lock:
+            while offset + _INOTIFY_EVENT.size <= len(data):
+                wd, _mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                directory = self._wd_dir.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if path in self._paths:
+                    changed.add(path)
+        return changed
+
+    def _poll(self):
+        """Poll a lotti: stat solo dei file non coperti da inotify."""
+        with self._lock:
+            items = [(p, st) for p, st in self._paths.items()
+                     if os.path.dirname(p) not in self._dir_wd]
+        changed = set()
+        for path, expected in items:
+            try:
+                st = os.stat(path)
+                current = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                current = None
+            if current != expected:
+                changed.add(path)
+                with self._lock:
+                    if path in self._paths:
+                        self._paths[path] = current  # notifica una sola volta per modifica
+        return changed
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            changed = set()
+            timeout = max(0.0, next_poll - time.monotonic())
+            if self.uses_inotify:
+                ready, _, _ = select.select([self._fd], [], [], timeout)
+                if ready:
+                    changed |= self._read_events()
+                    # raggruppa le raffiche di eventi di un singolo salvataggio
+                    time.sleep(WATCH_COALESCE_S)
+                    while select.select([self._fd], [], [], 0)[0]:
+                        changed |= self._read_events()
+            else:
+                self._stop.wait(timeout)
+            if time.monotonic() >= next_poll:
+                changed |= self._poll()
+                next_poll = time.monotonic() + self.poll_interval
+            if changed:
+                self.on_change(changed)
+
+
+def start_file_watcher():
+    """Avvia il watcher; le notifiche vengono riportate sul thread Tk."""
+    global file_watcher
+    if WATCH_MODE == "off":
+        return
+    file_watcher = FileWatcher(lambda paths: post_to_ui(on_files_changed, paths))
+    file_watcher.start()
+    mode = "inotify" if file_watcher.uses_inotify else f"poll ogni {WATCH_POLL_INTERVAL_S}s"
+    print(f"[INFO] Monitoraggio modifiche file attivo ({mode}).")
+
+
+def sync_watched_files():
+    """Allinea l’insieme osservato agli slot aperti."""
+    if file_watcher is None:
+        return
+    file_watcher.set_paths({file_paths[slot["id"]]: slot_file_stats[slot["id"]]
+                            for slot in columns
+                            if slot["id"] in file_paths and slot["id"] in slot_file_stats})
+
+
+def forget_slot_state(file_path_var):
+    """Dimentica path, stat e stato stale/troncato di uno slot rimosso."""
+    cancel_slot_load(file_path_var)
+    file_paths.pop(file_path_var, None)
+    slot_file_stats.pop(file_path_var, None)
+    stale_files.discard(file_path_var)
+    truncated_files.pop(file_path_var, None)
+    full_content_slots.discard(file_path_var)
+    binary_slots.discard(file_path_var)
+    slot_encodings.pop(file_path_var, None)
+    slot_saved_hashes.pop(file_path_var, None)
+    dirty_slots.discard(file_path_var)
+
+
+def _remember_loaded_stat(file_path_var, file_path, st):
+    """Registra la stat del file appena letto nello slot e la passa al watcher."""
+    stat = (st.st_size, st.st_mtime_ns)
+    slot_file_stats[file_path_var] = stat
+    stale_files.discard(file_path_var)
+    if file_watcher is not None:
+        file_watcher.watch(file_path, stat)
+
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def mark_slot_stale(file_path_var):
+    """Evidenzia lo slot e abilita il suo "Refresh Slot"."""
+    stale_files.add(file_path_var)
+    slot = slots_by_id.get(file_path_var)
+    if slot is not None and slot["widget"] is not None:
+        _apply_slot_state(slot["widget"], slot)
+
+
+def check_slots_for_changes(paths=None):
+    """
+    Confronta size/mtime dei file degli slot (tutti, o solo quelli in `paths`) con quelli
+    registrati al caricamento e marca come stale gli slot cambiati. Ritorna quanti sono.
+    """
+    marked = 0
+    for var, file_path in list(file_paths.items()):
+        if paths is not None and os.path.normpath(file_path) not in paths:
+            continue
+        if var in stale_files:
+            continue
+        if _stat_signature(file_path) != slot_file_stats.get(var):
+            mark_slot_stale(var)
+            marked += 1
+    return marked
+
+
+def on_files_changed(paths):
+    """Notifica del watcher (thread Tk): ricontrolla solo i file segnalati."""
+    marked = check_slots_for_changes(paths)
+    if marked:
+        print(f"[INFO] {marked} slot modificati su disco: usa Refresh Slot o Ricarica Tutti.")
 
 
 # ========================== FUNZIONI DI GESTIONE FILE ==========================
 
+
 def update_truncated_files_label():
     global truncated_files_label
     if truncated_files_label:
-        truncated_files_label.config(text="")
+        if not truncated_files:
+            truncated_files_label.config(text="")
+            return
+        parts = []
+        for file_path_var, info in list(truncated_files.items())[:5]:
+            slot = slots_by_id.get(file_path_var)
+            name = slot["name"] if slot is not None else file_path_var
+            parts.append(f"{name} ({format_size(info['size'])})")
+        more = len(truncated_files) - len(parts)
+        if more > 0:
+            parts.append(f"e altri {more}")
+        truncated_files_label.config(
+            text=f"File mostrati solo in anteprima (oltre {format_size(MAX_FILE_BYTES)}): "
+                 + ", ".join(parts))
+
+
+def _set_truncation(file_path_var, info):
+    if info is None:
+        truncated_files.pop(file_path_var, None)
+    else:
+        truncated_files[file_path_var] = info
 
 
-def upload_file(entry, text_widget, file_path_var, file_path=None, refresh_button=None):
-    global file_paths, truncated_files
+@traced("upload_file")
+def upload_file(slot, file_path=None, max_bytes=None):
+    """Carica il file nello slot: la lettura avviene sul pool di I/O (vedi queue_slot_load)."""
     if not file_path:
         return
-    file_paths[file_path_var] = file_path
-    rel_path = os.path.relpath(file_path, selected_dir)
-    entry.delete(0, tk.END)
-    entry.insert(0, rel_path)
+    queue_slot_load(slot, file_path, max_bytes)
+
 
+def load_full_file(slot):
+    """Carica il contenuto completo di uno slot mostrato in anteprima (ignora il budget)."""
+    full_content_slots.add(slot["id"])
+    upload_file(slot, file_paths.get(slot["id"]), max_bytes=0)
+
+
+def disk_conflict(path, loaded_stat, saved_hash):
+    """
+    Motivo del conflitto se il file è cambiato su disco dopo il caricamento (o l’ultimo
+    salvataggio), altrimenti None. Se size/mtime sono cambiati si confronta l’hash del
+    contenuto: un file solo "toccato" non è un conflitto. Sicura da qualsiasi thread.
+    """
+    signature = _stat_signature(path)
+    if signature == loaded_stat:
+        return None
+    if signature is None:
+        return "eliminato dal disco"
     try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
-            lines = file.readlines()
-        content = "".join(lines)
-        text_widget.configure(bg=TEXT_BG)
-        if file_path_var in truncated_files:
-            del truncated_files[file_path_var]
-        if refresh_button:
-            refresh_button.config(state="disabled")
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError as e:
+        return str(e)
+    if compute_content_hash(decode_text(data).encode("utf-8")) == saved_hash:
+        return None
+    return "modificato su disco dopo il caricamento"
+
+
+def update_slot_dirty(slot):
+    """Stato "non salvato" dello slot: hash del contenuto diverso da quello su disco."""
+    file_path_var = slot["id"]
+    saved = slot_saved_hashes.get(file_path_var)
+    if file_path_var in file_paths and saved is not None and get_slot_hash(slot) != saved:
+        dirty_slots.add(file_path_var)
+    else:
+        dirty_slots.discard(file_path_var)
+    update_save_all_button()
+    return file_path_var in dirty_slots
+
+
+def mark_slot_saved(slot, content_hash, st=None):
+    """Registra come contenuto su disco quello con hash `content_hash` (e la stat del file scritto)."""
+    file_path_var = slot["id"]
+    slot_saved_hashes[file_path_var] = content_hash
+    if st is not None:
+        # il salvataggio non deve far risultare lo slot "modificato su disco"
+        file_path = file_paths[file_path_var]
+        _remember_loaded_stat(file_path_var, file_path, st)
+        record_file_in_index(file_path, None, st)
+    update_slot_dirty(slot)
+    if slot["widget"] is not None:
+        _apply_slot_state(slot["widget"], slot)
+
+
+def on_slot_text_modified(widget):
+    """<<Modified>> della Text: lo slot diventa "non salvato" senza rileggere il testo a ogni tasto."""
+    slot = widget["slot"]
+    if slot is None or not widget["text"].edit_modified():
+        return
+    if slot["id"] in file_paths and slot["id"] not in dirty_slots:
+        dirty_slots.add(slot["id"])
+        _update_column_label(widget)
+        update_save_all_button()
 
-        text_widget.delete("1.0", tk.END)
-        text_widget.insert("1.0", content)
-        update_truncated_files_label()
-    except Exception as e:
-        print(f"[ERRORE] Impossibile leggere il file: {e}")
 
+def update_save_all_button():
+    if save_all_button is not None:
+        count = len(dirty_slots)
+        save_all_button.config(text=f"Salva Tutti ({count})" if count else "Salva Tutti")
 
-def save_file(text_widget, file_path_var):
+
+def save_file(slot):
     global file_paths
+    file_path_var = slot["id"]
     file_path = file_paths.get(file_path_var)
+    finish_slot_load(file_path_var)  # mai salvare uno slot ancora vuoto sopra il file
+    if file_path and file_path_var in binary_slots:
+        messagebox.showwarning(
+            "File binario", "Lo slot mostra un segnaposto per un file binario: non può essere salvato.")
+        return
+    if file_path and file_path_var in truncated_files:
+        messagebox.showwarning(
+            "File in anteprima",
+            "Lo slot contiene solo un’anteprima del file: salvarlo lo troncherebbe.\n"
+            "Usa \"Completo\" per caricare il contenuto intero prima di salvare.")
+        return
     if file_path:
         try:
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(text_widget.get("1.0", tk.END))
+            content = get_slot_content(slot)
+            conflict = disk_conflict(file_path, slot_file_stats.get(file_path_var),
+                                     slot_saved_hashes.get(file_path_var))
+            if conflict and not messagebox.askyesno(
+                    "Conflitto", f"{get_slot_name(slot)}: {conflict}.\n\nSovrascrivere con il contenuto dello slot?"):
+                return
+            # il contenuto è scritto così com’è (Text.get "end-1c" non aggiunge newline)
+            st = write_file_atomic(file_path, content, slot_save_encoding(file_path_var, content))
+            mark_slot_saved(slot, get_slot_hash(slot), st)
             print(f"[INFO] File salvato in: {file_path}")
         except Exception as e:
             print(f"[ERRORE] Impossibile salvare il file: {e}")
 
 
-def refresh_single(file_path_var, entry, text_widget, refresh_button):
+def slot_save_encoding(file_path_var, content):
+    """Codifica in cui salvare lo slot: quella del file letto, o UTF-8 se il testo non vi è rappresentabile."""
+    encoding = slot_encodings.get(file_path_var, "utf-8")
+    if encoding in ("utf-8", "utf-8-sig", "utf-16", "utf-32"):
+        return encoding
+    try:
+        content.encode(encoding)
+    except UnicodeEncodeError:
+        print(f"[WARN] {file_paths.get(file_path_var)}: il testo non è rappresentabile in {encoding}, "
+              "salvo in UTF-8.")
+        encoding = slot_encodings[file_path_var] = "utf-8"
+    return encoding
+
+
+def _save_job(slot):
+    """Istantanea (thread Tk) di quanto serve per salvare lo slot da un thread di lavoro."""
+    file_path_var = slot["id"]
+    content = get_slot_content(slot)
+    return {"id": file_path_var, "name": get_slot_name(slot), "path": file_paths[file_path_var],
+            "content": content, "hash": get_slot_hash(slot),
+            "encoding": slot_save_encoding(file_path_var, content),
+            "stat": slot_file_stats.get(file_path_var), "saved_hash": slot_saved_hashes.get(file_path_var)}
+
+
+def _run_save_job(job, force):
+    """Thread di lavoro: controllo conflitti e scrittura atomica. Ritorna (job, esito, stat o motivo)."""
+    if not force:
+        conflict = disk_conflict(job["path"], job["stat"], job["saved_hash"])
+        if conflict:
+            return job, "conflict", conflict
+    try:
+        return job, "saved", write_file_atomic(job["path"], job["content"], job["encoding"])
+    except OSError as e:
+        return job, "error", str(e)
+
+
+def _save_all_worker(jobs, force):
+    with ThreadPoolExecutor(max_workers=min(SAVE_WORKERS, len(jobs))) as pool:
+        results = list(pool.map(lambda job: _run_save_job(job, force), jobs))
+    post_to_ui(_on_save_all_done, results)
+
+
+def start_save_jobs(jobs, force=False):
+    global save_in_progress
+    save_in_progress = True
+    if save_all_button is not None:
+        save_all_button.config(state="disabled")
+    threading.Thread(target=_save_all_worker, args=(jobs, force),
+                     name="codeshow-save", daemon=True).start()
+
+
+def save_all_files():
+    """
+    "Salva Tutti": scrive in parallelo solo gli slot con modifiche non salvate, con scrittura
+    atomica. I file cambiati su disco dopo il caricamento non vengono sovrascritti senza conferma.
+    """
+    if save_in_progress:
+        return
+    jobs = []
+    previews = []
+    for slot in columns:
+        file_path_var = slot["id"]
+        if file_path_var not in file_paths or file_path_var in binary_slots:
+            continue
+        if not update_slot_dirty(slot):
+            continue
+        if file_path_var in truncated_files:
+            previews.append(get_slot_name(slot))
+            continue
+        jobs.append(_save_job(slot))
+    if previews:
+        print(f"[WARN] Non salvati (solo anteprima caricata): {', '.join(previews)}")
+    if not jobs:
+        print("[INFO] Salva Tutti: nessuno slot modificato.")
+        return
+    print(f"[INFO] Salva Tutti: {len(jobs)} slot modificati...")
+    start_save_jobs(jobs)
+
+
+def _on_save_all_done(results):
+    global save_in_progress
+    save_in_progress = False
+    if save_all_button is not None:
+        save_all_button.config(state="normal")
+    saved = 0
+    conflicts = []
+    errors = []
+    for job, status, info in results:
+        slot = slots_by_id.get(job["id"])
+        if status == "saved":
+            saved += 1
+            if slot is not None and file_paths.get(job["id"]) == job["path"]:
+                mark_slot_saved(slot, job["hash"], info)
+            print(f"[INFO] File salvato in: {job['path']}")
+        elif status == "conflict":
+            conflicts.append((job, slot, info))
+        else:
+            errors.append(f"{job['name']}: {info}")
+    print(f"[INFO] Salva Tutti: {saved} salvati, {len(conflicts)} in conflitto, {len(errors)} errori.")
+    if errors:
+        messagebox.showerror("Salva Tutti", "Impossibile salvare:\n" + "\n".join(errors[:10]))
+    if not conflicts:
+        return
+    names = "\n".join(f"{job['name']} ({reason})" for job, _, reason in conflicts[:10])
+    if len(conflicts) > 10:
+        names += f"\n… e altri {len(conflicts) - 10}"
+    if messagebox.askyesno(
+            "Conflitti",
+            f"{len(conflicts)} file sono cambiati su disco dopo il caricamento:\n{names}\n\n"
+            "Sovrascriverli con il contenuto degli slot?\n(No = lasciali su disco; usa Refresh Slot per ricaricarli)"):
+        jobs = [_save_job(slot) for _, slot, _ in conflicts
+                if slot is not None and slot["id"] in file_paths]
+        if jobs:
+            start_save_jobs(jobs, force=True)
+    else:
+        for _, slot, _ in conflicts:
+            if slot is not None:
+                mark_slot_stale(slot["id"])
+
+
+@traced("refresh_single")
+def refresh_single(slot):
     global file_paths, truncated_files
+    file_path_var = slot["id"]
     file_path = file_paths.get(file_path_var)
     if not file_path:
         return
-    try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
-            content = file.read()
-        rel_path = os.path.relpath(file_path, selected_dir)
-        entry.delete(0, tk.END)
-        entry.insert(0, rel_path)
-        text_widget.delete("1.0", tk.END)
-        text_widget.insert("1.0", content)
-        text_widget.configure(bg=TEXT_BG)
-        refresh_button.config(state="disabled")
-        if file_path_var in truncated_files:
-            del truncated_files[file_path_var]
-        update_truncated_files_label()
-    except Exception as e:
-        print(f"[ERRORE] Impossibile ricaricare il file {file_path}: {e}")
+    # uno slot caricato per intero su richiesta resta completo anche dopo il refresh
+    max_bytes = 0 if file_path_var in full_content_slots else None
+    queue_slot_load(slot, file_path, max_bytes)
+
+
+# ========================== MODELLO SLOT ==========================
+# Ogni slot è un dict {"id", "name", "content", "hash", "widget"} in `columns` (ordine delle colonne);
+# "hash" è l’hash del contenuto, calcolato a richiesta e azzerato a ogni modifica.
+# Il contenuto vive nel modello; i widget Tk esistono solo per gli slot visibili
+# (vedi VISTA COLONNE VIRTUALIZZATA) e "widget" punta alla colonna che lo mostra, se c'è.
+
+def new_slot():
+    global slot_seq
+    # id stabile dello slot: non si ripete dopo rimozioni (chiave di file_paths & co.)
+    slot_seq += 1
+    slot = make_slot(f"file{slot_seq}")
+    slots_by_id[slot["id"]] = slot
+    return slot
+
+
+def set_slot_name(slot, name):
+    slot["name"] = name
+    widget = slot["widget"]
+    if widget is not None:
+        widget["entry"].delete(0, tk.END)
+        widget["entry"].insert(0, name)
+
+
+def set_slot_content(slot, content):
+    slot["content"] = content
+    slot["hash"] = None
+    update_slot_dirty(slot)
+    widget = slot["widget"]
+    if widget is not None:
+        _fill_text_widget(widget, content)
+        _apply_slot_state(widget, slot)
 
 
 # ========================== GESTIONE COLONNE ==========================
 
 def add_column(default_path=None):
+    """Aggiunge uno slot al modello (i widget vengono creati solo se visibile)."""
     global columns
     if len(columns) >= MAX_COLUMNS:
+        return None
+    slot = new_slot()
+    columns.append(slot)
+    if default_path:
+        queue_slot_load(slot, default_path)
+    schedule_column_view_update()
+    return slot
+
+
+def drop_slot(slot):
+    """Toglie uno slot dal modello: restituisce il widget al pool e ne dimentica lo stato."""
+    release_column_widget(slot)
+    slots_by_id.pop(slot["id"], None)
+    forget_slot_state(slot["id"])
+
+
+def remove_column(slot):
+    global columns
+    if slot in columns:
+        columns.remove(slot)
+        drop_slot(slot)
+    update_truncated_files_label()
+    sync_watched_files()
+    schedule_column_view_update()
+
+
+def clear_slots():
+    """Svuota il modello rilasciando i widget (che restano nel pool per il riuso)."""
+    for slot in columns:
+        drop_slot(slot)
+    columns.clear()
+
+
+# ========================== CARICAMENTO PROGRESSIVO DEGLI SLOT ==========================
+# Avvio, rebuild_columns, Upload e Refresh accodano gli slot da leggere invece di leggerli sul
+# thread Tk: le letture (classificazione, lettura, decodifica) girano sul pool di I/O con al
+# massimo FILE_IO_WORKERS file contemporanei, prima gli slot visibili, e i contenuti tornano al
+# thread Tk via post_to_ui. Uno slot in coda ha il nome ma non ancora il contenuto: prompt,
+# invio, salvataggio e applicazione delle risposte completano prima la coda (flush_slot_loads).
+
+def get_file_io_pool():
+    global file_io_pool
+    if file_io_pool is None:
+        file_io_pool = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS, thread_name_prefix="codeshow-io")
+    return file_io_pool
+
+
+def read_slot_job(file_path, kind, max_bytes):
+    """Thread di I/O: classifica il file se serve, lo legge e lo decodifica. Non tocca lo stato Tk."""
+    if kind is None:
+        kind = classify_file(file_path)
+    return (kind,) + codeshow.read_slot_file(file_path, kind, max_bytes)
+
+
+def queue_slot_load(slot, file_path, max_bytes=None):
+    global slot_loads_total, slot_loads_started
+    file_path_var = slot["id"]
+    file_paths[file_path_var] = file_path
+    set_slot_name(slot, os.path.relpath(file_path, selected_dir))
+    if not pending_slot_loads and not slot_loads_inflight:
+        slot_loads_total = 0
+        slot_loads_started = time.perf_counter()
+    if file_path_var not in pending_slot_loads and file_path_var not in slot_loads_inflight:
+        slot_loads_total += 1
+    slot_loads_inflight.pop(file_path_var, None)  # una lettura già avviata è superata da questa
+    pending_slot_loads[file_path_var] = (file_path, max_bytes)
+    if slot["widget"] is not None:
+        _apply_slot_state(slot["widget"], slot)
+    schedule_slot_loads()
+
+
+def schedule_slot_loads():
+    global slot_loads_scheduled
+    if not slot_loads_scheduled:
+        slot_loads_scheduled = True
+        root.after(1, process_slot_loads)
+
+
+def _next_pending_slots(limit):
+    """Fino a `limit` id in coda: prima quelli nella parte visibile, poi gli altri in ordine di arrivo."""
+    first, last = visible_column_range()
+    visible = [slot["id"] for slot in columns[first:last] if slot["id"] in pending_slot_loads]
+    rest = (slot_id for slot_id in pending_slot_loads if slot_id not in visible)
+    return list(itertools.islice(itertools.chain(visible, rest), limit))
+
+
+def _submit_slot_read(file_path_var):
+    """Passa al pool di I/O la lettura di uno slot in coda; il risultato arriva a _finish_slot_read."""
+    file_path, max_bytes = pending_slot_loads.pop(file_path_var)
+    if file_path_var not in slots_by_id:
+        return  # slot rimosso mentre era in coda
+    kind = cached_file_kind(os.path.relpath(file_path, selected_dir))
+    future = get_file_io_pool().submit(read_slot_job, file_path, kind, max_bytes)
+    slot_loads_inflight[file_path_var] = (future, file_path)
+    future.add_done_callback(lambda done: post_to_ui(_finish_slot_read, file_path_var, done))
+
+
+def _apply_slot_read(file_path_var, file_path, future):
+    """Thread Tk: porta nello slot il risultato di una lettura (attendendola se non è finita)."""
+    slot = slots_by_id.get(file_path_var)
+    if slot is None:
+        return
+    try:
+        kind, content, st, truncation, digest, encoding = future.result()
+    except Exception as e:
+        print(f"[ERRORE] Impossibile leggere il file {file_path}: {e}")
+        if slot["widget"] is not None:
+            _apply_slot_state(slot["widget"], slot)
+        return
+    # I file binari non vengono decodificati: lo slot mostra un segnaposto e nel prompt
+    # compare solo il nome.
+    if kind == FILE_KIND_BINARY:
+        binary_slots.add(file_path_var)
+        slot_encodings.pop(file_path_var, None)
+    else:
+        binary_slots.discard(file_path_var)
+        slot_encodings[file_path_var] = encoding
+        record_file_in_index(file_path, digest, st)
+    _remember_loaded_stat(file_path_var, file_path, st)
+    _set_truncation(file_path_var, truncation)
+    slot_saved_hashes.pop(file_path_var, None)
+    set_slot_content(slot, content)
+    mark_slot_saved(slot, get_slot_hash(slot))
+
+
+def _finish_slot_read(file_path_var, future):
+    entry = slot_loads_inflight.get(file_path_var)
+    if entry is None or entry[0] is not future:
+        return  # lettura superata: slot riaccodato, rimosso o già completato da flush_slot_loads
+    del slot_loads_inflight[file_path_var]
+    with span("slot_load_apply"):
+        _apply_slot_read(file_path_var, entry[1], future)
+    _slot_loads_progressed()
+
+
+def process_slot_loads():
+    """Avvia letture finché il pool ha posti liberi (al massimo due per worker in attesa)."""
+    global slot_loads_scheduled
+    slot_loads_scheduled = False
+    if not pending_slot_loads:
+        return  # coda già svuotata (flush_slot_loads) dopo la pianificazione
+    free = FILE_IO_WORKERS * 2 - len(slot_loads_inflight)
+    if free > 0:
+        for file_path_var in _next_pending_slots(free):
+            _submit_slot_read(file_path_var)
+    _slot_loads_progressed()
+
+
+def _slot_loads_progressed():
+    update_load_progress()
+    if pending_slot_loads:
+        schedule_slot_loads()
+    elif not slot_loads_inflight:
+        _on_slot_loads_done()
+
+
+def finish_slot_load(file_path_var):
+    """Completa subito il caricamento di uno slot in coda o in lettura (attende il pool di I/O)."""
+    if file_path_var not in pending_slot_loads and file_path_var not in slot_loads_inflight:
         return
-    column_index = len(columns) + 1
-    frame = ttk.Frame(main_frame, padding="5", relief="sunken")
-    frame.grid(row=0, column=column_index - 1, sticky=(tk.W, tk.E, tk.N, tk.S))
+    if file_path_var in pending_slot_loads:
+        _submit_slot_read(file_path_var)
+    entry = slot_loads_inflight.pop(file_path_var, None)
+    if entry is not None:
+        _apply_slot_read(file_path_var, entry[1], entry[0])
+    _slot_loads_progressed()
 
-    file_label = ttk.Label(frame, text=f"Nome file {column_index}:")
-    file_label.pack(anchor="w")
 
-    entry = ttk.Entry(frame, width=40)
-    entry.pack(side="top", fill="x", expand=True)
+def flush_slot_loads():
+    """Legge subito (in parallelo sul pool di I/O) tutti gli slot ancora in coda o in lettura."""
+    if not pending_slot_loads and not slot_loads_inflight:
+        return
+    with span("slot_load_flush") as sp:
+        for file_path_var in list(pending_slot_loads):
+            _submit_slot_read(file_path_var)
+        sp.set(files=len(slot_loads_inflight))
+        while slot_loads_inflight:
+            file_path_var = next(iter(slot_loads_inflight))
+            future, file_path = slot_loads_inflight.pop(file_path_var)
+            _apply_slot_read(file_path_var, file_path, future)
+    _slot_loads_progressed()
 
-    text_area = tk.Text(frame, wrap="none", width=40, height=COLUMN_TEXT_HEIGHT,
-                        bg=TEXT_BG, fg=FG_TEXT, insertbackground=FG_TEXT,
-                        selectbackground=TEXT_SELECT, selectforeground=FG_TEXT,
-                        relief="flat", borderwidth=1, highlightthickness=1,
-                        highlightbackground=BORDER_COLOR, highlightcolor=ACCENT_BLUE,
-                        font=('Consolas', 10))
-    text_area.pack(fill="both", expand=True)
 
-    button_frame = ttk.Frame(frame)
-    button_frame.pack(side="top", fill="x", pady=5)
+def slot_load_pending(file_path_var):
+    return file_path_var in pending_slot_loads or file_path_var in slot_loads_inflight
 
-    refresh_button = ttk.Button(frame, text="dummy")
 
-    upload_button = ttk.Button(
-        button_frame,
-        text="Upload",
-        command=lambda e=entry, t=text_area, f=f"file{column_index}": upload_file(
-            e, t, f, default_path, refresh_button)
-    )
-    upload_button.pack(side="left", padx=5)
+def cancel_slot_load(file_path_var):
+    pending_slot_loads.pop(file_path_var, None)
+    slot_loads_inflight.pop(file_path_var, None)
+    if not pending_slot_loads and not slot_loads_inflight:
+        update_load_progress()
 
-    save_button = ttk.Button(
-        button_frame, text="Salva",
-        command=lambda t=text_area, f=f"file{column_index}": save_file(t, f)
-    )
-    save_button.pack(side="left", padx=5)
 
-    remove_button = ttk.Button(
-        button_frame, text="×",
-        command=lambda f=frame: remove_column(f)
-    )
-    remove_button.pack(side="left", padx=5)
+def _on_slot_loads_done():
+    print(f"[INFO] Caricati {slot_loads_total} slot in {time.perf_counter() - slot_loads_started:.2f}s.")
+    update_truncated_files_label()
+    sync_watched_files()
+
+
+def update_load_progress():
+    """Barra di avanzamento globale: visibile solo mentre ci sono slot in coda o in lettura."""
+    if load_progress_bar is None:
+        return
+    remaining = len(pending_slot_loads) + len(slot_loads_inflight)
+    if not remaining:
+        load_progress_frame.pack_forget()
+        return
+    done = slot_loads_total - remaining
+    load_progress_bar.configure(maximum=max(slot_loads_total, 1), value=done)
+    load_progress_label.config(text=f"Caricamento file {done}/{slot_loads_total}")
+    if not load_progress_frame.winfo_manager():
+        load_progress_frame.pack(side="left", padx=5)
 
-    refresh_button = ttk.Button(
-        button_frame, text="Refresh Slot", state="disabled"
+
+# ========================== VISTA COLONNE VIRTUALIZZATA ==========================
+# Solo le colonne nel viewport del canvas (più COLUMN_OVERSCAN per lato) hanno widget;
+# le colonne che escono dalla vista restituiscono i widget al pool e vengono riciclate.
+
+def _fill_text_widget(widget, content):
+    """
+    Mostra `content` nella Text della colonna. Oltre TEXT_INSERT_CHUNK caratteri inserisce solo
+    il primo pezzo e accoda il resto (_continue_text_fill); fino alla fine la Text non è modificabile.
+    """
+    text_widget = widget["text"]
+    token = widget["fill_token"] = object()  # un nuovo riempimento annulla quello in corso
+    with span("text_insert", chars=min(len(content), TEXT_INSERT_CHUNK)):
+        text_widget.configure(state="normal")
+        text_widget.delete("1.0", tk.END)
+        text_widget.insert("1.0", content[:TEXT_INSERT_CHUNK])
+        text_widget.edit_modified(False)
+    if len(content) > TEXT_INSERT_CHUNK:
+        widget["fill_progress"] = TEXT_INSERT_CHUNK / len(content)
+        text_widget.configure(state="disabled")
+        root.after(1, _continue_text_fill, widget, token, content, TEXT_INSERT_CHUNK)
+    else:
+        widget["fill_progress"] = None
+
+
+def _continue_text_fill(widget, token, content, pos):
+    if widget["fill_token"] is not token:
+        return  # la colonna mostra ormai un altro contenuto
+    text_widget = widget["text"]
+    end = pos + TEXT_INSERT_CHUNK
+    with span("text_insert", chars=len(content[pos:end])):
+        text_widget.configure(state="normal")
+        text_widget.insert("end-1c", content[pos:end])
+        text_widget.edit_modified(False)
+    if end < len(content):
+        widget["fill_progress"] = end / len(content)
+        text_widget.configure(state="disabled")
+        root.after(1, _continue_text_fill, widget, token, content, end)
+    else:
+        widget["fill_progress"] = None
+        widget["fill_token"] = None
+    _update_column_label(widget)
+
+
+def _update_column_label(widget):
+    """Etichetta della colonna: posizione dello slot e segno delle modifiche non salvate."""
+    if widget["index"] is None or widget["slot"] is None:
+        return
+    slot_id = widget["slot"]["id"]
+    state = ""
+    if slot_load_pending(slot_id):
+        state = "  ⏳ in caricamento"
+    elif widget["fill_progress"] is not None:
+        state = f"  ⏳ {widget['fill_progress']:.0%}"
+    elif slot_id in dirty_slots:
+        state = "  ● non salvato"
+    widget["label"].config(text=f"Nome file {widget['index'] + 1}:" + state)
+
+
+def _apply_slot_state(widget, slot):
+    """Colore di sfondo e stato di "Refresh Slot"/"Completo" secondo lo stato dello slot."""
+    _update_column_label(widget)
+    if slot_load_pending(slot["id"]):
+        widget["text"].configure(state="disabled")  # niente testo digitato prima del contenuto
+    elif widget["fill_progress"] is None:
+        widget["text"].configure(state="normal")
+    stale = slot["id"] in stale_files
+    widget["text"].configure(bg=TEXT_BG_STALE if stale else TEXT_BG)
+    widget["refresh_button"].config(state="normal" if stale else "disabled")
+    widget["full_button"].config(
+        state="normal" if slot["id"] in truncated_files else "disabled")
+
+
+def create_column_widget():
+    """Crea una colonna (frame, entry, text, pulsanti) non ancora associata a uno slot."""
+    frame = ttk.Frame(canvas, padding="5", relief="sunken")
+    widget = {"frame": frame, "slot": None, "index": None, "fill_token": None, "fill_progress": None}
+
+    def bound_slot_call(func):
+        # i pulsanti agiscono sullo slot mostrato in quel momento dalla colonna riciclata
+        def command():
+            if widget["slot"] is not None:
+                func(widget["slot"])
+        return command
+
+    widget["label"] = ttk.Label(frame, text="")
+    widget["label"].pack(anchor="w")
+
+    widget["entry"] = ttk.Entry(frame, width=40)
+    widget["entry"].pack(side="top", fill="x")
+
+    button_frame = ttk.Frame(frame)
+    button_frame.pack(side="bottom", fill="x", pady=5)
+
+    widget["text"] = tk.Text(frame, wrap="none", width=40, height=COLUMN_TEXT_HEIGHT,
+                             bg=TEXT_BG, fg=FG_TEXT, insertbackground=FG_TEXT,
+                             selectbackground=TEXT_SELECT, selectforeground=FG_TEXT,
+                             relief="flat", borderwidth=1, highlightthickness=1,
+                             highlightbackground=BORDER_COLOR, highlightcolor=ACCENT_BLUE,
+                             font=('Consolas', 10))
+    widget["text"].pack(fill="both", expand=True)
+    widget["text"].bind("<<Modified>>", lambda e: on_slot_text_modified(widget))
+
+    ttk.Button(
+        button_frame, text="Upload",
+        command=bound_slot_call(lambda s: upload_file(s, file_paths.get(s["id"])))
+    ).pack(side="left", padx=5)
+    ttk.Button(
+        button_frame, text="Salva", command=bound_slot_call(save_file)
+    ).pack(side="left", padx=5)
+    ttk.Button(
+        button_frame, text="×", command=bound_slot_call(remove_column)
+    ).pack(side="left", padx=5)
+    widget["refresh_button"] = ttk.Button(
+        button_frame, text="Refresh Slot", state="disabled",
+        command=bound_slot_call(refresh_single)
     )
-    refresh_button.config(
-        command=lambda f=f"file{column_index}", e=entry, t=text_area, rb=refresh_button:
-        refresh_single(f, e, t, rb)
+    widget["refresh_button"].pack(side="left", padx=5)
+    widget["full_button"] = ttk.Button(
+        button_frame, text="Completo", state="disabled",
+        command=bound_slot_call(load_full_file)
     )
-    refresh_button.pack(side="left", padx=5)
+    widget["full_button"].pack(side="left", padx=5)
 
-    columns.append(
-        (frame, entry, text_area, f"file{column_index}", refresh_button))
-    if default_path:
-        upload_file(entry, text_area,
-                    f"file{column_index}", default_path, refresh_button)
+    _measure_column_pitch(frame)
+    widget["window"] = canvas.create_window(
+        (0, 0), window=frame, anchor="nw", state="hidden",
+        width=column_pitch - COLUMN_GAP_PX, height=max(1, canvas.winfo_height()))
+    return widget
 
 
-def remove_column(frame):
-    global columns
-    for i, (f, entry, text_area, file_path_var, refresh_button) in enumerate(columns):
-        if f == frame:
-            f.destroy()
-            columns.pop(i)
-            if file_path_var in file_paths:
-                del file_paths[file_path_var]
-            if file_path_var in truncated_files:
-                del truncated_files[file_path_var]
-            break
-    for i, (f, entry, _, _, _) in enumerate(columns):
-        entry_label = f.winfo_children()[0]
-        entry_label.config(text=f"Nome file {i+1}:")
-    update_truncated_files_label()
+def _measure_column_pitch(frame):
+    """Alla prima colonna creata adatta il passo alla larghezza richiesta dai widget."""
+    global column_pitch, column_pitch_measured
+    if column_pitch_measured:
+        return
+    column_pitch_measured = True
+    frame.update_idletasks()
+    column_pitch = max(column_pitch, frame.winfo_reqwidth() + COLUMN_GAP_PX)
+
+
+def bind_column_widget(widget, slot):
+    """Mostra lo slot nella colonna: il contenuto viene copiato dal modello."""
+    widget["slot"] = slot
+    slot["widget"] = widget
+    widget["entry"].delete(0, tk.END)
+    widget["entry"].insert(0, slot["name"])
+    _fill_text_widget(widget, slot["content"])
+    widget["text"].xview_moveto(0)
+    _apply_slot_state(widget, slot)
+
+
+def release_column_widget(slot):
+    """Riporta nel modello eventuali modifiche e restituisce la colonna al pool."""
+    widget = slot["widget"]
+    if widget is None:
+        return
+    get_slot_name(slot)
+    get_slot_content(slot)
+    slot["widget"] = None
+    widget["slot"] = None
+    widget["index"] = None
+    widget["fill_token"] = widget["fill_progress"] = None
+    canvas.itemconfigure(widget["window"], state="hidden")
+    if widget in active_column_widgets:
+        active_column_widgets.remove(widget)
+    free_column_widgets.append(widget)
+
+
+def visible_column_range():
+    """Indici [first, last) degli slot da realizzare: viewport più overscan."""
+    x0 = canvas.canvasx(0)
+    width = max(canvas.winfo_width(), 1)
+    first = max(0, int(x0 // column_pitch) - COLUMN_OVERSCAN)
+    last = min(len(columns), int((x0 + width) // column_pitch) + 1 + COLUMN_OVERSCAN)
+    return first, last
+
+
+def update_column_view():
+    """Realizza le colonne visibili, ricicla quelle uscite dal viewport, aggiorna lo scroll."""
+    global column_view_pending
+    column_view_pending = False
+    height = max(canvas.winfo_height(), 1)
+    canvas.configure(scrollregion=(0, 0, max(len(columns) * column_pitch, 1), height))
+    first, last = visible_column_range()
+    visible = columns[first:last]
+    visible_ids = {slot["id"] for slot in visible}
+
+    for widget in list(active_column_widgets):
+        if widget["slot"]["id"] not in visible_ids:
+            release_column_widget(widget["slot"])
+
+    for offset, slot in enumerate(visible):
+        index = first + offset
+        widget = slot["widget"]
+        if widget is None:
+            widget = free_column_widgets.pop() if free_column_widgets else create_column_widget()
+            bind_column_widget(widget, slot)
+            active_column_widgets.append(widget)
+        if widget["index"] != index:
+            widget["index"] = index
+            _update_column_label(widget)
+            canvas.coords(widget["window"], index * column_pitch, 0)
+        canvas.itemconfigure(widget["window"], state="normal", height=height)
+
+
+def schedule_column_view_update(*_):
+    """Coalesce le richieste di aggiornamento della vista in un solo after_idle."""
+    global column_view_pending
+    if not column_view_pending:
+        column_view_pending = True
+        root.after_idle(update_column_view)
+
+
+def on_columns_xscroll(first, last):
+    scroll_x.set(first, last)
+    schedule_column_view_update()
 
 
 # ========================== RICOSTRUISCI COLONNE ==========================
 
+@traced("rebuild_columns")
 def rebuild_columns():
-    """Ricostruisce tutte le colonne nel main_frame in base ai file selezionati"""
+    """
+    Allinea gli slot ai file selezionati calcolando la differenza con quelli aperti:
+    gli slot già presenti restano (con le eventuali modifiche non salvate) e vengono solo
+    riordinati, si creano solo gli slot dei file aggiunti e si rimuovono quelli tolti.
+    Gli slot senza file (creati a mano o dalla risposta AI) restano in coda se non vuoti.
+    """
     global columns
 
-    # cancella tutte le colonne attuali
-    for (frame, _, _, _, _) in columns:
-        frame.destroy()
-    columns.clear()
+    kept = {}       # rel_path -> slot esistente da mantenere
+    manual = []
+    removed = 0
+    for slot in columns:
+        file_path = file_paths.get(slot["id"])
+        if file_path is None:
+            if get_slot_name(slot).strip() or get_slot_content(slot).strip():
+                manual.append(slot)
+            else:
+                drop_slot(slot)
+            continue
+        rel_path = os.path.relpath(file_path, selected_dir)
+        if rel_path in selected_files and rel_path not in kept:
+            kept[rel_path] = slot
+        else:
+            drop_slot(slot)
+            removed += 1
 
-    # ricostruisce solo i file selezionati
+    new_columns = []
+    added = 0
     for rel_path in sorted(selected_files):
-        file_path = os.path.join(selected_dir, rel_path)
-        add_column(default_path=file_path)
-
-    # riallinea i frame secondari (request, explanation, bottoni)
-    num_columns = len(columns)
-    request_frame.grid_forget()
-    request_frame.grid(
-        row=1, column=0, columnspan=num_columns, sticky=(tk.W, tk.E))
-
-    explanation_frame.grid_forget()
-    explanation_frame.grid(row=1, column=num_columns,
-                           sticky=(tk.W, tk.E, tk.N, tk.S))
+        if len(new_columns) >= MAX_COLUMNS:
+            break
+        slot = kept.get(rel_path)
+        if slot is None:
+            # i widget nasceranno solo se lo slot finisce nella parte visibile
+            slot = new_slot()
+            queue_slot_load(slot, os.path.join(selected_dir, rel_path))
+            added += 1
+        new_columns.append(slot)
+    columns[:] = new_columns + manual[:max(0, MAX_COLUMNS - len(new_columns))]
+    # oltre MAX_COLUMNS: anche gli slot esistenti rimasti fuori vanno rilasciati
+    in_columns = {slot["id"] for slot in columns}
+    for slot in itertools.chain(kept.values(), manual):
+        if slot["id"] not in in_columns:
+            drop_slot(slot)
+            removed += 1
+
+    print(f"[INFO] Slot: {len(columns) - added} mantenuti, {added} aggiunti, {removed} rimossi.")
+    if added or removed:
+        # la conversazione DeepSeek riguardava un altro insieme di file
+        reset_api_conversation()
+    update_truncated_files_label()
+    sync_watched_files()
+    schedule_column_view_update()
 
-    button_frame.grid_forget()
-    button_frame.grid(
-        row=2, column=0, columnspan=num_columns + 1, sticky=(tk.W, tk.E))
 
-    # riallinea anche il frame delle opzioni prompt (se già creato)
-    global prompt_mode_frame
-    if prompt_mode_frame is not None:
-        prompt_mode_frame.grid_forget()
-        prompt_mode_frame.grid(
-            row=3, column=0, columnspan=num_columns + 1, sticky=(tk.W, tk.E)
-        )
+# ========================== FINESTRA "GESTISCI FILE" ==========================
+# Albero ttk.Treeview popolato a richiesta: esistono solo i nodi delle directory espanse
+# (o i primi risultati della ricerca), quindi l’apertura non dipende dal numero di file.
 
+CHECK_ON = "☑"
+CHECK_OFF = "☐"
+CHECK_PARTIAL = "◩"
+SEARCH_DEBOUNCE_MS = 200
+SEARCH_RESULT_LIMIT = 2000
 
-# ========================== FINESTRA "GESTISCI FILE" ==========================
 
 def open_manage_files():
     global all_files, selected_files
@@ -368,66 +1500,289 @@ def open_manage_files():
     win.geometry("700x550")
     win.configure(bg=BG_DARK)
 
+    checked = set()                 # file spuntati nel dialogo (path relativi)
+    checked_counts = {}             # directory -> file spuntati (e già indicizzati) al suo interno
+    populated = set()               # directory i cui figli sono già nell’albero
+    state = {"query": "", "results": None, "search_job": None,
+             "mode": "", "elapsed": 0.0, "error": None}
+
     # barra ricerca
     search_var = tk.StringVar()
-
-    def update_list(*args):
-        filter_text = search_var.get().lower()
-        for cb, rel_path in checkboxes:
-            if filter_text in rel_path.lower():
-                cb.pack(anchor="w")
-            else:
-                cb.pack_forget()
-
     search_entry = ttk.Entry(win, textvariable=search_var)
     search_entry.pack(fill="x", padx=5, pady=5)
-    search_var.trace("w", update_list)
-
-    # canvas + scrollbar
-    canvas_m = tk.Canvas(win, bg=BG_DARK, highlightthickness=0)
-    scroll_y = ttk.Scrollbar(win, orient="vertical", command=canvas_m.yview)
-    frame_m = ttk.Frame(canvas_m)
-    frame_m.bind("<Configure>", lambda e: canvas_m.configure(
-        scrollregion=canvas_m.bbox("all")))
-    canvas_m.create_window((0, 0), window=frame_m, anchor="nw")
-    canvas_m.configure(yscrollcommand=scroll_y.set)
-    canvas_m.pack(side="left", fill="both", expand=True)
-    scroll_y.pack(side="right", fill="y")
+    ttk.Label(win, text="Ricerca fuzzy (es. apitest) · glob: src/**/*.ts · regex: re:^api/.*test_").pack(
+        anchor="w", padx=5)
+
+    scan_status = ttk.Label(win, text="")
+    scan_status.pack(anchor="w", padx=5)
 
-    checkboxes = []
-    vars_map = {}
+    # pulsanti in basso (impacchettati prima dell’albero così restano sempre visibili)
+    ok_frame = ttk.Frame(win)
+    ok_frame.pack(side="bottom", fill="x")
+    action_frame = ttk.Frame(win)
+    action_frame.pack(side="bottom", fill="x", pady=5)
+    quick_frame = ttk.Frame(win)
+    quick_frame.pack(side="bottom", fill="x", pady=5)
+
+    # albero + scrollbar
+    tree_frame = ttk.Frame(win)
+    tree_frame.pack(fill="both", expand=True)
+    tree = ttk.Treeview(tree_frame, columns=("kind",), selectmode="extended")
+    tree.heading("#0", text="File")
+    tree.heading("kind", text="Tipo")
+    tree.column("kind", width=90, stretch=False)
+    scroll_y = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+    tree.configure(yscrollcommand=scroll_y.set)
+    tree.pack(side="left", fill="both", expand=True)
+    scroll_y.pack(side="right", fill="y")
 
-    for rel_path in sorted(all_files):
-        var = tk.BooleanVar(value=(rel_path in selected_files))
-        cb = ttk.Checkbutton(frame_m, text=rel_path, variable=var)
-        cb.pack(anchor="w")
-        vars_map[rel_path] = var
-        checkboxes.append((cb, rel_path))
+    # --- rendering dei nodi ---
+    def dir_iid(rel):
+        return "d:" + rel
+
+    def file_iid(rel):
+        return "f:" + rel
+
+    def dir_glyph(rel):
+        total = path_index.subtree_size(rel)
+        count = checked_counts.get(rel, 0)
+        if total and count >= total:
+            return CHECK_ON, total
+        return (CHECK_PARTIAL if count else CHECK_OFF), total
+
+    def file_text(rel, full_path):
+        glyph = CHECK_ON if rel in checked else CHECK_OFF
+        return f"{glyph} {rel if full_path else os.path.basename(rel)}"
+
+    def dir_text(rel):
+        glyph, count = dir_glyph(rel)
+        return f"{glyph} {os.path.basename(rel)}{os.sep}  ({count})"
+
+    def insert_child(parent_rel, position, iid):
+        parent = dir_iid(parent_rel) if parent_rel else ""
+        rel = iid[2:]
+        if iid.startswith("d:"):
+            tree.insert(parent, position, iid=iid, text=dir_text(rel))
+            tree.insert(iid, "end", iid="x:" + rel, text="…")  # segnaposto: mostra la freccia
+        else:
+            tree.insert(parent, position, iid=iid, text=file_text(rel, False),
+                        values=(file_kind_label(file_kinds.get(rel)),))
+
+    def sync_children(dir_rel):
+        """Inserisce i figli mancanti di una directory già popolata, in ordine."""
+        subdirs, files = path_index.children(dir_rel)
+        desired = [dir_iid(d) for d in subdirs] + [file_iid(f) for f in files]
+        parent = dir_iid(dir_rel) if dir_rel else ""
+        existing = set(tree.get_children(parent))
+        for position, iid in enumerate(desired):
+            if iid not in existing:
+                insert_child(dir_rel, position, iid)
+
+    def populate(dir_rel):
+        if dir_rel in populated:
+            return
+        populated.add(dir_rel)
+        dummy = "x:" + dir_rel
+        if tree.exists(dummy):
+            tree.delete(dummy)
+        sync_children(dir_rel)
+
+    def show_tree():
+        tree.delete(*tree.get_children(""))
+        populated.clear()
+        populate("")
+
+    def show_results():
+        tree.delete(*tree.get_children(""))
+        for rel in state["results"][:SEARCH_RESULT_LIMIT]:
+            tree.insert("", "end", iid=file_iid(rel), text=file_text(rel, True),
+                        values=(file_kind_label(file_kinds.get(rel)),))
+
+    # --- spunte: contatori per directory aggiornati solo per i file che cambiano ---
+    def set_checked(paths, on, changed, dirs):
+        """
+        Spunta (o toglie) i file e aggiorna i contatori delle directory che li contengono;
+        aggiunge a `changed` i file cambiati e a `dirs` le directory da ridisegnare.
+        """
+        delta = 1 if on else -1
+        paths = set(paths)
+        if on:
+            paths.difference_update(checked)
+            checked.update(paths)
+        else:
+            paths.intersection_update(checked)
+            checked.difference_update(paths)
+        changed.extend(paths)
+        per_dir = {}  # directory madre -> file cambiati: gli antenati si visitano una volta per directory
+        for rel in paths:
+            if rel in path_index:  # i file non ancora scansionati si contano a fine scansione
+                parent = rel.rpartition(os.sep)[0]
+                per_dir[parent] = per_dir.get(parent, 0) + delta
+        for parent, n in per_dir.items():
+            while parent:
+                checked_counts[parent] = checked_counts.get(parent, 0) + n
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+    def reset_checked(paths):
+        """Sostituisce la selezione e ricalcola tutti i contatori."""
+        checked.clear()
+        checked_counts.clear()
+        set_checked(paths, True, [], set())
+
+    def redraw_marks(changed, dirs):
+        """
+        Ridisegna solo i file cambiati e le directory che li contengono, se sono nell’albero:
+        un nodo esiste se la sua directory madre è popolata (o, in ricerca, se è tra i risultati).
+        """
+        if state["results"] is not None:
+            shown = set(state["results"][:SEARCH_RESULT_LIMIT])
+            for rel in changed:
+                if rel in shown:
+                    tree.item(file_iid(rel), text=file_text(rel, True))
+        else:
+            for rel in dirs:
+                if os.path.dirname(rel) in populated:
+                    tree.item(dir_iid(rel), text=dir_text(rel))
+            for rel in changed:
+                if os.path.dirname(rel) in populated and rel in path_index:
+                    tree.item(file_iid(rel), text=file_text(rel, False))
+        refresh_status()
+
+    def refresh_marks():
+        """Aggiorna le spunte di tutti i nodi presenti nell’albero (fine scansione, file_set)."""
+        def walk(parent):
+            for iid in tree.get_children(parent):
+                if iid.startswith("d:"):
+                    tree.item(iid, text=dir_text(iid[2:]))
+                    if iid[2:] in populated:
+                        walk(iid)
+                elif iid.startswith("f:"):
+                    tree.item(iid, text=file_text(iid[2:], state["results"] is not None))
+        walk("")
+        refresh_status()
+
+    def refresh_status():
+        total = len(path_index)
+        prefix = f"Scansione in corso… {total} file trovati" if scan_in_progress else f"{total} file"
+        text = f"{prefix} · {len(checked)} selezionati"
+        if state["error"]:
+            text += f" · regex non valida: {state['error']}"
+        elif state["results"] is not None:
+            shown = min(len(state["results"]), SEARCH_RESULT_LIMIT)
+            text += (f" · {len(state['results'])} risultati {state['mode']}"
+                     f" in {state['elapsed'] * 1000:.1f} ms")
+            if shown < len(state["results"]):
+                text += f" (mostrati i primi {shown})"
+        scan_status.config(text=text)
+
+    # --- selezione ---
+    def toggle(iids):
+        """Spunta/toglie file e intere sottodirectory; ridisegna solo i nodi interessati."""
+        changed, dirs = [], set()
+        for iid in iids:
+            rel = iid[2:]
+            if iid.startswith("d:"):
+                total = path_index.subtree_size(rel)
+                on = not (total and checked_counts.get(rel, 0) >= total)
+                set_checked(path_index.subtree(rel), on, changed, dirs)
+            elif iid.startswith("f:"):
+                set_checked((rel,), rel not in checked, changed, dirs)
+        redraw_marks(changed, dirs)
+
+    def on_click(event):
+        iid = tree.identify_row(event.y)
+        if not iid or "indicator" in tree.identify_element(event.x, event.y):
+            return None
+        toggle([iid])
+        return "break"
+
+    def on_space(event):
+        toggle(tree.selection())
+        return "break"
+
+    def on_open(event):
+        iid = tree.focus()
+        if iid.startswith("d:"):
+            populate(iid[2:])
+
+    tree.bind("<Button-1>", on_click)
+    tree.bind("<space>", on_space)
+    tree.bind("<<TreeviewOpen>>", on_open)
+
+    # --- ricerca con debounce sull’indice precalcolato ---
+    def run_search():
+        state["search_job"] = None
+        query = search_var.get().strip()
+        state["query"] = query
+        state["error"] = None
+        if query:
+            started = time.perf_counter()
+            try:
+                state["mode"], state["results"] = path_index.search(query)
+            except re.error as e:
+                state["mode"], state["results"], state["error"] = "regex", [], str(e)
+            state["elapsed"] = time.perf_counter() - started
+            show_results()
+        else:
+            state["results"] = None
+            show_tree()
+        refresh_status()
+
+    def on_search_change(*args):
+        if state["search_job"] is not None:
+            win.after_cancel(state["search_job"])
+        state["search_job"] = win.after(SEARCH_DEBOUNCE_MS, run_search)
+
+    search_var.trace("w", on_search_change)
+
+    # stato scansione: i file trovati dal thread di scansione arrivano a lotti
+    def on_scan_progress(batch, done):
+        if state["results"] is None:
+            for dir_rel in list(populated):
+                sync_children(dir_rel)
+            if done:
+                reset_checked(list(checked))
+                refresh_marks()
+        elif done and state["query"]:
+            reset_checked(list(checked))
+            run_search()
+        refresh_status()
+
+    def on_destroy(event):
+        if event.widget is win and on_scan_progress in scan_listeners:
+            scan_listeners.remove(on_scan_progress)
+
+    scan_listeners.append(on_scan_progress)
+    win.bind("<Destroy>", on_destroy)
+    reset_checked(selected_files)
+    show_tree()
+    refresh_status()
+
+    # --- funzioni di selezione rapida (sui risultati della ricerca, se attiva) ---
+    def visible_scope():
+        return state["results"] if state["results"] is not None else path_index.sorted_paths()
 
-    # --- funzioni di selezione rapida ---
     def select_all():
-        for v in vars_map.values():
-            v.set(True)
+        changed, dirs = [], set()
+        set_checked(visible_scope(), True, changed, dirs)
+        redraw_marks(changed, dirs)
 
     def deselect_all():
-        for v in vars_map.values():
-            v.set(False)
+        changed, dirs = [], set()
+        set_checked(visible_scope(), False, changed, dirs)
+        redraw_marks(changed, dirs)
 
     # pulsanti selezione rapida
-    quick_frame = ttk.Frame(win)
-    quick_frame.pack(fill="x", pady=5)
     ttk.Button(quick_frame, text="Seleziona Tutti",
                command=select_all).pack(side="left", padx=5)
     ttk.Button(quick_frame, text="Deseleziona Tutti",
                command=deselect_all).pack(side="left", padx=5)
 
     # --- salvataggio file_set ---
-    action_frame = ttk.Frame(win)
-    action_frame.pack(fill="x", pady=5)
-
     def on_save_fileset():
         # costruisci l’insieme selezionato (relativi)
-        chosen = sorted([rel for rel, v in vars_map.items() if v.get()])
+        chosen = sorted(checked)
         if not chosen:
             messagebox.showwarning(
                 "Nessun file", "Seleziona almeno un file da salvare.")
@@ -445,7 +1800,7 @@ def open_manage_files():
     # --- caricamento file_set ---
     def on_load_fileset():
         ensure_file_set_dir()
-        existing = list_existing_file_sets()
+        existing = list_file_set_entries()
         if not existing:
             messagebox.showinfo("Nessun file_set",
                                 "Non ci sono file_set salvati.")
@@ -454,7 +1809,7 @@ def open_manage_files():
         # dialogo semplice con lista e pulsante Usa
         chooser = tk.Toplevel(win)
         chooser.title("Carica File_set")
-        chooser.geometry("420x300")
+        chooser.geometry("520x300")
         chooser.configure(bg=BG_DARK)
 
         ttk.Label(chooser, text="Seleziona una configurazione salvata:").pack(
@@ -469,9 +1824,10 @@ def open_manage_files():
         lb.pack(fill="both", expand=True, padx=8, pady=8)
 
         # Mostra in ordine decrescente (più recente in alto)
-        items_desc = list(reversed(existing))  # (path, n)
-        for p, n in items_desc:
-            lb.insert(tk.END, f"file_set_tony_{n}.json")
+        items_desc = list(reversed(existing))
+        for entry in items_desc:
+            created = (entry["created"] or "").replace("T", " ")[:16]
+            lb.insert(tk.END, f"{entry['name']}  ·  {entry['count']} file  ·  {created}")
 
         def use_selected():
             sel = lb.curselection()
@@ -480,11 +1836,24 @@ def open_manage_files():
                     "Nessuna scelta", "Seleziona un file_set dall’elenco.")
                 return
             index = sel[0]
-            path, n = items_desc[index]
+            path = os.path.join(file_set_dir, items_desc[index]["name"])
             ok = load_fileset_from_path(path)
             if ok:
+                global selection_from_user
+                selection_from_user = True
                 rebuild_columns()
+                # allinea le spunte del dialogo al file_set appena caricato
+                reset_checked(selected_files)
+                refresh_marks()
                 chooser.destroy()
+                if fileset_drifted_files:
+                    names = "\n".join(fileset_drifted_files[:10])
+                    if len(fileset_drifted_files) > 10:
+                        names += f"\n… e altri {len(fileset_drifted_files) - 10}"
+                    messagebox.showinfo(
+                        "File cambiati",
+                        f"{len(fileset_drifted_files)} file sono cambiati dopo il salvataggio "
+                        f"del file_set:\n{names}")
                 # opzionalmente chiudere anche "Gestisci File"
                 # win.destroy()
 
@@ -493,303 +1862,314 @@ def open_manage_files():
     load_btn = ttk.Button(
         action_frame, text="Carica File_set", command=on_load_fileset)
     # disabilita se non esistono file_set
-    load_btn_state = "normal" if list_existing_file_sets() else "disabled"
+    load_btn_state = "normal" if get_latest_fileset_path()[0] else "disabled"
     load_btn.configure(state=load_btn_state)
     load_btn.pack(side="left", padx=5)
 
     # --- applica selezione manuale corrente ---
     def apply_selection():
-        global selected_files
-        selected_files = {rel for rel, v in vars_map.items() if v.get()}
+        global selected_files, selection_from_user
+        selected_files = set(checked)
+        selection_from_user = True
         rebuild_columns()
         win.destroy()
 
-    ttk.Button(win, text="OK", command=apply_selection).pack(pady=5)
+    ttk.Button(ok_frame, text="OK", command=apply_selection).pack(pady=5)
 
 
-# ========================== PROMPT E API (DeepSeek) ==========================
+# ========================== COSTRUZIONE PROMPT ==========================
+# Writer, sezioni dei file, budget token, scheletri e follow-up sono in codeshow.py (lo stesso
+# costruttore serve alla riga di comando); qui il legame con le opzioni della GUI.
 
 def get_prompt_tail():
     """
     Restituisce il finale del prompt in base all'opzione selezionata.
     Ordine di priorità: patches (2) > explanation (3) > full code (1 default).
     """
+    return prompt_tail(get_prompt_mode(), columns)
+
+
+def get_prompt_mode():
     # Se esiste la variabile vuol dire che l'UI è stata creata.
     # In fase di bootstrap, se non ancora creata, fallback all'opzione 1.
     try:
         if prompt_mode_var2.get():
-            return (
-                "DO NOT return the full, updated content of the files involved. "
-                "YOU MUST provide a precise and specific list of the changes to be implemented. "
-                "SPECIFY clearly the name of the file/s to be edited (e.g., file1.js). "
-                "INDICATE the specific action/s to perform (e.g., Replace, Insert, Delete etc etc). "
-                "DEFINE the exact location/s in the code/s. "
-                "PROVIDE the exact code to be used for the change. "
-                "Execute the following request, providing only the changes as described above:\n"
-            )
+            return "patches"
         if prompt_mode_var3.get():
-            return "I want to ask you something about this application, read here my request:"
+            return "explain"
     except NameError:
         pass
-    # Default (opzione 1)
-    return (
-        "Please return the fully updated code of the files involved to fulfill the following request.  \n"
-        "If, to fulfill the following request, for example, it is necessary to edit file 1 and file 3 (for example), \n"
-        "return the fully updated files for file 1 and file 3.\n"
-        "Follow the request:"
-    )
+    return "full"
 
 
-def generate_prompt():
-    global columns
-    file_names = [entry.get() for _, entry, _, _, _ in columns]
-    file_contents = [text_area.get("1.0", tk.END).strip()
-                     for _, _, text_area, _, _ in columns]
-    prompt_text = "User has these files:\n"
-    for name in file_names:
-        prompt_text += f"{name}\n"
-    prompt_text += "\nContents of the files are:\n"
-    for name, content in zip(file_names, file_contents):
-        prompt_text += f"{name}\n{content}\n\n"
-    prompt_text += get_prompt_tail()
-    pyperclip.copy(prompt_text)
-    print("[INFO] Prompt copiato nella clipboard.")
+def last_full_prompt_tokens():
+    """Token stimati del prompt completo più recente (per confrontarli con il follow-up)."""
+    return last_prompt_report["total_full"] if last_prompt_report else 0
 
 
-def run_refresh_then_prompt():
-    refresh_files()
-    generate_prompt()
+def show_budget_report(report):
+    global last_prompt_report
+    last_prompt_report = report
+    print(f"[INFO] Token prompt: {describe_budget_report(report)}")
+    if budget_report_label is not None:
+        over = report["total"] > report["budget"]
+        budget_report_label.config(text=describe_budget_report(report),
+                                   foreground="#f48771" if over else FG_TEXT)
+
+
+def prepare_prompt_plan(tail, user_request=None):
+    """Piano di resa per il prompt corrente: tutto completo, o adattato al budget se attivo."""
+    fit_budget = budget_mode_var is not None and budget_mode_var.get()
+    plan, report = prompt_plan(columns, tail, user_request, fit_budget)
+    show_budget_report(report)
+    return plan
+
+
+def followup_available(channel):
+    return bool(followup_mode_var is not None and followup_mode_var.get() and sent_snapshots.get(channel))
 
 
-def parse_deepseek_files(content: str):
+def reset_api_conversation():
+    """Dimentica la conversazione DeepSeek: il prossimo "Esegui" invia di nuovo il prompt completo."""
+    api_conversation.clear()
+    sent_snapshots.pop("api", None)
+
+
+def on_followup_mode_change():
+    if not followup_mode_var.get():
+        reset_api_conversation()
+
+
+# ========================== STREAMING DELLE RISPOSTE (SSE) ==========================
+# Con "stream": true DeepSeek invia la risposta come server-sent events (righe "data: {...}"
+# separate da una riga vuota, chiusura con "data: [DONE]"). Il testo viene aggiunto a
+# "Spiegazioni" man mano e ogni blocco "nome file + ``` ... ```" completo va subito nel suo slot.
+
+def _on_deepseek_delta(request, delta):
+    """Thread Tk: aggiunge il pezzo di risposta a "Spiegazioni" e applica i file completati."""
+    if request is not deepseek_request or request["cancel"].is_set():
+        return
+    if not request["parser"].parts:
+        explanations.delete("1.0", tk.END)
+        print(f"[INFO] Primo token DeepSeek dopo {time.monotonic() - request['started']:.2f}s.")
+    explanations.insert(tk.END, delta)
+    explanations.see(tk.END)
+    for fname, body in request["parser"].feed(delta):
+        if looks_like_patch(body):
+            continue  # modifiche mirate: si applicano a risposta completa (apply_deepseek_response)
+        result = apply_file_to_slots(fname, body)
+        request["applied"][fname] = (result, body)
+        print(f"[INFO] Streaming: {fname} applicato allo slot ({result}).")
+
+
+# ========================== PROMPT E API (DeepSeek) ==========================
+
+def confirm_truncated_slots():
     """
-    Estrae un dizionario {filename -> file_content} dal testo del modello.
-    Supporta due formati comuni:
-      1) Filename su una riga + blocco ``` ... ```
-      2) Filename su una riga + corpo fino al prossimo filename o fine testo
-    Ritorna anche una stringa 'explanations' con l'eventuale testo non parsato.
+    Prima di costruire un prompt: se ci sono slot mostrati solo in anteprima chiede se
+    caricarli per intero o inviarli marcati come parziali. Ritorna False se l’utente annulla.
     """
-    files_map = {}
-    consumed_spans = []
-
-    # --- Passo 1: filename + fenced code block
-    # Esempio:
-    #   path/to/file.py
-    #   ```python
-    #   ...code...
-    #   ```
-    pattern_fenced = re.compile(
-        r'(?m)^\s*([^\n\r]+?\.[A-Za-z0-9]{1,10})\s*\n```[^`\n]*\n(.*?)\n```',
-        re.DOTALL
-    )
-    for m in pattern_fenced.finditer(content):
-        fname = m.group(1).strip()
-        body = m.group(2)
-        files_map[fname] = body
-        consumed_spans.append((m.start(), m.end()))
-
-    # --- Passo 2: filename + blocco plain fino al prossimo filename
-    # Ma evita di riparsare aree già consumate
-    def is_consumed(i):
-        for a, b in consumed_spans:
-            if a <= i < b:
-                return True
+    pending = [slot for slot in columns if slot["id"] in truncated_files]
+    if not pending:
+        return True
+    names = "\n".join(get_slot_name(slot) for slot in pending[:10])
+    if len(pending) > 10:
+        names += f"\n… e altri {len(pending) - 10}"
+    answer = messagebox.askyesnocancel(
+        "File in anteprima",
+        f"{len(pending)} slot contengono solo un’anteprima del file:\n{names}\n\n"
+        "Sì = carica il contenuto completo\n"
+        "No = includi l’anteprima segnalandola come parziale\n"
+        "Annulla = non generare il prompt")
+    if answer is None:
         return False
+    if answer:
+        for slot in pending:
+            load_full_file(slot)
+        flush_slot_loads()
+    return True
 
-    # Candidati filename: linee che terminano con .ext
-    pattern_plain_header = re.compile(
-        r'(?m)^\s*([^\n\r]+?\.[A-Za-z0-9]{1,10})\s*$')
-    matches = list(pattern_plain_header.finditer(content))
-    for idx, m in enumerate(matches):
-        start = m.start()
-        if is_consumed(start):
-            continue
-        fname = m.group(1).strip()
 
-        # Limita al prossimo header non consumato
-        end_pos = len(content)
-        for j in range(idx + 1, len(matches)):
-            nxt = matches[j]
-            if is_consumed(nxt.start()):
-                continue
-            end_pos = nxt.start()
-            break
+@traced("generate_prompt")
+def generate_prompt():
+    flush_slot_loads()
+    if not confirm_truncated_slots():
+        return
+    prompt_cache_stats.update(rendered=0, cached=0)
+    tail = get_prompt_tail()
+    plan = prepare_prompt_plan(tail)
+    followup = followup_available("prompt")
+    try:
+        writer = open_prompt_writer()
+        try:
+            if followup:
+                counter = TokenCountingWriter(writer)
+                stats = write_followup_prompt(counter, columns, sent_snapshots["prompt"], tail, plan=plan)
+                summary = describe_followup_stats(stats, counter.tokens, last_full_prompt_tokens())
+                budget_report_label.config(text=summary)
+                print(f"[INFO] Prompt {summary}.")
+            else:
+                write_prompt(writer, columns, tail, plan=plan)
+        finally:
+            writer.close()
+    except OSError as e:
+        messagebox.showerror("Errore", f"Impossibile scrivere il prompt:\n{e}")
+        return
+    record_sent_snapshot("prompt", columns, plan)
+    print(f"[INFO] Prompt scritto {describe_prompt_target()} "
+          f"({prompt_cache_stats['rendered']} sezioni rigenerate, "
+          f"{prompt_cache_stats['cached']} dalla cache).")
 
-        # Corpo è tra fine linea header e end_pos
-        # taglia un eventuale \n iniziale
-        body = content[m.end():end_pos]
-        if body.startswith("\n"):
-            body = body[1:]
-        body = body.strip()
-        if body:
-            files_map[fname] = body
-            consumed_spans.append((m.start(), end_pos))
-
-    # Spiegazioni = tutto ciò che non è stato consumato
-    # (per semplicità, se parsing ha trovato almeno un file, mostriamo cmq explanations=resto)
-    explanations_parts = []
-    last = 0
-    for a, b in sorted(consumed_spans):
-        if last < a:
-            explanations_parts.append(content[last:a])
-        last = b
-    if last < len(content):
-        explanations_parts.append(content[last:])
-    explanations_text = "\n".join(p.strip()
-                                  for p in explanations_parts if p.strip())
-
-    return files_map, explanations_text
+
+def run_refresh_then_prompt():
+    refresh_files()
+    generate_prompt()
 
 
 def send_to_deepseek():
     """
-    Esegue la chiamata a DeepSeek, mostra l'output in 'Spiegazioni',
-    e APPLICA le modifiche ai rispettivi slot dei file (match per path relativo o basename).
+    Prepara il prompt e avvia la chiamata a DeepSeek su un thread di lavoro: la finestra resta
+    utilizzabile, "Annulla" interrompe la richiesta e la risposta viene applicata dal thread Tk
+    (vedi apply_deepseek_response).
     Non salva su disco automaticamente (usa il pulsante 'Salva' per ciascun slot).
     """
-    try:
-        # Costruzione prompt (come generate_prompt, ma includendo anche la richiesta utente)
-        file_names = [entry.get() for _, entry, _, _, _ in columns]
-        file_contents = [text_area.get("1.0", tk.END).strip()
-                         for _, _, text_area, _, _ in columns]
-
-        prompt_text = "User has these files:\n"
-        for name in file_names:
-            prompt_text += f"{name}\n"
-        prompt_text += "\nContents of the files are:\n"
-        for name, content in zip(file_names, file_contents):
-            prompt_text += f"{name}\n{content}\n\n"
-
-        prompt_text += get_prompt_tail() + "\n"
-
-        user_request = request_entry.get("1.0", tk.END).strip()
-        if not user_request:
-            user_request = "(Nessuna richiesta specificata dall'utente.)"
-        prompt_text += user_request
-
-        if not API_KEY or not isinstance(API_KEY, str):
-            messagebox.showerror(
-                "Errore DeepSeek", "API key mancante o non valida (variabile DEEPSEEK_API_KEY).")
+    global deepseek_request
+    if deepseek_request is not None:
+        return
+    flush_slot_loads()
+    # Costruzione prompt (come generate_prompt, ma includendo anche la richiesta utente)
+    if not confirm_truncated_slots():
+        return
+    user_request = request_entry.get("1.0", tk.END).strip()
+    if not user_request:
+        user_request = "(Nessuna richiesta specificata dall'utente.)"
+    tail = get_prompt_tail()
+    plan = prepare_prompt_plan(tail, user_request)
+    prompt_text, history = None, []
+    if followup_available("api") and api_conversation:
+        # la conversazione precedente resta nei messaggi: basta inviare le differenze,
+        # finché conversazione + follow-up restano nel budget token
+        writer = StringWriter()
+        stats = write_followup_prompt(writer, columns, sent_snapshots["api"], tail, user_request, plan)
+        followup_tokens = estimate_tokens(writer.getvalue())
+        history_tokens = sum(estimate_tokens(message["content"]) for message in api_conversation)
+        if history_tokens + followup_tokens <= TOKEN_BUDGET:
+            prompt_text, history = writer.getvalue(), list(api_conversation)
+            print(f"[INFO] DeepSeek {describe_followup_stats(stats, followup_tokens, last_full_prompt_tokens(), history_tokens)}.")
+        else:
+            print(f"[INFO] DeepSeek: la conversazione (≈ {format_tokens(history_tokens)} token) supera il "
+                  f"budget, si riparte da un prompt completo.")
+    if prompt_text is None:
+        prompt_text = build_prompt(columns, tail, user_request, plan)
+    # contenuti così come sono in prompt_text: le modifiche fatte durante la richiesta
+    # restano "non inviate" e compaiono nel follow-up successivo
+    sent_snapshot = build_sent_snapshot(columns, plan)
+
+    if not API_KEY or not isinstance(API_KEY, str):
+        messagebox.showerror(
+            "Errore DeepSeek", "API key mancante o non valida (variabile DEEPSEEK_API_KEY).")
+        return
+
+    payload = build_chat_payload(prompt_text, history)
+
+    deepseek_request = {
+        "cancel": threading.Event(),
+        "response": None,  # risposta HTTP in lettura (chiusa da "Annulla")
+        "started": time.monotonic(),
+        "history": history,
+        "prompt_text": prompt_text,
+        "snapshot": sent_snapshot,
+        "stream": bool(stream_mode_var is not None and stream_mode_var.get()),
+        "parser": IncrementalFileParser(),
+        "applied": {},  # file già applicati durante lo streaming: nome -> (esito, contenuto)
+        "cache_key": None,
+    }
+    if response_cache_var is not None and response_cache_var.get():
+        deepseek_request["cache_key"] = ResponseCache.key_for(payload)
+        cached = get_response_cache().get(deepseek_request["cache_key"])
+        update_response_cache_label()
+        if cached is not None:
+            print("[INFO] Risposta DeepSeek dalla cache (nessuna chiamata di rete).")
+            request, deepseek_request = deepseek_request, None
+            apply_deepseek_response(request, cached)
             return
+    if deepseek_request["stream"]:
+        payload["stream"] = True
+    print("[INFO] Chiamata a DeepSeek in corso...")
+    set_deepseek_busy(True)
+    threading.Thread(target=_deepseek_worker, args=(get_deepseek_client(), deepseek_request, payload),
+                     name="codeshow-deepseek", daemon=True).start()
+
+
+def get_deepseek_client():
+    """Client condiviso: le chiamate successive riusano la connessione keep-alive."""
+    global deepseek_client
+    if deepseek_client is None:
+        deepseek_client = DeepSeekClient(ClientConfig.from_env(url=DEEPSEEK_API_URL, api_key=API_KEY))
+    return deepseek_client
 
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert developer assistant. "
-                        "When the user asks to modify files, always return only the fully updated file contents, "
-                        "each preceded by the file name (exact path or exact name), preferably followed by a fenced code block with the file content."
-                    ),
-                },
-                {"role": "user", "content": prompt_text},
-            ],
-            "temperature": 0.2,
-        }
-
-        print("[INFO] Chiamata a DeepSeek in corso...")
-        resp = requests.post(
-            DEEPSEEK_API_URL, headers=headers, json=payload, timeout=90)
-        resp.raise_for_status()
-        data = resp.json()
-
-        content = ""
+
+def _deepseek_worker(client, request, payload):
+    """
+    Thread di lavoro: esegue la POST (con retry/backoff del client) e passa risultato o errore
+    al thread Tk. Il corpo è letto in streaming HTTP anche senza SSE, così "Annulla" può
+    chiudere la risposta mentre arriva.
+    """
+    try:
+        with span("http_request", chars=len(request["prompt_text"]), stream=request["stream"]) as sp:
+            resp = client.post(payload, stream=True, cancel_event=request["cancel"])
+            request["response"] = resp
+            with resp:
+                if request["stream"]:
+                    deltas = []
+                    for delta in iter_stream_deltas(resp, request["cancel"]):
+                        deltas.append(delta)
+                        post_to_ui(_on_deepseek_delta, request, delta)
+                    data = {"choices": [{"message": {"content": "".join(deltas)}}]}
+                    sp.set(response_chars=sum(len(delta) for delta in deltas))
+                else:
+                    data = resp.json()
+                    sp.set(bytes=len(resp.content), **response_usage(data))
+    except Exception as e:
+        post_to_ui(_on_deepseek_done, request, None, e)
+        return
+    if request["cache_key"] and not request["cancel"].is_set() and response_text(data):
         try:
-            content = data.get("choices", [{}])[0].get(
-                "message", {}).get("content", "")
-        except Exception:
-            content = ""
-
-        if not content:
-            content = f"[WARN] Nessun contenuto nella risposta DeepSeek.\nPayload risposta:\n{json.dumps(data, ensure_ascii=False, indent=2)}"
-
-        # --- Parsing dei file restituiti
-        files_map, extra_explanations = parse_deepseek_files(content)
-
-        # --- Applica modifiche agli slot
-        # Crea mappe ausiliarie per match:
-        #   - path relativo esatto (quello che c'è nella Entry)
-        #   - basename del file
-        slot_by_rel = {}
-        slot_by_base = {}
-        for (frame, entry, text_area, file_path_var, refresh_btn) in columns:
-            rel = entry.get().strip()
-            base = os.path.basename(rel) if rel else ""
-            slot_by_rel[rel] = (entry, text_area)
-            if base:
-                slot_by_base.setdefault(base, []).append((entry, text_area))
-
-        updated_count = 0
-        created_count = 0
-
-        for fname_from_ai, new_body in files_map.items():
-            fname_from_ai = fname_from_ai.strip()
-            base_ai = os.path.basename(fname_from_ai)
-
-            target_entry = None
-            target_text = None
-
-            # 1) Match su path relativo esatto
-            if fname_from_ai in slot_by_rel:
-                target_entry, target_text = slot_by_rel[fname_from_ai]
-            # 2) Match su basename
-            elif base_ai in slot_by_base and len(slot_by_base[base_ai]) == 1:
-                target_entry, target_text = slot_by_base[base_ai][0]
-            elif base_ai in slot_by_base and len(slot_by_base[base_ai]) > 1:
-                # Ambiguità: prova match per suffisso path
-                candidates = slot_by_base[base_ai]
-                chosen = None
-                for (e, t) in candidates:
-                    if e.get().endswith(fname_from_ai):
-                        chosen = (e, t)
-                        break
-                if not chosen:
-                    # fallback: primo con basename
-                    chosen = candidates[0]
-                target_entry, target_text = chosen
-
-            if target_text is not None:
-                # Aggiorna slot esistente
-                target_text.delete("1.0", tk.END)
-                target_text.insert("1.0", new_body)
-                target_text.configure(bg=TEXT_BG)
-                updated_count += 1
-            else:
-                # Nessuno slot corrispondente: crea uno slot nuovo e inserisci contenuto
-                add_column(default_path=None)
-                # lo slot appena creato è l'ultimo della lista
-                _, entry_new, text_new, _, _ = columns[-1]
-                entry_new.delete(0, tk.END)
-                entry_new.insert(0, fname_from_ai)
-                text_new.delete("1.0", tk.END)
-                text_new.insert("1.0", new_body)
-                text_new.configure(bg=TEXT_BG)
-                created_count += 1
-
-        # --- Aggiorna riquadro Spiegazioni
-        exp_full = []
-        if extra_explanations:
-            exp_full.append(
-                "=== Notes / Explanations ===\n" + extra_explanations)
-        if files_map:
-            exp_full.append(
-                f"\n=== Summary ===\nUpdated slots: {updated_count} | New slots: {created_count}")
-        explanations_text = "\n\n".join(exp_full).strip() or content
+            get_response_cache().put(request["cache_key"], data)
+        except OSError as e:
+            # la risposta è arrivata (ed è stata pagata): un errore della cache non la scarta
+            print(f"[WARN] Impossibile salvare la risposta nella cache: {e}")
+    post_to_ui(_on_deepseek_done, request, data, None)
 
-        explanations.delete("1.0", tk.END)
-        explanations.insert("1.0", explanations_text)
-        pyperclip.copy(content)
 
-        print(
-            f"[INFO] DeepSeek: aggiornati {updated_count} slot, creati {created_count} slot.")
-        messagebox.showinfo("DeepSeek",
-                            f"Risposta ricevuta.\nAggiornati {updated_count} slot.\nCreati {created_count} slot nuovi (se necessario).")
-    except requests.HTTPError as he:
+def get_response_cache():
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache(os.path.join(get_cache_dir(), "responses"), RESPONSE_CACHE_MAX_BYTES)
+    return response_cache
+
+
+def update_response_cache_label():
+    if response_cache_label is None:
+        return
+    if not response_cache_var.get():
+        response_cache_label.config(text="cache disattivata")
+        return
+    cache = get_response_cache()
+    response_cache_label.config(
+        text=f"cache: {cache.stats['hits']} hit · {cache.stats['misses']} miss · "
+             f"{len(cache.entries)} risposte ({format_size(cache.total_bytes)})")
+
+
+def _on_deepseek_done(request, data, error):
+    global deepseek_request
+    if request is not deepseek_request or request["cancel"].is_set():
+        return  # richiesta annullata: la risposta arrivata in ritardo si scarta
+    deepseek_request = None
+    set_deepseek_busy(False)
+    elapsed = time.monotonic() - request["started"]
+    if isinstance(error, requests.HTTPError):
+        he = error
         try:
             err_json = he.response.json()
             err_text = json.dumps(err_json, ensure_ascii=False, indent=2)
@@ -797,28 +2177,376 @@ def send_to_deepseek():
             err_text = he.response.text if he.response is not None else str(he)
         messagebox.showerror("Errore DeepSeek (HTTP)",
                              f"{he}\n\nDettagli:\n{err_text}")
-    except Exception as e:
+    elif error is not None:
         messagebox.showerror(
-            "Errore DeepSeek", f"Non è stato possibile completare la richiesta:\n{e}")
+            "Errore DeepSeek", f"Non è stato possibile completare la richiesta:\n{error}")
+    else:
+        print(f"[INFO] Risposta DeepSeek ricevuta in {elapsed:.1f}s.")
+        update_response_cache_label()
+        try:
+            apply_deepseek_response(request, data)
+        except Exception as e:
+            messagebox.showerror(
+                "Errore DeepSeek", f"Non è stato possibile applicare la risposta:\n{e}")
+
+
+def cancel_deepseek():
+    """Annulla la richiesta in corso: chiude la connessione e ignora un’eventuale risposta tardiva."""
+    global deepseek_request
+    request = deepseek_request
+    if request is None:
+        return
+    request["cancel"].set()
+    deepseek_request = None
+    resp = request["response"]
+    if resp is not None:
+        try:
+            resp.close()
+        except Exception:
+            pass
+    set_deepseek_busy(False)
+    print("[INFO] Richiesta DeepSeek annullata.")
+
+
+def set_deepseek_busy(busy):
+    """Stato dei controlli durante una richiesta: Esegui disabilitato, Annulla e tempo trascorso visibili."""
+    process_button.configure(state="disabled" if busy else "normal")
+    cancel_button.configure(state="normal" if busy else "disabled")
+    if busy:
+        _tick_deepseek_progress()
+    else:
+        deepseek_status_label.config(text="")
+
+
+def _tick_deepseek_progress():
+    request = deepseek_request
+    if request is None:
+        return
+    elapsed = time.monotonic() - request["started"]
+    received = request["parser"].received
+    if received:
+        deepseek_status_label.config(text=f"DeepSeek: ricezione… {received} caratteri, {elapsed:.1f}s")
+    else:
+        deepseek_status_label.config(text=f"DeepSeek: in attesa della risposta… {elapsed:.1f}s")
+    root.after(DEEPSEEK_PROGRESS_MS, _tick_deepseek_progress)
+
+
+def build_slot_match_maps():
+    """
+    Mappe ausiliarie per associare i file della risposta agli slot:
+      - path relativo esatto (quello che c'è nella Entry)
+      - basename del file
+    Completa prima il caricamento degli slot in coda: le risposte si applicano ai contenuti veri.
+    """
+    flush_slot_loads()
+    slot_by_rel = {}
+    slot_by_base = {}
+    for slot in columns:
+        rel = get_slot_name(slot).strip()
+        base = os.path.basename(rel) if rel else ""
+        slot_by_rel[rel] = slot
+        if base:
+            slot_by_base.setdefault(base, []).append(slot)
+    return slot_by_rel, slot_by_base
+
+
+def find_slot_for_file(fname_from_ai, slot_maps):
+    """Slot che corrisponde al nome di file indicato dal modello, oppure None."""
+    slot_by_rel, slot_by_base = slot_maps
+    base_ai = os.path.basename(fname_from_ai)
+
+    target_slot = None
+
+    # 1) Match su path relativo esatto
+    if fname_from_ai in slot_by_rel:
+        target_slot = slot_by_rel[fname_from_ai]
+    # 2) Match su basename
+    elif base_ai in slot_by_base and len(slot_by_base[base_ai]) == 1:
+        target_slot = slot_by_base[base_ai][0]
+    elif base_ai in slot_by_base and len(slot_by_base[base_ai]) > 1:
+        # Ambiguità: prova match per suffisso path
+        candidates = slot_by_base[base_ai]
+        chosen = None
+        for candidate in candidates:
+            if candidate["name"].endswith(fname_from_ai):
+                chosen = candidate
+                break
+        if not chosen:
+            # fallback: primo con basename
+            chosen = candidates[0]
+        target_slot = chosen
+    return target_slot
+
+
+def apply_file_to_slots(fname_from_ai, new_body, slot_maps=None):
+    """
+    Scrive un file restituito dal modello nello slot corrispondente (o in uno slot nuovo).
+    Ritorna "updated", "created" oppure None se non è stato possibile creare lo slot.
+    """
+    slot_maps = slot_maps or build_slot_match_maps()
+    slot_by_rel, slot_by_base = slot_maps
+    fname_from_ai = fname_from_ai.strip()
+    base_ai = os.path.basename(fname_from_ai)
+    target_slot = find_slot_for_file(fname_from_ai, slot_maps)
+
+    if target_slot is not None:
+        # Aggiorna slot esistente (la risposta è un file completo, non più un’anteprima)
+        truncated_files.pop(target_slot["id"], None)
+        set_slot_content(target_slot, new_body)
+        return "updated"
+    # Nessuno slot corrispondente: crea uno slot nuovo e inserisci contenuto
+    slot_new = add_column(default_path=None)
+    if slot_new is None:
+        return None
+    set_slot_name(slot_new, fname_from_ai)
+    set_slot_content(slot_new, new_body)
+    slot_by_rel[fname_from_ai] = slot_new
+    if base_ai:
+        slot_by_base.setdefault(base_ai, []).append(slot_new)
+    return "created"
+
+
+def apply_patch_to_slots(patch, slot_maps):
+    """
+    Applica le modifiche mirate di un file al suo slot (o crea lo slot per un file nuovo).
+    Ritorna (esito "updated"/"created"/None, lista di EditResult).
+    """
+    if patch.path is None:
+        return None, [EditResult(edit, False, "file non indicato") for edit in patch.edits]
+    if codeshow.resolve_response_path(selected_dir, patch.path) is None:
+        # lo slot verrebbe poi salvato fuori dalla directory (o con un nome preso dalla prosa)
+        return None, [EditResult(edit, False, "nome non valido o fuori dalla directory")
+                      for edit in patch.edits]
+    target_slot = find_slot_for_file(patch.path.strip(), slot_maps)
+    if target_slot is None:
+        if not patch.only_creates:
+            return None, [EditResult(edit, False, "file non presente negli slot") for edit in patch.edits]
+        content, results = apply_edits("", patch.edits)
+        return apply_file_to_slots(patch.path, content, slot_maps), results
+    if target_slot["id"] in binary_slots:
+        return None, [EditResult(edit, False, "file binario") for edit in patch.edits]
+    if target_slot["id"] in truncated_files:
+        load_full_file(target_slot)  # le modifiche vanno applicate al file intero, non all’anteprima
+        finish_slot_load(target_slot["id"])
+    content, results = apply_edits(get_slot_content(target_slot), patch.edits)
+    if not any(result.applied for result in results):
+        return None, results
+    set_slot_content(target_slot, content)
+    return "updated", results
+
+
+def describe_patch_results(patch_reports):
+    """Resoconto per "Spiegazioni": modifiche applicate per file e testo di quelle fallite."""
+    lines = []
+    for path, results in patch_reports:
+        ok = sum(result.applied for result in results)
+        lines.append(f"{path or '(file non indicato)'}: {ok}/{len(results)} modifiche applicate")
+        for n, result in enumerate(results, 1):
+            if result.applied:
+                if result.how != "esatto":
+                    lines.append(f"  #{n}: {result.how}")
+                continue
+            lines.append(f"  #{n} NON APPLICATA ({result.how}):")
+            lines.extend("    " + line for line in result.edit.text.split("\n"))
+    return "\n".join(lines)
+
+
+def apply_deepseek_response(request, data):
+    """
+    Mostra l'output in 'Spiegazioni' e APPLICA le modifiche ai rispettivi slot dei file
+    (match per path relativo o basename). Eseguita sul thread Tk.
+    """
+    content = response_text(data)
+
+    if content:
+        # conversazione e snapshot per un eventuale follow-up con le sole differenze
+        api_conversation[:] = request["history"] + [
+            {"role": "user", "content": request["prompt_text"]},
+            {"role": "assistant", "content": content}]
+        sent_snapshots["api"] = request["snapshot"]
+
+    if not content:
+        content = f"[WARN] Nessun contenuto nella risposta DeepSeek.\nPayload risposta:\n{json.dumps(data, ensure_ascii=False, indent=2)}"
+
+    # --- Parsing: prima le modifiche mirate (search/replace, diff), poi i file completi
+    with span("response_parse", chars=len(content)) as sp:
+        patches, remaining = parse_patches(content)
+        files_map, extra_explanations = parse_deepseek_files(remaining)
+        sp.set(files=len(files_map), patches=len(patches))
+
+    # --- Applica modifiche agli slot (quelli già applicati durante lo streaming non si ripetono)
+    applied = request.get("applied", {})
+    slot_maps = build_slot_match_maps()
+    updated_count = 0
+    created_count = 0
+    for fname_from_ai, new_body in files_map.items():
+        previous = applied.get(fname_from_ai.strip())
+        if previous is not None and previous[1] == new_body:
+            result = previous[0]
+        else:
+            result = apply_file_to_slots(fname_from_ai, new_body, slot_maps)
+        if result == "updated":
+            updated_count += 1
+        elif result == "created":
+            created_count += 1
+
+    patch_reports = []
+    failed_edits = 0
+    for patch in patches:
+        result, edit_results = apply_patch_to_slots(patch, slot_maps)
+        patch_reports.append((patch.path, edit_results))
+        failed_edits += sum(not r.applied for r in edit_results)
+        if result == "updated":
+            updated_count += 1
+        elif result == "created":
+            created_count += 1
+
+    update_truncated_files_label()
+
+    # --- Aggiorna riquadro Spiegazioni
+    exp_full = []
+    if extra_explanations:
+        exp_full.append(
+            "=== Notes / Explanations ===\n" + extra_explanations)
+    if patch_reports:
+        exp_full.append("=== Patch ===\n" + describe_patch_results(patch_reports))
+    if files_map or patches:
+        exp_full.append(
+            f"\n=== Summary ===\nUpdated slots: {updated_count} | New slots: {created_count}")
+    explanations_text = "\n\n".join(exp_full).strip() or content
+
+    explanations.delete("1.0", tk.END)
+    explanations.insert("1.0", explanations_text)
+    pyperclip.copy(content)
+
+    print(
+        f"[INFO] DeepSeek: aggiornati {updated_count} slot, creati {created_count} slot.")
+    if failed_edits:
+        print(f"[WARN] DeepSeek: {failed_edits} modifiche non applicate (dettagli in Spiegazioni).")
+        messagebox.showwarning("DeepSeek",
+                               f"Risposta ricevuta.\nAggiornati {updated_count} slot.\nCreati {created_count} slot nuovi.\n"
+                               f"{failed_edits} modifiche NON applicate: il testo è in “Spiegazioni”.")
+        return
+    messagebox.showinfo("DeepSeek",
+                        f"Risposta ricevuta.\nAggiornati {updated_count} slot.\nCreati {created_count} slot nuovi (se necessario).")
 
 
 def clear_all():
-    for (frame, _, _, _, _) in columns:
-        frame.destroy()
-    columns.clear()
+    clear_slots()
     selected_files.clear()
+    reset_api_conversation()
     for _ in range(3):
         add_column()
+    sync_watched_files()
 
 
 def refresh_files():
-    for frame, entry, text_area, file_path_var, refresh_button in columns:
-        if file_path_var in file_paths:
-            if str(refresh_button['state']) == "normal":
-                refresh_single(file_path_var, entry, text_area, refresh_button)
-            else:
-                upload_file(entry, text_area, file_path_var,
-                            file_path=file_paths[file_path_var], refresh_button=refresh_button)
+    """
+    Ricarica solo gli slot i cui file sono cambiati su disco: oltre a quelli già segnalati
+    dal watcher, un controllo a lotti di size/mtime copre le modifiche non ancora notificate.
+    Le letture partono insieme sul pool di I/O.
+    """
+    check_slots_for_changes()
+    reloaded = 0
+    for slot in columns:
+        if slot["id"] in file_paths and slot["id"] in stale_files:
+            refresh_single(slot)
+            reloaded += 1
+    print(f"[INFO] Ricarico {reloaded} slot su {len(columns)} (solo file modificati).")
+
+
+# ========================== PANNELLO PRESTAZIONI ==========================
+# Totali per fase degli span registrati (scansione, lettura file, inserimento nei widget,
+# prompt, clipboard, HTTP, parsing), aggiornati mentre il pannello è aperto.
+PERF_COLUMNS = (("count", "chiamate", 70), ("total_ms", "totale ms", 90), ("mean_ms", "media ms", 80),
+                ("max_ms", "max ms", 80), ("bytes", "byte", 100), ("chars", "caratteri", 100),
+                ("tokens", "token", 80))
+
+
+def build_perf_panel(parent):
+    """Crea il pannello (chiuso): intestazione con il pulsante di apertura, corpo con la tabella."""
+    global perf_panel_body, perf_toggle_button, perf_tree, perf_status_label, trace_var
+    frame = ttk.Frame(parent, padding="5")
+    header = ttk.Frame(frame)
+    header.pack(fill="x")
+    perf_toggle_button = ttk.Button(header, text="▸ Prestazioni", command=toggle_perf_panel)
+    perf_toggle_button.pack(side="left")
+    trace_var = tk.IntVar(value=1 if codeshow.trace_enabled else 0)
+    ttk.Checkbutton(header, text="Registra tempi", variable=trace_var,
+                    command=lambda: codeshow.set_tracing(trace_var.get())).pack(side="left", padx=5)
+    ttk.Button(header, text="Azzera", command=clear_perf_panel).pack(side="left", padx=5)
+    ttk.Button(header, text="Esporta Chrome trace…", command=export_perf_trace).pack(side="left", padx=5)
+    perf_status_label = ttk.Label(header, text="")
+    perf_status_label.pack(side="left", padx=5)
+
+    perf_panel_body = ttk.Frame(frame)
+    perf_tree = ttk.Treeview(perf_panel_body, columns=[c[0] for c in PERF_COLUMNS], height=8)
+    perf_tree.heading("#0", text="fase")
+    perf_tree.column("#0", width=160)
+    for key, title, width in PERF_COLUMNS:
+        perf_tree.heading(key, text=title)
+        perf_tree.column(key, width=width, anchor="e")
+    perf_tree.pack(fill="x")
+    return frame
+
+
+def toggle_perf_panel():
+    global perf_seen_spans, perf_panel_open
+    perf_panel_open = not perf_panel_open
+    if not perf_panel_open:
+        perf_panel_body.pack_forget()
+        perf_toggle_button.config(text="▸ Prestazioni")
+        return
+    perf_panel_body.pack(fill="x", pady=(5, 0))
+    perf_toggle_button.config(text="▾ Prestazioni")
+    perf_seen_spans = None
+    refresh_perf_panel()
+
+
+def refresh_perf_panel():
+    """Ridisegna la tabella se ci sono span nuovi; si ripete finché il pannello è aperto."""
+    global perf_seen_spans
+    if not perf_panel_open:
+        return
+    last = trace_spans[-1] if trace_spans else None
+    if last is not perf_seen_spans:
+        perf_seen_spans = last
+        perf_tree.delete(*perf_tree.get_children())
+        for row in codeshow.trace_summary():
+            values = [row["count"], f"{row['total_ms']:.1f}", f"{row['total_ms'] / row['count']:.2f}",
+                      f"{row['max_ms']:.1f}"]
+            values += [format_size(row["bytes"]) if "bytes" in row else ""]
+            values += [f"{row[key]:,}" if key in row else "" for key in ("chars", "tokens")]
+            perf_tree.insert("", tk.END, text=row["name"], values=values)
+        perf_status_label.config(text=f"{len(trace_spans)} span" if trace_spans else
+                                 ("nessuno span registrato" if codeshow.trace_enabled else "registrazione disattivata"))
+    root.after(PERF_REFRESH_MS, refresh_perf_panel)
+
+
+def clear_perf_panel():
+    global perf_seen_spans
+    codeshow.clear_trace()
+    perf_seen_spans = None
+    if perf_panel_open:
+        perf_tree.delete(*perf_tree.get_children())
+        perf_status_label.config(text="")
+
+
+def export_perf_trace():
+    if not trace_spans:
+        messagebox.showinfo("Prestazioni", "Nessuno span da esportare: attiva “Registra tempi” e ripeti le operazioni.")
+        return
+    path = filedialog.asksaveasfilename(title="Esporta Chrome trace", defaultextension=".json",
+                                        initialfile="codeshow_trace.json",
+                                        filetypes=[("Chrome trace", "*.json")])
+    if not path:
+        return
+    try:
+        count = codeshow.export_chrome_trace(path)
+    except OSError as e:
+        messagebox.showerror("Errore", f"Impossibile esportare la traccia:\n{e}")
+        return
+    print(f"[INFO] {count} span esportati in {path} (apribili con chrome://tracing o ui.perfetto.dev).")
 
 
 # ========================== AVVIO INTERFACCIA ==========================
@@ -827,8 +2555,8 @@ root = tk.Tk()
 root.title("Editor con AI")
 
 root.withdraw()
-selected_dir = filedialog.askdirectory(title="Seleziona la directory di lavoro",
-                                       initialdir="C:/Users/Antonio Nuzzi/Trust Gym")
+selected_dir = os.getenv("CODESHOW_DIR") or filedialog.askdirectory(
+    title="Seleziona la directory di lavoro", initialdir="C:/Users/Antonio Nuzzi/Trust Gym")
 if not selected_dir:
     selected_dir = "C:/Users/Antonio Nuzzi/Trust Gym"
 print(f"[INFO] Directory selezionata: {selected_dir}")
@@ -847,6 +2575,7 @@ ACCENT_GREEN = "#4ec9b0"      # Accento verde
 BORDER_COLOR = "#3e3e42"      # Bordi
 TEXT_BG = "#1e1e1e"           # Background text widget
 TEXT_SELECT = "#264f78"       # Selezione testo
+TEXT_BG_STALE = "#2f2b1c"     # Background slot con file modificato su disco
 
 # Configura root window
 root.configure(bg=BG_DARK)
@@ -912,27 +2641,33 @@ style.map("TScrollbar",
           background=[("active", "#3e3e42")])
 
 # prepara path cartella file_set
-file_set_dir = os.path.join(selected_dir, "file_set")
+file_set_dir = codeshow.file_set_dir_for(selected_dir)
 
-# scan ricorsiva di tutti i file
-all_files = []
-for root_dir, _, files in os.walk(selected_dir):
-    for f in files:
-        rel_path = os.path.relpath(os.path.join(root_dir, f), selected_dir)
-        all_files.append(rel_path)
+# indice persistente della scansione precedente: fornisce gli hash per validare il file_set
+# e permette alla scansione di rileggere solo le directory modificate
+file_index = load_file_index()
 
-# default: carico tutti, ma se esiste un file_set recente lo uso
-selected_files = set(all_files)
-maybe_autoload_latest_fileset()
+# scan ricorsiva di tutti i file su un thread di lavoro: all_files si riempie a lotti
+# e, se non esiste un file_set recente, a fine scansione vengono selezionati tutti
+selection_from_user = maybe_autoload_latest_fileset()
+start_background_scan()
+process_ui_queue()
 
 container = ttk.Frame(root)
 container.pack(fill="both", expand=True)
 
+# pannello fisso sotto la striscia delle colonne: richiesta, spiegazioni, pulsanti, opzioni
+main_frame = ttk.Frame(container, padding="10")
+main_frame.pack(side="bottom", fill="x")
+main_frame.columnconfigure(0, weight=1)
+
+# striscia delle colonne: il canvas ospita solo le colonne visibili (vista virtualizzata)
 canvas = tk.Canvas(container, bg=BG_DARK, highlightthickness=0)
 scroll_x = ttk.Scrollbar(container, orient="horizontal", command=canvas.xview)
-canvas.configure(xscrollcommand=scroll_x.set)
+canvas.configure(xscrollcommand=on_columns_xscroll)
 scroll_x.pack(side="bottom", fill="x")
 canvas.pack(side="top", fill="both", expand=True)
+canvas.bind("<Configure>", schedule_column_view_update)
 
 
 def shift_scroll(event):
@@ -941,10 +2676,8 @@ def shift_scroll(event):
 
 canvas.bind("<Shift-MouseWheel>", shift_scroll)
 
-main_frame = ttk.Frame(canvas, padding="10")
-canvas.create_window((0, 0), window=main_frame, anchor="nw")
-main_frame.bind("<Configure>", lambda e: canvas.configure(
-    scrollregion=canvas.bbox("all")))
+# il watcher parte prima del caricamento: ogni slot letto viene subito osservato
+start_file_watcher()
 
 # carico i file selezionati (eventualmente da file_set)
 for rel_path in sorted(selected_files):
@@ -953,8 +2686,7 @@ for rel_path in sorted(selected_files):
 
 # frames secondari
 request_frame = ttk.Frame(main_frame, padding="5", relief="sunken")
-request_frame.grid(row=1, column=0, columnspan=len(
-    columns), sticky=(tk.W, tk.E))
+request_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
 request_label = ttk.Label(request_frame, text="Fai una richiesta:")
 request_label.pack(anchor="w")
 request_entry = tk.Text(request_frame, wrap="word", height=5,
@@ -966,8 +2698,7 @@ request_entry = tk.Text(request_frame, wrap="word", height=5,
 request_entry.pack(fill="both", expand=True)
 
 explanation_frame = ttk.Frame(main_frame, padding="5", relief="sunken")
-explanation_frame.grid(row=1, column=len(
-    columns), sticky=(tk.W, tk.E, tk.N, tk.S))
+explanation_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
 explanations_label = ttk.Label(explanation_frame, text="Spiegazioni:")
 explanations_label.pack(anchor="w")
 explanations = tk.Text(explanation_frame, wrap="word", width=40, height=5,
@@ -979,8 +2710,7 @@ explanations = tk.Text(explanation_frame, wrap="word", width=40, height=5,
 explanations.pack(fill="both", expand=True)
 
 button_frame = ttk.Frame(main_frame, padding="5")
-button_frame.grid(row=2, column=0, columnspan=len(
-    columns) + 1, sticky=(tk.W, tk.E))
+button_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E))
 process_button = ttk.Button(
     button_frame, text="Esegui", command=send_to_deepseek)
 process_button.pack(side="left", padx=5)
@@ -995,12 +2725,34 @@ clear_all_button.pack(side="left", padx=5)
 refresh_button_global = ttk.Button(
     button_frame, text="Ricarica Tutti", command=refresh_files)
 refresh_button_global.pack(side="left", padx=5)
+save_all_button = ttk.Button(
+    button_frame, text="Salva Tutti", command=save_all_files)
+save_all_button.pack(side="left", padx=5)
 combo_button = ttk.Button(
     button_frame, text="Ricarica + Prompt", command=run_refresh_then_prompt, style="Green.TButton")
 combo_button.pack(side="left", padx=5)
 manage_button = ttk.Button(
     button_frame, text="Gestisci File", command=open_manage_files)
 manage_button.pack(side="left", padx=5)
+cancel_button = ttk.Button(
+    button_frame, text="Annulla", command=cancel_deepseek, state="disabled")
+cancel_button.pack(side="left", padx=5)
+stream_mode_var = tk.IntVar(value=1 if DEEPSEEK_STREAM else 0)
+ttk.Checkbutton(button_frame, text="Streaming", variable=stream_mode_var).pack(side="left", padx=5)
+response_cache_var = tk.IntVar(value=1 if RESPONSE_CACHE_ENABLED else 0)
+ttk.Checkbutton(button_frame, text="Cache risposte", variable=response_cache_var,
+                command=lambda: update_response_cache_label()).pack(side="left", padx=5)
+response_cache_label = ttk.Label(button_frame, text="")
+response_cache_label.pack(side="left", padx=5)
+update_response_cache_label()
+deepseek_status_label = ttk.Label(button_frame, text="")
+deepseek_status_label.pack(side="left", padx=5)
+load_progress_frame = ttk.Frame(button_frame)  # mostrata solo durante il caricamento degli slot
+load_progress_bar = ttk.Progressbar(load_progress_frame, length=160, mode="determinate")
+load_progress_bar.pack(side="left")
+load_progress_label = ttk.Label(load_progress_frame, text="")
+load_progress_label.pack(side="left", padx=5)
+update_load_progress()
 
 truncated_files_label = ttk.Label(root, text="", foreground="#f48771", background=BG_DARK)
 truncated_files_label.pack(side="bottom", fill="x", pady=5)
@@ -1022,7 +2774,7 @@ def set_prompt_mode(which):
 
 # Frame posizionato subito sotto i bottoni
 prompt_mode_frame = ttk.Frame(main_frame, padding="5")
-prompt_mode_frame.grid(row=3, column=0, columnspan=len(columns) + 1, sticky=(tk.W, tk.E))
+prompt_mode_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E))
 ttk.Label(prompt_mode_frame, text="Output preference:").pack(anchor="w")
 cb1 = ttk.Checkbutton(
     prompt_mode_frame,
@@ -1046,7 +2798,39 @@ cb3 = ttk.Checkbutton(
 )
 cb3.pack(anchor="w")
 
+budget_mode_var = tk.IntVar(value=0)
+ttk.Checkbutton(
+    prompt_mode_frame,
+    text=f"Adatta al budget token ({format_tokens(TOKEN_BUDGET)}): i file in eccesso diventano scheletri",
+    variable=budget_mode_var
+).pack(anchor="w", pady=(6, 0))
+followup_mode_var = tk.IntVar(value=0)
+ttk.Checkbutton(
+    prompt_mode_frame,
+    text="Follow-up: invia solo le differenze rispetto all’ultimo prompt",
+    variable=followup_mode_var,
+    command=on_followup_mode_change
+).pack(anchor="w")
+budget_report_label = ttk.Label(prompt_mode_frame, text="")
+budget_report_label.pack(anchor="w")
+
+build_perf_panel(main_frame).grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E))
+
 root.bind("<Control-Return>", lambda e: run_refresh_then_prompt())
+root.bind("<Control-s>", lambda e: save_all_files())
+
+
+def on_close():
+    """Salva l’indice (con gli hash calcolati in sessione) prima di chiudere."""
+    save_file_index(file_index)
+    if file_watcher is not None:
+        file_watcher.stop()
+    if deepseek_client is not None:
+        deepseek_client.close()
+    root.destroy()
+
+
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 print("[INFO] Interfaccia inizializzata con successo.")
 root.mainloop()
@@ -0,0 +1,2306 @@
+"""
+Nucleo di CodeShow senza interfaccia grafica: scansione della directory con le regole di
+ignore, file_set, indice file persistente, modello degli slot, costruzione del prompt (budget
+token, scheletri, follow-up) e supporto all’API DeepSeek (payload, streaming SSE).
+
+Non importa tkinter: lo usano la GUI ("code_show_all_directories - Working Api.py") e la riga
+di comando, che parte in pochi millisecondi e si può usare in script e automazioni:
+
+    python codeshow.py prompt --dir X --fileset N --mode patches > prompt.txt
+    python codeshow.py scan --dir X
+    python codeshow.py filesets --dir X
+    python codeshow.py send --dir X --request "..." [--apply]
+    python codeshow.py apply --dir X risposta.txt [--write]
+
+(anche come "python -m codeshow ...").
+"""
+import argparse
+import ast        # scheletri strutturali dei file Python
+import bisect
+import codecs     # BOM per riconoscere la codifica dei file
+import collections
+import difflib    # diff dei prompt di follow-up
+import functools
+import hashlib    # hash dei contenuti per l'indice file
+import itertools
+import json
+import mmap       # anteprima dei file oltre il budget senza caricarli interamente
+import os
+import re
+import socket     # destinazione tcp: del prompt
+import sys
+import tempfile   # salvataggi atomici (file temporaneo + rename)
+import threading
+import time
+from array import array  # liste compatte di id per l'indice di trigrammi
+
+# ========================== CONFIGURAZIONE ==========================
+
+def load_dotenv_into_environ():
+    """Carica chiavi da un file .env nella root del progetto (se presente)."""
+    try:
+        base_dir = os.path.dirname(__file__)
+        env_path = os.path.join(base_dir, ".env")
+        if os.path.isfile(env_path):
+            with open(env_path, "r", encoding="utf-8") as f:
+                for raw_line in f:
+                    line = raw_line.strip()
+                    if not line or line.startswith("#") or "=" not in line:
+                        continue
+                    key, value = line.split("=", 1)
+                    key = key.strip()
+                    value = value.strip()
+                    if key and value and key not in os.environ:
+                        os.environ[key] = value
+    except Exception:
+        # Silenzia errori di caricamento .env; fallback a variabili d'ambiente del sistema
+        pass
+
+
+# Budget per file: oltre questa dimensione si mostra solo un’anteprima testa/coda letta
+# via mmap (il contenuto completo si carica su richiesta con "Completo"). 0 = nessun limite.
+MAX_FILE_BYTES = int(os.getenv("CODESHOW_MAX_FILE_BYTES", str(1024 * 1024)))
+PREVIEW_HEAD_BYTES = 64 * 1024
+PREVIEW_TAIL_BYTES = 16 * 1024
+# Codifica dei file: BOM, poi UTF-8 stretto, poi charset_normalizer se installato, poi le
+# codifiche di CODESHOW_ENCODINGS (separate da virgola) e infine latin-1, che accetta ogni byte.
+# La codifica rilevata viene riusata al salvataggio. Sotto ENCODING_GUESS_MIN_BYTES la stima
+# statistica è poco affidabile e si passa direttamente alle codifiche di ripiego.
+ENCODING_GUESS_MIN_BYTES = 1024
+FALLBACK_ENCODINGS = [name.strip() for name in os.getenv("CODESHOW_ENCODINGS", "cp1252").split(",")
+                      if name.strip()]
+ENCODING_BOMS = (  # (BOM, codifica, variante senza BOM); UTF-32 LE prima di UTF-16 LE, stesso prefisso
+    (codecs.BOM_UTF32_LE, "utf-32", "utf-32-le"), (codecs.BOM_UTF32_BE, "utf-32", "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8-sig", "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16", "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16", "utf-16-be"),
+)
+
+# Stato degli slot condiviso con la GUI (chiave: id dello slot)
+truncated_files = {}  # file_path_var -> {"size": byte totali, "shown": byte in anteprima}
+full_content_slots = set()  # slot caricati per intero su richiesta ("Completo")
+binary_slots = set()        # slot di file binari scelti esplicitamente (solo segnaposto)
+
+# Cartella dei file_set: <directory di lavoro>/file_set/file_set_tony_N.json
+FILE_SET_DIR_NAME = "file_set"
+FILE_SET_PREFIX = "file_set_tony_"
+# file_set v2: ogni set salva anche size, mtime_ns e hash dei file ("fingerprints") per
+# riconoscere al caricamento quelli cambiati dopo il salvataggio. file_set/file_set_index.json
+# elenca i set (nome, data, numero di file) e il prossimo N, così elenco, ultimo e prossimo
+# set non richiedono listdir né la lettura dei set.
+# I file_set_tony_N.json v1 (solo "files") restano leggibili; l’indice si ricostruisce se manca.
+FILE_SET_VERSION = 2
+FILE_SET_INDEX_NAME = "file_set_index.json"
+
+# Regole di esclusione di default (sintassi .gitignore). Possono essere estese o
+# annullate (con "!pattern") tramite <selected_dir>/.codeshowignore oppure la
+# variabile d'ambiente CODESHOW_IGNORE (pattern separati da virgola).
+DEFAULT_IGNORE_PATTERNS = [
+    ".git/", ".hg/", ".svn/",
+    "node_modules/", "bower_components/",
+    "venv/", ".venv/", "__pycache__/",
+    ".mypy_cache/", ".pytest_cache/", ".ruff_cache/", ".tox/", ".nox/",
+    ".idea/", "build/", "dist/", ".next/", "coverage/",
+    "/file_set/", "/.codeshow/",
+]
+CODESHOW_IGNORE_FILE = ".codeshowignore"
+USE_GITIGNORE = os.getenv("CODESHOW_USE_GITIGNORE", "1") != "0"
+SCAN_BATCH_SIZE = 500      # file per lotto inviato alla UI
+
+# Indice persistente dei file (<selected_dir>/.codeshow/file_index.json, accanto a file_set):
+# per ogni file [size, mtime_ns, hash] e per ogni directory mtime + elenco nomi.
+CACHE_DIR_NAME = ".codeshow"
+FILE_INDEX_NAME = "file_index.json"
+FILE_INDEX_VERSION = 2  # v2: ogni file ha anche il tipo (testo / binario / generato)
+
+# Classificazione dei file durante la scansione (salvata nell’indice): i file binari o
+# generati (lockfile, bundle minificati, ...) non vengono preselezionati né caricati come testo.
+FILE_KIND_TEXT = "text"
+FILE_KIND_BINARY = "binary"
+FILE_KIND_GENERATED = "generated"
+CLASSIFY_SAMPLE_BYTES = 8192
+MINIFIED_MAX_LINE = 1000     # una riga più lunga di così nel campione = minificato
+MINIFIED_AVG_LINE = 300      # lunghezza media delle righe oltre cui il file è "generato"
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".tif", ".tiff", ".psd",
+    ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".jar", ".war", ".whl",
+    ".pyc", ".pyo", ".class", ".so", ".dll", ".dylib", ".exe", ".bin", ".o", ".a", ".lib",
+    ".obj", ".woff", ".woff2", ".ttf", ".otf", ".eot", ".mp3", ".mp4", ".wav", ".ogg",
+    ".mov", ".avi", ".webm", ".sqlite", ".db", ".xlsx", ".docx", ".pptx", ".xls", ".doc",
+}
+BINARY_MAGIC = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"%PDF", b"PK\x03\x04", b"\x1f\x8b", b"\x7fELF",
+    b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe", b"SQLite format 3\x00", b"7z\xbc\xaf\x27\x1c",
+    b"Rar!", b"BZh", b"\xfd7zXZ", b"wOFF", b"wOF2", b"OggS", b"ID3", b"\x00asm",
+)
+GENERATED_FILE_NAMES = {
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock",
+    "Pipfile.lock", "uv.lock", "Cargo.lock", "composer.lock", "Gemfile.lock", "go.sum",
+}
+GENERATED_SUFFIXES = (".min.js", ".min.css", ".min.mjs", ".js.map", ".css.map", ".bundle.js")
+GENERATED_MARKERS = (b"@generated", b"do not edit", b"code generated by", b"auto-generated",
+                     b"autogenerated")
+
+# Destinazione del prompt generato: "clipboard" (default), "file:<path>" o "tcp:<host>:<port>".
+PROMPT_OUTPUT = os.getenv("CODESHOW_PROMPT_OUTPUT", "clipboard")
+prompt_section_cache = {}  # (etichetta, hash contenuto) -> sezione del prompt già renderizzata
+prompt_cache_stats = {"rendered": 0, "cached": 0}
+PROMPT_MODES = ("full", "patches", "explain")  # le tre "Output preference" della GUI
+
+# Budget di token del prompt (modalità "Adatta al budget token"): i file che non ci stanno
+# vengono ridotti a scheletro (import, classi, firme). Contesto DeepSeek 64k meno la risposta.
+TOKEN_BUDGET = int(os.getenv("CODESHOW_TOKEN_BUDGET", "56000"))
+CHARS_PER_TOKEN = 3.5   # stima a caratteri quando non c’è un tokenizer
+TOKENIZER_NAME = os.getenv("CODESHOW_TOKENIZER", "auto").lower()  # "auto", "tiktoken", "chars"
+PACK_FULL, PACK_SKELETON, PACK_OMITTED = "full", "skeleton", "omitted"
+token_counter = None       # funzione testo -> token (caricata al primo uso, vedi set_tokenizer)
+tokenizer_name = "chars"
+section_token_cache = {}   # chiave sezione -> token stimati
+skeleton_cache = {}        # (nome, hash contenuto) -> scheletro (None se non disponibile)
+# Prompt di follow-up: ultimo contenuto inviato per canale ("prompt" e "api").
+sent_snapshots = {"prompt": {}, "api": {}}
+FOLLOWUP_DIFF_CONTEXT = 3  # righe di contesto nei diff
+# Sopra questa dimensione (caratteri) anche in modalità "file completi" si chiedono solo le
+# modifiche (search/replace): si evita di far rigenerare file grandi. 0 = mai.
+PATCH_MODE_MIN_CHARS = int(os.getenv("CODESHOW_PATCH_MIN_CHARS", "20000"))
+
+DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_SYSTEM_PROMPT = (
+    "You are an expert developer assistant. "
+    "When the user asks to modify files, return the fully updated file contents, "
+    "each preceded by the file name (exact path or exact name), preferably followed by a fenced code block with the file content, "
+    "unless the user asks for the changes only: then use the SEARCH/REPLACE format they describe."
+)
+
+
+# ========================== TRACCIAMENTO (SPAN DI TEMPO) ==========================
+# Span di tempo attorno alle fasi costose (scansione, lettura file, inserimento nei widget,
+# prompt, clipboard, HTTP, parsing) con conteggi di byte e token. Disattivato, span() ritorna
+# un oggetto vuoto condiviso: il costo è un controllo di flag per chiamata.
+#
+#     with span("prompt_build") as sp:
+#         ...
+#         sp.set(bytes=len(text))
+#
+# Gli span completati restano in memoria (ultimi TRACE_MAX_SPANS) e si esportano nel formato
+# Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+TRACE_MAX_SPANS = 20000
+trace_enabled = os.getenv("CODESHOW_TRACE", "0").lower() in ("1", "true", "yes", "on")
+trace_spans = collections.deque(maxlen=TRACE_MAX_SPANS)  # (nome, inizio ns, durata ns, thread, args)
+trace_origin_ns = time.perf_counter_ns()
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        # deque.append è atomica: gli span arrivano anche dai thread di lavoro
+        trace_spans.append((self.name, self.start, end - self.start,
+                            threading.current_thread().name, self.args))
+        return False
+
+    def set(self, **counts):
+        """Aggiunge conteggi allo span (bytes, tokens, files, ...)."""
+        self.args.update(counts)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **counts):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Span di tempo da usare con `with`; con il tracciamento spento non registra nulla."""
+    if not trace_enabled:
+        return _NO_SPAN
+    return Span(name, args)
+
+
+def traced(name):
+    """Decoratore: ogni chiamata della funzione è uno span `name` (solo a tracciamento attivo)."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not trace_enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_tracing(enabled):
+    global trace_enabled
+    trace_enabled = bool(enabled)
+
+
+def clear_trace():
+    trace_spans.clear()
+
+
+def trace_summary():
+    """
+    Totali per nome di span, dal più costoso: lista di dict con count, total_ms, max_ms e la
+    somma dei conteggi numerici (bytes, tokens, ...).
+    """
+    rows = {}
+    for name, _, duration, _, args in list(trace_spans):
+        row = rows.get(name)
+        if row is None:
+            row = rows[name] = {"name": name, "count": 0, "total_ms": 0.0, "max_ms": 0.0}
+        ms = duration / 1e6
+        row["count"] += 1
+        row["total_ms"] += ms
+        row["max_ms"] = max(row["max_ms"], ms)
+        for key, value in args.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[key] = row.get(key, 0) + value
+    return sorted(rows.values(), key=lambda r: r["total_ms"], reverse=True)
+
+
+def chrome_trace():
+    """Span registrati come Chrome trace ("X" = evento completo, tempi in microsecondi)."""
+    threads = {}
+    events = []
+    pid = os.getpid()
+    for name, start, duration, thread, args in list(trace_spans):
+        tid = threads.setdefault(thread, len(threads) + 1)
+        events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                       "ts": (start - trace_origin_ns) / 1000, "dur": duration / 1000,
+                       "args": args})
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(chrome_trace(), f, ensure_ascii=False)
+    return len(trace_spans)
+
+
+# ========================== FILE_SET ==========================
+
+def file_set_dir_for(base_dir):
+    return os.path.join(base_dir, FILE_SET_DIR_NAME)
+
+
+def _scan_file_sets(set_dir):
+    """Tuple (path_assoluto, N) dei file_set_tony_N.json presenti, ordinate per N crescente."""
+    if not os.path.isdir(set_dir):
+        return []
+    result = []
+    for name in os.listdir(set_dir):
+        # pattern: file_set_tony_N.json
+        if name.startswith(FILE_SET_PREFIX) and name.lower().endswith(".json"):
+            # rimuove prefisso e ".json"
+            middle = name[len(FILE_SET_PREFIX):-5]
+            try:
+                n = int(middle)
+                result.append((os.path.join(set_dir, name), n))
+            except ValueError:
+                continue
+    result.sort(key=lambda x: x[1])  # per N crescente
+    return result
+
+
+def _file_set_entry(path, n):
+    """Voce dell’indice dei file_set per un set già su disco (anche v1)."""
+    try:
+        data = read_file_set_data(path)
+    except (OSError, ValueError):
+        data = {"files": [], "created": None}
+    created = data.get("created")
+    if not created:
+        try:
+            created = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(path)))
+        except OSError:
+            created = None
+    return {"n": n, "name": os.path.basename(path), "created": created,
+            "count": len(data["files"]), "version": data.get("version", 1)}
+
+
+def _save_file_set_index(set_dir, manifest):
+    path = os.path.join(set_dir, FILE_SET_INDEX_NAME)
+    try:
+        if not os.path.exists(path):
+            open(path, "a").close()  # permessi secondo umask (mkstemp userebbe 0600)
+        write_file_atomic(path, json.dumps(manifest, ensure_ascii=False, indent=2))
+    except OSError as e:
+        print(f"[WARN] Impossibile salvare l’indice dei file_set: {e}", file=sys.stderr)
+
+
+def load_file_set_index(set_dir):
+    """
+    Indice dei file_set {"version", "next", "sets": [{"n", "name", "created", "count", "version"}]}.
+    Si ricostruisce dai file presenti se manca, è corrotto o non è più allineato al disco
+    (un set elencato non esiste più o il prossimo N è già occupato): una stat per set.
+    """
+    path = os.path.join(set_dir, FILE_SET_INDEX_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        sets = manifest["sets"]
+        next_n = manifest["next"]
+        if (manifest.get("version") == FILE_SET_VERSION
+                and all(os.path.isfile(os.path.join(set_dir, entry["name"])) for entry in sets)
+                and not os.path.exists(file_set_path(set_dir, next_n))):
+            return manifest
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    items = _scan_file_sets(set_dir)
+    manifest = {"version": FILE_SET_VERSION, "next": items[-1][1] + 1 if items else 1,
+                "sets": [_file_set_entry(p, n) for p, n in items]}
+    if items:
+        _save_file_set_index(set_dir, manifest)
+    return manifest
+
+
+def list_file_sets(set_dir):
+    """Ritorna lista di tuple (path_assoluto, N) dei file_set esistenti, ordinati per N crescente."""
+    if not os.path.isdir(set_dir):
+        return []
+    return [(os.path.join(set_dir, entry["name"]), entry["n"])
+            for entry in load_file_set_index(set_dir)["sets"]]
+
+
+def latest_file_set(set_dir):
+    """(path, N) dell’ultimo file_set dall’indice, oppure (None, None) se non ce ne sono."""
+    if not os.path.isdir(set_dir):
+        return None, None
+    sets = load_file_set_index(set_dir)["sets"]
+    if not sets:
+        return None, None
+    return os.path.join(set_dir, sets[-1]["name"]), sets[-1]["n"]
+
+
+def file_set_path(set_dir, n):
+    return os.path.join(set_dir, f"{FILE_SET_PREFIX}{n}.json")
+
+
+def file_set_fingerprints(base_dir, rel_paths, index=None):
+    """
+    Impronte dei file senza leggerli: {"size": [...], "mtime_ns": [...], "hash": [...]}, liste
+    allineate a `rel_paths`. Valori dall’indice file (hash None se non lo conosce), una stat
+    per i file che l’indice non ha; size None per i file non più presenti.
+    """
+    files = index["files"] if index else {}
+    native_sep = os.sep != "/"
+    sizes, mtimes, hashes = [], [], []
+    for rel in rel_paths:
+        entry = files.get(rel.replace(os.sep, "/") if native_sep else rel)
+        if entry is None:
+            try:
+                st = os.stat(os.path.join(base_dir, rel))
+                entry = (st.st_size, st.st_mtime_ns, None)
+            except OSError:
+                entry = (None, None, None)
+        sizes.append(entry[0])
+        mtimes.append(entry[1])
+        hashes.append(entry[2])
+    return {"size": sizes, "mtime_ns": mtimes, "hash": hashes}
+
+
+def write_file_set(set_dir, base_dir, rel_paths, index=None):
+    """
+    Salva i percorsi RELATIVI (con le impronte dei file) nel prossimo file_set_tony_N.json e
+    aggiorna l’indice dei file_set. Ritorna (path, N).
+    """
+    os.makedirs(set_dir, exist_ok=True)
+    manifest = load_file_set_index(set_dir)
+    n = manifest["next"]
+    out_path = file_set_path(set_dir, n)
+    files = sorted(rel_paths)
+    created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    data = {
+        "version": FILE_SET_VERSION,
+        "base_dir": base_dir,
+        "created": created,
+        "files": files,  # come in v1: i lettori vecchi usano solo questa chiave
+        "fingerprints": file_set_fingerprints(base_dir, files, index),
+    }
+    # compatto come l’indice file: con migliaia di file l’indentazione triplica tempi e dimensioni
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))  # json.dump su file è più lento
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    manifest["sets"].append({"n": n, "name": os.path.basename(out_path), "created": created,
+                             "count": len(files), "version": FILE_SET_VERSION})
+    manifest["next"] = n + 1
+    _save_file_set_index(set_dir, manifest)
+    return out_path, n
+
+
+def read_file_set_data(path):
+    """
+    Contenuto di un file_set come dict con almeno "files" e "fingerprints" (None per i set v1).
+    Eccezioni di I/O e JSON al chiamante.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data.setdefault("files", [])
+    fingerprints = data.get("fingerprints")
+    if not isinstance(fingerprints, dict) or len(fingerprints.get("size") or ()) != len(data["files"]):
+        data["fingerprints"] = None
+    return data
+
+
+def read_file_set(path):
+    """Percorsi relativi salvati in un file_set (eccezioni di I/O e JSON al chiamante)."""
+    return read_file_set_data(path)["files"]
+
+
+def check_file_set(base_dir, data, index=None):
+    """
+    Confronta in blocco i file di un file_set con le impronte salvate, senza leggerli.
+    Con `index` size/mtime/hash vengono dall’indice file (valido quanto l’ultima scansione)
+    e la stat serve solo per i path che non conosce; senza, una stat per file. Ritorna
+    (presenti, cambiati, mancanti): "cambiati" hanno size/mtime diversi e hash diverso o
+    non confrontabile.
+    """
+    files = index["files"] if index else {}
+    native_sep = os.sep != "/"
+    fingerprints = data["fingerprints"]
+    if fingerprints is None:
+        saved_rows = itertools.repeat(None)
+    else:
+        saved_rows = zip(fingerprints["size"], fingerprints["mtime_ns"], fingerprints["hash"])
+    present, drifted, missing = [], [], []
+    for rel, saved in zip(data["files"], saved_rows):
+        entry = files.get(rel.replace(os.sep, "/") if native_sep else rel)
+        if entry is None:
+            try:
+                st = os.stat(os.path.join(base_dir, rel))
+            except OSError:
+                missing.append(rel)
+                continue
+            entry = (st.st_size, st.st_mtime_ns, None)
+        present.append(rel)
+        if saved is None or saved[0] is None or (saved[0] == entry[0] and saved[1] == entry[1]):
+            continue
+        if saved[2] is None or entry[2] is None or saved[2] != entry[2]:
+            drifted.append(rel)
+    return present, drifted, missing
+
+
+# ========================== SCANSIONE DIRECTORY ==========================
+
+def _gitignore_glob_to_regex(pattern):
+    """Traduce un glob in stile .gitignore (*, **, ?, [..]) in una regex su path con '/'."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                if i + 2 < n and pattern[i + 2] == "/":
+                    out.append("(?:.*/)?")   # "**/" = zero o più directory
+                    i += 3
+                else:
+                    out.append(".*")         # "/**" finale = tutto il contenuto
+                    i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnoreLayer:
+    """
+    Regole di un singolo file di ignore (o dei default), relative alla directory `base`
+    (path con '/', "" = radice). Semantica .gitignore: l’ultima regola che combacia vince,
+    "!" riammette, "/" finale = solo directory, "/" iniziale o interno = ancorata a `base`.
+    """
+
+    def __init__(self, lines, base=""):
+        self.base = base
+        self.rules = []  # (regex compilata, negata, solo_directory)
+        for raw in lines:
+            line = raw.rstrip("\n\r")
+            if not line or line.startswith("#"):
+                continue
+            line = line.rstrip()
+            negate = False
+            if line.startswith("!"):
+                negate = True
+                line = line[1:]
+            elif line.startswith(("\\!", "\\#")):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            regex = _gitignore_glob_to_regex(line.lstrip("/"))
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            self.rules.append((re.compile(regex), negate, dir_only))
+        # Percorso veloce: senza negazioni basta sapere se QUALCHE regola combacia
+        self._fast = None
+        if self.rules and not any(neg for _, neg, _ in self.rules):
+            any_kind = [rx.pattern for rx, _, d in self.rules if not d]
+            self._fast = (
+                re.compile("|".join(f"(?:{p})" for p in any_kind)) if any_kind else None,
+                re.compile("|".join(f"(?:{rx.pattern})" for rx, _, _ in self.rules)),
+            )
+
+    def match(self, rel_posix, is_dir):
+        """True = ignorato, False = riammesso, None = nessuna regola applicabile."""
+        if self.base:
+            if not rel_posix.startswith(self.base + "/"):
+                return None
+            rel_posix = rel_posix[len(self.base) + 1:]
+        if self._fast is not None:
+            rx = self._fast[1] if is_dir else self._fast[0]
+            return True if rx is not None and rx.fullmatch(rel_posix) else None
+        for rx, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if rx.fullmatch(rel_posix):
+                return not negate
+        return None
+
+
+def is_ignored(layers, rel_posix, is_dir):
+    """Valuta i layer dal più specifico (ultimo) al più generico; il primo che decide vince."""
+    for layer in reversed(layers):
+        verdict = layer.match(rel_posix, is_dir)
+        if verdict is not None:
+            return verdict
+    return False
+
+
+def _read_ignore_file(path):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def build_root_ignore_layers(base_dir):
+    """Layer iniziali: default del tool, CODESHOW_IGNORE e <base_dir>/.codeshowignore."""
+    layers = [IgnoreLayer(DEFAULT_IGNORE_PATTERNS)]
+    env_patterns = [p.strip() for p in os.getenv("CODESHOW_IGNORE", "").split(",") if p.strip()]
+    if env_patterns:
+        layers.append(IgnoreLayer(env_patterns))
+    custom = _read_ignore_file(os.path.join(base_dir, CODESHOW_IGNORE_FILE))
+    if custom:
+        layers.append(IgnoreLayer(custom))
+    return tuple(layers)
+
+
+def scan_directory(base_dir, emit, stop_event=None, batch_size=SCAN_BATCH_SIZE, index=None):
+    """
+    Scansione iterativa con os.scandir: pota le directory escluse dalle regole di ignore
+    (inclusi i .gitignore annidati) e chiama emit(lista_path_relativi, {path: tipo}) a lotti;
+    il dict contiene solo i file binari o generati (vedi classify_file).
+    I path emessi usano il separatore del sistema, come os.path.relpath.
+
+    Se `index` (indice persistente di una scansione precedente) è fornito, le directory
+    con mtime invariato non vengono rilette: i nomi arrivano dall’indice, mentre ogni file
+    riceve comunque una stat, così hash e tipo si riusano solo per i file davvero invariati.
+    Ritorna il nuovo indice, oppure None se la scansione è stata interrotta.
+    """
+    native_sep = os.sep != "/"
+    old_dirs = index["dirs"] if index else {}
+    old_files = index["files"] if index else {}
+    new_dirs = {}
+    new_files = {}
+    stack = [("", build_root_ignore_layers(base_dir))]
+    batch = []
+    batch_kinds = {}
+    reread = 0
+    while stack:
+        if stop_event is not None and stop_event.is_set():
+            return None
+        rel_dir, layers = stack.pop()
+        abs_dir = os.path.join(base_dir, rel_dir) if rel_dir else base_dir
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            continue
+        cached = old_dirs.get(rel_dir)
+        if cached is not None and cached["mtime"] == dir_mtime:
+            file_names, dir_names = cached["files"], cached["dirs"]
+            fresh_stats = {}
+        else:
+            # directory nuova o modificata: unica rilettura necessaria
+            reread += 1
+            file_names, dir_names, fresh_stats = [], [], {}
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                dir_names.append(entry.name)
+                            elif entry.is_file():
+                                file_names.append(entry.name)
+                                st = entry.stat()
+                                fresh_stats[entry.name] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            file_names.sort()
+            dir_names.sort()
+        new_dirs[rel_dir] = {"mtime": dir_mtime, "files": file_names, "dirs": dir_names}
+
+        if USE_GITIGNORE and ".gitignore" in file_names:
+            lines = _read_ignore_file(os.path.join(abs_dir, ".gitignore"))
+            if lines:
+                layers = layers + (IgnoreLayer(lines, rel_dir),)
+        for name in file_names:
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if is_ignored(layers, rel, False):
+                continue
+            stat = fresh_stats.get(name)
+            old = old_files.get(rel)
+            if stat is None:
+                # directory invariata: i nomi vengono dall’indice, ma la stat va riletta perché
+                # una modifica sul posto cambia size/mtime del file e non quello della directory
+                try:
+                    st = os.stat(os.path.join(abs_dir, name))
+                except OSError:
+                    continue
+                stat = (st.st_size, st.st_mtime_ns)
+            # hash e tipo restano validi solo se size e mtime non sono cambiati
+            unchanged = old is not None and (old[0], old[1]) == stat
+            digest = old[2] if unchanged else None
+            kind = old[3] if unchanged else None
+            if kind is None:
+                kind = classify_file(os.path.join(abs_dir, name), stat[0])
+            new_files[rel] = [stat[0], stat[1], digest, kind]
+            native_rel = rel.replace("/", os.sep) if native_sep else rel
+            batch.append(native_rel)
+            if kind != FILE_KIND_TEXT:
+                batch_kinds[native_rel] = kind
+        subdirs = []
+        for name in dir_names:
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if not is_ignored(layers, rel, True):
+                subdirs.append(rel)
+        # visita in profondità mantenendo l’ordine alfabetico
+        for sub in reversed(subdirs):
+            stack.append((sub, layers))
+        if len(batch) >= batch_size:
+            emit(batch, batch_kinds)
+            batch = []
+            batch_kinds = {}
+    if batch:
+        emit(batch, batch_kinds)
+    return {"version": FILE_INDEX_VERSION, "base_dir": base_dir,
+            "dirs": new_dirs, "files": new_files, "reread_dirs": reread}
+
+
+# ========================== CLASSIFICAZIONE FILE (BINARI / GENERATI) ==========================
+
+def _looks_generated(sample, size):
+    """Euristiche per output generato o minificato su un campione di testo."""
+    head = sample[:2048].lower()
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return True
+    if len(sample) < 1024:
+        return False
+    lines = sample.split(b"\n")
+    if len(lines) > 1 and len(lines[-1]) < len(sample):
+        lines = lines[:-1]  # l’ultima riga del campione può essere tagliata
+    longest = max(len(line) for line in lines)
+    average = len(sample) / max(len(lines), 1)
+    if longest > MINIFIED_MAX_LINE or average > MINIFIED_AVG_LINE:
+        return True
+    # file grandi con righe comunque lunghe: tipico di bundle e dump
+    return size > 512 * 1024 and average > MINIFIED_AVG_LINE / 2
+
+
+def classify_file(abs_path, size=None):
+    """
+    Ritorna FILE_KIND_TEXT, FILE_KIND_BINARY o FILE_KIND_GENERATED.
+    Usa nome/estensione, magic bytes, byte nulli nel campione iniziale e lunghezza delle righe.
+    """
+    name = os.path.basename(abs_path)
+    lower = name.lower()
+    ext = os.path.splitext(lower)[1]
+    if ext in BINARY_EXTENSIONS:
+        return FILE_KIND_BINARY
+    if name in GENERATED_FILE_NAMES or lower.endswith(GENERATED_SUFFIXES):
+        return FILE_KIND_GENERATED
+    try:
+        with open(abs_path, "rb") as f:
+            sample = f.read(CLASSIFY_SAMPLE_BYTES)
+            if size is None:
+                size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return FILE_KIND_TEXT
+    if not sample:
+        return FILE_KIND_TEXT
+    if sample.startswith(BINARY_MAGIC):
+        return FILE_KIND_BINARY
+    if sample.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return FILE_KIND_TEXT  # UTF-16 con BOM: contiene byte nulli ma è testo
+    if b"\x00" in sample:
+        return FILE_KIND_BINARY
+    control = sum(1 for b in sample if b < 32 and b not in (9, 10, 12, 13))
+    if control > len(sample) * 0.1:
+        return FILE_KIND_BINARY
+    if _looks_generated(sample, size):
+        return FILE_KIND_GENERATED
+    return FILE_KIND_TEXT
+
+
+def file_kind_label(kind):
+    return {FILE_KIND_BINARY: "binario", FILE_KIND_GENERATED: "generato"}.get(kind, "")
+
+
+# ========================== INDICE DEI PATH (ALBERO E RICERCA) ==========================
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _glob_literals(pattern):
+    """Parti letterali di un glob (fuori da *, ?, [..]) usabili per sfoltire i candidati."""
+    pattern = re.sub(r"\[[^\]]*\]", "*", pattern.replace("\\", ""))
+    return [part for part in re.split(r"[*?]+", pattern) if part]
+
+
+def _regex_literals(pattern):
+    """
+    Sequenze letterali sicuramente presenti in ogni match della regex (approssimazione
+    prudente: nessuna se c’è un’alternativa "|" o un flag inline; si fermano su metacaratteri
+    e quantificatori; il contenuto dei gruppi, anche speciali come (?P<..>) e (?!..), è
+    ignorato perché il gruppo può essere opzionale, ripetuto zero volte o non consumare testo).
+    """
+    if "|" in pattern or re.search(r"\(\?[aiLmsux-]+[:)]", pattern):
+        return []
+    literals, run = [], []
+    depth = 0
+    i, n = 0, len(pattern)
+
+    def flush():
+        if run:
+            literals.append("".join(run))
+            run.clear()
+
+    while i < n:
+        c = pattern[i]
+        if c == "\\":
+            flush()
+            i += 2
+            continue
+        if c == "[":
+            flush()
+            j = pattern.find("]", i + 2)
+            i = n if j == -1 else j + 1
+            continue
+        if c in "()":
+            flush()
+            depth += 1 if c == "(" else -1
+        elif depth > 0:
+            pass  # dentro un gruppo: nessun letterale è garantito
+        elif c in "?*{":
+            if run:
+                run.pop()  # il carattere quantificato può mancare
+            flush()
+            if c == "{":
+                j = pattern.find("}", i)
+                i = n if j == -1 else j + 1
+                continue
+        elif c in ".^$+":
+            flush()
+        else:
+            run.append(c)
+        i += 1
+    flush()
+    return literals
+
+
+def _fuzzy_pass(query, path, positions):
+    score, prev = 0, -2
+    base_start = path.rfind("/") + 1
+    for pos in positions:
+        if pos == prev + 1:
+            score += 5
+        if pos == 0 or path[pos - 1] in "/_-. ":
+            score += 3
+        if pos >= base_start:
+            score += 2
+        prev = pos
+    return score
+
+
+def fuzzy_score(query, path):
+    """
+    Punteggio quick-open: i caratteri di `query` devono comparire in ordine in `path`
+    (entrambi minuscoli, con '/'); premia caratteri consecutivi, inizi di segmento e match
+    nel nome del file, penalizza i path lunghi. None se non è una sottosequenza.
+    Prova l’allineamento più a sinistra e quello più a destra (che favorisce il nome file).
+    """
+    forward, pos = [], 0
+    for ch in query:
+        pos = path.find(ch, pos)
+        if pos < 0:
+            return None
+        forward.append(pos)
+        pos += 1
+    backward, pos = [], len(path)
+    for ch in reversed(query):
+        pos = path.rfind(ch, 0, pos)
+        backward.append(pos)
+    backward.reverse()
+    best = max(_fuzzy_pass(query, path, forward), _fuzzy_pass(query, path, backward))
+    return best * 100 - len(path)
+
+
+class PathIndex:
+    """
+    Indice in memoria dei file trovati dalla scansione, aggiornato a lotti:
+    elenco ordinato, mappa directory -> (sottodirectory, file) per popolare l’albero di
+    "Gestisci File" a richiesta, e indice di trigrammi sui path minuscoli per la ricerca.
+    I path usano il separatore del sistema, come all_files; la ricerca lavora con '/'.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._paths = []        # id -> path (solo in aggiunta: gli id restano stabili)
+        self._lower = []        # id -> path minuscolo con '/'
+        self._order = []        # id in ordine alfabetico di path
+        self._sorted_paths = []
+        self._sorted = True
+        self._known = set()
+        self._grams = {}        # trigramma -> array di id crescenti
+        self._last_fuzzy = ("", None)
+        self.dirs = {"": (set(), [])}  # dir_rel -> (nomi sottodirectory, path dei file)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, rel_path):
+        return rel_path in self._known
+
+    def add(self, paths):
+        grams = self._grams
+        for rel_path in paths:
+            if rel_path in self._known:
+                continue
+            self._known.add(rel_path)
+            path_id = len(self._paths)
+            low = rel_path.replace(os.sep, "/").lower()
+            self._paths.append(rel_path)
+            self._lower.append(low)
+            self._order.append(path_id)
+            for gram in _trigrams(low):
+                posting = grams.get(gram)
+                if posting is None:
+                    posting = grams[gram] = array("I")
+                posting.append(path_id)
+            self._sorted = False
+            parent = os.path.dirname(rel_path)
+            self._ensure_dir(parent)[1].append(rel_path)
+        self._last_fuzzy = ("", None)
+
+    def _ensure_dir(self, dir_rel):
+        node = self.dirs.get(dir_rel)
+        if node is None:
+            node = self.dirs[dir_rel] = (set(), [])
+            parent = os.path.dirname(dir_rel)
+            self._ensure_dir(parent)[0].add(os.path.basename(dir_rel))
+        return node
+
+    def _ensure_sorted(self):
+        if not self._sorted:
+            self._order.sort(key=self._paths.__getitem__)
+            self._sorted_paths = [self._paths[i] for i in self._order]
+            self._sorted = True
+
+    def sorted_paths(self):
+        self._ensure_sorted()
+        return self._sorted_paths
+
+    def children(self, dir_rel):
+        """(sottodirectory ordinate come path relativi, file ordinati) di una directory."""
+        subdirs, files = self.dirs.get(dir_rel, ((), ()))
+        return ([os.path.join(dir_rel, name) if dir_rel else name for name in sorted(subdirs)],
+                sorted(files))
+
+    def _subtree_bounds(self, dir_rel):
+        paths = self.sorted_paths()
+        if not dir_rel:
+            return paths, 0, len(paths)
+        prefix = dir_rel + os.sep
+        lo = bisect.bisect_left(paths, prefix)
+        hi = bisect.bisect_left(paths, prefix[:-1] + chr(ord(os.sep) + 1))
+        return paths, lo, hi
+
+    def subtree(self, dir_rel):
+        """Tutti i file sotto una directory ("" = tutti): un intervallo dell’elenco ordinato."""
+        paths, lo, hi = self._subtree_bounds(dir_rel)
+        return paths if not dir_rel else paths[lo:hi]
+
+    def subtree_size(self, dir_rel):
+        """Numero di file sotto una directory, senza copiarne l’elenco."""
+        _, lo, hi = self._subtree_bounds(dir_rel)
+        return hi - lo
+
+    # --- ricerca ---
+    def _candidates(self, literals):
+        """
+        Id che possono contenere tutti i letterali: la lista del trigramma più raro
+        (da verificare poi con il match vero). None = nessun trigramma utile, vanno visti tutti.
+        """
+        best = None
+        for literal in literals:
+            for gram in _trigrams(literal.lower()):
+                posting = self._grams.get(gram)
+                if posting is None:
+                    return ()
+                if best is None or len(posting) < len(best):
+                    best = posting
+        return best
+
+    def _scan(self, literals, test):
+        candidates = self._candidates(literals)
+        ids = range(len(self._paths)) if candidates is None else candidates
+        lower = self._lower
+        return [i for i in ids if test(lower[i])]
+
+    def _ranked(self, ids):
+        """Risultati di glob/regex/sottostringa: path più corti (meno annidati) prima."""
+        paths = self._paths
+        return [paths[i] for i in sorted(ids, key=lambda i: (len(paths[i]), paths[i]))]
+
+    def filter_substring(self, text):
+        """File il cui path contiene `text` (case-insensitive)."""
+        needle = text.replace(os.sep, "/").lower()
+        return self._ranked(self._scan([needle], lambda low: needle in low))
+
+    def filter_glob(self, pattern):
+        """
+        Glob come in .gitignore: con una '/' il pattern è ancorato alla radice
+        (src/**/*.ts), senza '/' vale per il nome del file a qualsiasi profondità (*.py).
+        """
+        pattern = pattern.replace(os.sep, "/").lower()
+        body = _gitignore_glob_to_regex(pattern.lstrip("/"))
+        prefix = "^" if "/" in pattern.rstrip("/") else "(?:^|/)"
+        matcher = re.compile(prefix + body + "$")
+        return self._ranked(self._scan(_glob_literals(pattern), lambda low: matcher.search(low)))
+
+    def filter_regex(self, pattern):
+        """Regex (case-insensitive) cercata ovunque nel path; solleva re.error se non valida."""
+        matcher = re.compile(pattern, re.IGNORECASE)
+        return self._ranked(self._scan(_regex_literals(pattern), lambda low: matcher.search(low)))
+
+    def filter_fuzzy(self, query):
+        """
+        Ricerca tipo quick-open ordinata per punteggio. Se la query estende la precedente
+        (digitazione) si riparte dai suoi risultati invece che da tutti i path.
+        """
+        query = query.replace(os.sep, "/").lower().replace(" ", "")
+        last_query, last_ids = self._last_fuzzy
+        if last_ids is not None and last_query and query.startswith(last_query):
+            ids = last_ids
+        else:
+            ids = range(len(self._paths))
+        lower = self._lower
+        # prefiltro in C: "[^a]*a[^b]*b..." riconosce le sottosequenze senza backtracking
+        is_subsequence = re.compile(
+            "".join(f"[^{re.escape(c)}]*{re.escape(c)}" for c in query)).match
+        scored = []
+        for i in ids:
+            low = lower[i]
+            if is_subsequence(low):
+                scored.append((-fuzzy_score(query, low), low, i))
+        scored.sort()
+        self._last_fuzzy = (query, [i for _, _, i in scored])
+        return [self._paths[i] for _, _, i in scored]
+
+    def search(self, query):
+        """
+        Interpreta la query di "Gestisci File": "re:<regex>" = regex, con *, ? o [..] = glob,
+        altrimenti fuzzy. Restituisce (modalità, risultati ordinati).
+        """
+        if query.startswith("re:"):
+            return "regex", self.filter_regex(query[3:])
+        if any(c in query for c in "*?["):
+            return "glob", self.filter_glob(query)
+        return "fuzzy", self.filter_fuzzy(query)
+
+
+# ========================== INDICE FILE PERSISTENTE ==========================
+
+def cache_dir_for(base_dir):
+    """Cartella cache del tool: <base_dir>/.codeshow (accanto a file_set)."""
+    return os.path.join(base_dir, CACHE_DIR_NAME)
+
+
+def load_file_index(base_dir):
+    """Legge l’indice persistente; None se assente, corrotto o di un’altra directory."""
+    path = os.path.join(cache_dir_for(base_dir), FILE_INDEX_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(data, dict) or data.get("version") != FILE_INDEX_VERSION
+            or os.path.normcase(data.get("base_dir", "")) != os.path.normcase(base_dir)):
+        return None
+    return data
+
+
+def save_file_index(base_dir, index):
+    """Scrive l’indice in modo atomico (file temporaneo + rename). Sicura da thread di lavoro."""
+    if not index:
+        return
+    cache_dir = cache_dir_for(base_dir)
+    path = os.path.join(cache_dir, FILE_INDEX_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({k: index[k] for k in ("version", "base_dir", "dirs", "files")},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[WARN] Impossibile salvare l’indice file: {e}", file=sys.stderr)
+
+
+def to_index_key(rel_path):
+    """Le chiavi dell’indice usano sempre '/' come separatore."""
+    return rel_path.replace(os.sep, "/") if os.sep != "/" else rel_path
+
+
+def compute_content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def detect_encoding(data):
+    """
+    Codifica del testo in `data`: BOM, UTF-8 valido, stima di charset_normalizer (se
+    installato), poi FALLBACK_ENCODINGS e latin-1. Non ritorna mai None.
+    """
+    for bom, encoding, _ in ENCODING_BOMS:
+        if data.startswith(bom):
+            return encoding
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if len(data) >= ENCODING_GUESS_MIN_BYTES:
+        try:
+            from charset_normalizer import from_bytes
+        except ImportError:
+            pass
+        else:
+            matches = from_bytes(data)
+            best = matches.best()
+            if best is not None:
+                # a parità di punteggio vincono le codifiche di ripiego configurate
+                preferred = [match.encoding for match in matches
+                             if match.encoding in FALLBACK_ENCODINGS and match.chaos <= best.chaos]
+                return preferred[0] if preferred else best.encoding
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            data.decode(encoding)
+            return encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return "latin-1"
+
+
+def decode_text(data, encoding=None):
+    """
+    Testo con newline normalizzati, come la lettura in modalità testo. Senza `encoding` la
+    codifica viene rilevata (detect_encoding); i byte non validi diventano U+FFFD.
+    """
+    content = data.decode(encoding or detect_encoding(data), errors="replace")
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+def _read_preview(f, size):
+    """
+    Testa e coda del file via mmap, tagliate a fine/inizio riga. La codifica è quella rilevata
+    sulla testa. Ritorna (testo, byte mostrati, codifica).
+    """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        head = mm[:PREVIEW_HEAD_BYTES]
+        tail = mm[max(size - PREVIEW_TAIL_BYTES, len(head)):]
+    cut = head.rfind(b"\n")
+    if cut > 0:
+        head = head[:cut + 1]
+    nl = tail.find(b"\n")
+    if 0 <= nl < len(tail) - 1:
+        tail = tail[nl + 1:]
+    encoding = detect_encoding(head)
+    omitted = size - len(head) - len(tail)
+    marker = (f"\n… [ANTEPRIMA TRONCATA: {omitted} byte omessi su {size}; "
+              f"usa \"Completo\" per caricare tutto il file] …\n\n")
+    # la coda non inizia con il BOM: si decodifica con la variante della codifica che non lo usa
+    tail_encoding = next((plain for bom, _, plain in ENCODING_BOMS if head.startswith(bom)), encoding)
+    return (decode_text(head, encoding) + marker + decode_text(tail, tail_encoding),
+            len(head) + len(tail), encoding)
+
+
+def read_text_file(path, max_bytes=None):
+    """
+    Legge un file come testo nella codifica rilevata (newline normalizzati come in modalità
+    testo). Se il file supera `max_bytes` (default MAX_FILE_BYTES; 0 = nessun limite) restituisce
+    solo un’anteprima testa/coda. Ritorna (contenuto, os.stat_result, info_troncamento o None,
+    hash dei byte o None per le anteprime, codifica) per aggiornare l’indice file.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_FILE_BYTES
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if max_bytes and st.st_size > max_bytes:
+            content, shown, encoding = _read_preview(f, st.st_size)
+            # niente hash: richiederebbe di leggere tutto il file
+            return content, st, {"size": st.st_size, "shown": shown}, None, encoding
+        data = f.read()
+    encoding = detect_encoding(data)
+    return decode_text(data, encoding), st, None, compute_content_hash(data), encoding
+
+
+def read_slot_file(path, kind, max_bytes=None):
+    """
+    Contenuto da mostrare in uno slot: per i file binari un segnaposto (nel prompt compare solo
+    il nome), altrimenti il testo o la sua anteprima. Stessi valori di ritorno di read_text_file.
+    """
+    with span("read_file") as sp:
+        if kind == FILE_KIND_BINARY:
+            st = os.stat(path)
+            sp.set(bytes=0)
+            return f"[File binario di {format_size(st.st_size)}: contenuto non mostrato]", st, None, None, None
+        result = read_text_file(path, max_bytes)
+        sp.set(bytes=result[2]["shown"] if result[2] else result[1].st_size)
+        return result
+
+
+def write_file_atomic(path, content, encoding="utf-8"):
+    """
+    Scrive il contenuto su un file temporaneo nella stessa cartella e lo rinomina sul file di
+    destinazione: chi legge vede il file vecchio o quello nuovo, mai uno scritto a metà.
+    Ritorna la stat del file scritto.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)  # mkstemp crea il file con 0600
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return os.stat(path)
+
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+# ========================== MODELLO SLOT ==========================
+# Ogni slot è un dict {"id", "name", "content", "hash", "widget"}; "hash" è l’hash del
+# contenuto, calcolato a richiesta e azzerato a ogni modifica. Nella GUI "widget" punta alla
+# colonna che mostra lo slot (se visibile) e le funzioni qui sotto la riallineano al modello;
+# senza interfaccia resta None.
+
+def make_slot(slot_id, name="", content=""):
+    return {"id": slot_id, "name": name, "content": content, "hash": None, "widget": None}
+
+
+def get_slot_name(slot):
+    widget = slot["widget"]
+    if widget is not None:
+        slot["name"] = widget["entry"].get()
+    return slot["name"]
+
+
+def get_slot_content(slot):
+    """Contenuto dello slot; se il widget è stato modificato dall’utente lo riallinea al modello."""
+    widget = slot["widget"]
+    if widget is not None and widget["text"].edit_modified():
+        slot["content"] = widget["text"].get("1.0", "end-1c")
+        slot["hash"] = None
+        widget["text"].edit_modified(False)
+    return slot["content"]
+
+
+def get_slot_hash(slot):
+    """Hash del contenuto attuale dello slot (ricalcolato solo dopo una modifica)."""
+    content = get_slot_content(slot)
+    if slot["hash"] is None:
+        slot["hash"] = compute_content_hash(content.encode("utf-8"))
+    return slot["hash"]
+
+
+def load_slots(base_dir, rel_paths, max_bytes=None, index=None):
+    """
+    Slot (senza widget) per i file indicati, nell’ordine della GUI (path ordinati). Il tipo di
+    file viene dall’indice persistente se lo conosce, altrimenti da classify_file.
+    """
+    slots = []
+    for rel in sorted(rel_paths):
+        abs_path = os.path.join(base_dir, rel)
+        entry = index["files"].get(to_index_key(rel)) if index else None
+        kind = entry[3] if entry is not None and entry[3] is not None else classify_file(abs_path)
+        try:
+            content, _, truncation, _, _ = read_slot_file(abs_path, kind, max_bytes)
+        except OSError as e:
+            print(f"[WARN] Impossibile leggere {rel}: {e}", file=sys.stderr)
+            continue
+        slot = make_slot(f"file{len(slots) + 1}", rel, content)
+        if kind == FILE_KIND_BINARY:
+            binary_slots.add(slot["id"])
+        if truncation is not None:
+            truncated_files[slot["id"]] = truncation
+        slots.append(slot)
+    return slots
+
+
+# ========================== COSTRUZIONE PROMPT ==========================
+# Un solo costruttore per "Genera Prompt", "Invia a DeepSeek" e la riga di comando: legge i
+# contenuti dal modello degli slot e scrive il prompt a pezzi su un writer.
+# La sezione di ogni file è messa in cache per (etichetta, hash del contenuto): dopo aver
+# modificato uno slot si ri-renderizza solo quello.
+
+class StringWriter:
+    """Accumula i pezzi del prompt e li unisce una sola volta (niente += ripetuti)."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+    def close(self):
+        pass
+
+
+class ClipboardWriter(StringWriter):
+    def close(self):
+        import pyperclip  # solo per la clipboard: la riga di comando scrive di norma su stdout
+        text = self.getvalue()
+        with span("clipboard_copy", chars=len(text)):
+            pyperclip.copy(text)
+
+
+class FileWriter:
+    """Scrive il prompt direttamente su file, sezione per sezione."""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, "w", encoding="utf-8")
+
+    def write(self, text):
+        self.handle.write(text)
+
+    def close(self):
+        self.handle.close()
+
+
+class SocketWriter:
+    """Invia il prompt (UTF-8) a un socket TCP man mano che viene costruito."""
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, timeout=10)
+
+    def write(self, text):
+        self.sock.sendall(text.encode("utf-8"))
+
+    def close(self):
+        self.sock.close()
+
+
+def open_prompt_writer(target=None):
+    """
+    Writer per la destinazione del prompt: "clipboard", "file:<path>" o "tcp:<host>:<port>"
+    (default: CODESHOW_PROMPT_OUTPUT).
+    """
+    target = target or PROMPT_OUTPUT
+    if target.startswith("file:"):
+        return FileWriter(os.path.expanduser(target[5:]))
+    if target.startswith("tcp:"):
+        host, _, port = target[4:].rpartition(":")
+        return SocketWriter(host or "127.0.0.1", int(port))
+    return ClipboardWriter()
+
+
+def describe_prompt_target(target=None):
+    target = target or PROMPT_OUTPUT
+    if target.startswith("file:"):
+        return f"nel file {os.path.expanduser(target[5:])}"
+    if target.startswith("tcp:"):
+        return f"su {target[4:]}"
+    return "nella clipboard"
+
+
+def prompt_file_label(slot, mode=PACK_FULL):
+    """
+    Nome del file nel prompt; gli slot in anteprima sono dichiarati come parziali e quelli
+    ridotti dal budget token come scheletro/omessi.
+    """
+    name = get_slot_name(slot)
+    if slot["id"] in binary_slots:
+        return f"{name} [BINARY FILE: content omitted]"
+    if mode == PACK_SKELETON:
+        return f"{name} [SKELETON: imports and signatures only, bodies omitted to fit the context budget]"
+    if mode == PACK_OMITTED:
+        return f"{name} [CONTENT OMITTED: does not fit the context budget]"
+    info = truncated_files.get(slot["id"])
+    if info:
+        return (f"{name} [PARTIAL CONTENT: head/tail preview, "
+                f"{info['shown']} of {info['size']} bytes shown]")
+    return name
+
+
+def prompt_file_content(slot):
+    """Contenuto dello slot per il prompt (vuoto per i file binari)."""
+    if slot["id"] in binary_slots:
+        return ""
+    return get_slot_content(slot).strip()
+
+
+def render_file_section(slot, mode=PACK_FULL):
+    """
+    Sezione "<nome>\\n<contenuto>\\n\\n" di uno slot, dalla cache se il contenuto non è cambiato.
+    `mode` è la resa scelta dal budget: completo, scheletro o solo nome.
+    """
+    label = prompt_file_label(slot, mode)
+    key = (label, None if slot["id"] in binary_slots else get_slot_hash(slot))
+    section = prompt_section_cache.get(key)
+    if section is None:
+        if mode == PACK_SKELETON:
+            body = get_slot_skeleton(slot)
+        elif mode == PACK_OMITTED:
+            body = ""
+        else:
+            body = prompt_file_content(slot)
+        section = prompt_section_cache[key] = f"{label}\n{body}\n\n"
+        prompt_cache_stats["rendered"] += 1
+    else:
+        prompt_cache_stats["cached"] += 1
+    return key, section
+
+
+def write_prompt(writer, slots, tail, user_request=None, plan=None):
+    """
+    Scrive il prompt completo (elenco file, contenuti, istruzioni finali) su `writer`.
+    `plan` ({slot id: resa}) viene da plan_prompt_budget; senza piano tutto è completo.
+    """
+    plan = plan or {}
+    with span("prompt_build", files=len(slots)) as sp:
+        sections = [render_file_section(slot, plan.get(slot["id"], PACK_FULL)) for slot in slots]
+        writer.write("User has these files:\n")
+        writer.write("".join(f"{key[0]}\n" for key, _ in sections))
+        writer.write("\nContents of the files are:\n")
+        for _, section in sections:
+            writer.write(section)
+        writer.write(tail)
+        if user_request is not None:
+            writer.write("\n" + user_request)
+        sp.set(chars=sum(len(section) for _, section in sections))
+    # le cache tengono solo le voci dei contenuti attuali (tutte le rese, per i prossimi piani)
+    used = {key[1] for key, _ in sections}
+    for cache in (prompt_section_cache, section_token_cache, skeleton_cache):
+        for key in [k for k in cache if k[1] not in used]:
+            del cache[key]
+
+
+def build_prompt(slots, tail, user_request=None, plan=None):
+    writer = StringWriter()
+    write_prompt(writer, slots, tail, user_request, plan)
+    return writer.getvalue()
+
+
+# Formato delle modifiche mirate, riconosciuto da deepseek_patch.parse_patches
+PATCH_FORMAT_INSTRUCTIONS = (
+    "For each change, write the file name (exact path) on its own line, followed by one or more blocks "
+    "in exactly this format:\n"
+    "<<<<<<< SEARCH\n"
+    "(the exact current lines of the file, with a few unchanged lines around the change so the location is unique)\n"
+    "=======\n"
+    "(the lines that replace them)\n"
+    ">>>>>>> REPLACE\n"
+    "To create a new file, leave the SEARCH part empty. "
+)
+
+
+def large_patch_slots(slots):
+    """Slot grandi (oltre PATCH_MODE_MIN_CHARS) per cui si chiedono solo modifiche mirate."""
+    if PATCH_MODE_MIN_CHARS <= 0:
+        return []
+    return [slot for slot in slots
+            if slot["id"] not in binary_slots and get_slot_name(slot).strip()
+            and len(get_slot_content(slot)) >= PATCH_MODE_MIN_CHARS]
+
+
+def prompt_tail(mode, slots):
+    """
+    Finale del prompt per la "Output preference": "full" (file completi, default), "patches"
+    (solo modifiche) o "explain" (domanda). Con "full" i file grandi sono comunque chiesti
+    come patch (vedi large_patch_slots).
+    """
+    if mode == "patches":
+        return (
+            "DO NOT return the full, updated content of the files involved. "
+            "YOU MUST provide only the changes to be implemented. "
+            + PATCH_FORMAT_INSTRUCTIONS +
+            "Execute the following request, providing only the changes as described above:\n"
+        )
+    if mode == "explain":
+        return "I want to ask you something about this application, read here my request:"
+    tail = (
+        "Please return the fully updated code of the files involved to fulfill the following request.  \n"
+        "If, to fulfill the following request, for example, it is necessary to edit file 1 and file 3 (for example), \n"
+        "return the fully updated files for file 1 and file 3.\n"
+    )
+    large = large_patch_slots(slots)
+    if large:
+        names = ", ".join(get_slot_name(slot).strip() for slot in large)
+        tail += (
+            f"EXCEPTION: these files are large, so DO NOT return their full content: {names}. "
+            "For them provide only the changes. " + PATCH_FORMAT_INSTRUCTIONS + "\n"
+        )
+    return tail + "Follow the request:"
+
+
+# ========================== BUDGET TOKEN E SCHELETRI ==========================
+# Stima dei token del prompt e, in modalità "Adatta al budget", riduzione dei file che non
+# ci stanno a scheletro strutturale (import, classi, firme) o, se non basta, al solo nome.
+
+def _char_token_count(text):
+    """Stima veloce: ~CHARS_PER_TOKEN caratteri per token (media tipica sul codice)."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+
+def _load_tokenizer():
+    """Tokenizer reale se disponibile (tiktoken), altrimenti la stima a caratteri."""
+    if TOKENIZER_NAME in ("auto", "tiktoken"):
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            return "tiktoken", lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            if TOKENIZER_NAME == "tiktoken":
+                print("[WARN] tiktoken non disponibile: uso la stima a caratteri.")
+    return "chars", _char_token_count
+
+
+def set_tokenizer(count_fn, name="custom"):
+    """Sostituisce il contatore di token (funzione testo -> numero di token)."""
+    global token_counter, tokenizer_name
+    token_counter, tokenizer_name = count_fn, name
+    section_token_cache.clear()
+
+
+def estimate_tokens(text):
+    global token_counter, tokenizer_name
+    if token_counter is None:
+        tokenizer_name, token_counter = _load_tokenizer()
+    return token_counter(text)
+
+
+def format_tokens(n):
+    return f"{n / 1000:.1f}k" if n >= 1000 else str(n)
+
+
+def python_skeleton(source):
+    """Import, costanti di modulo, classi e firme di funzioni (con docstring in una riga) via ast."""
+    tree = ast.parse(source)
+    out = []
+
+    def doc_line(node, indent):
+        doc = ast.get_docstring(node)
+        if doc:
+            out.append(f'{indent}    """{doc.strip().splitlines()[0]}"""')
+
+    def visit(body, indent):
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                out.append(indent + ast.unparse(node))
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                for deco in node.decorator_list:
+                    out.append(f"{indent}@{ast.unparse(deco)}")
+                prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                out.append(f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){returns}:")
+                doc_line(node, indent)
+                out.append(f"{indent}    ...")
+            elif isinstance(node, ast.ClassDef):
+                for deco in node.decorator_list:
+                    out.append(f"{indent}@{ast.unparse(deco)}")
+                bases = [ast.unparse(b) for b in node.bases + node.keywords]
+                out.append(f"{indent}class {node.name}" + (f"({', '.join(bases)})" if bases else "") + ":")
+                doc_line(node, indent)
+                visit(node.body, indent + "    ")
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and not indent:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                if all(isinstance(t, ast.Name) and t.id.isupper() for t in targets):
+                    line = ast.unparse(node)
+                    out.append(line if len(line) <= 120 else line[:117] + "...")
+            elif isinstance(node, ast.If) and not indent:
+                visit(node.body, indent)  # es. import condizionali, if __name__ == ...
+                visit(node.orelse, indent)
+            elif isinstance(node, ast.Try) and not indent:
+                visit(node.body, indent)
+
+    visit(tree.body, "")
+    return "\n".join(out)
+
+
+_JS_STRIP = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//.*$|/\*.*?\*/')
+_JS_CONTAINER = re.compile(
+    r"^\s*(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:abstract\s+)?(?:class|interface|enum)\b")
+_JS_DECL = re.compile(
+    r"^\s*(?:export\b|import\b|(?:declare\s+)?(?:async\s+)?(?:function\b|type\b|namespace\b))")
+_JS_ARROW = re.compile(
+    r"^\s*(?:const|let|var)\s+[\w$]+\s*(?::[^=]+)?=\s*(?:async\s+)?"
+    r"(?:function\b|(?:\([^)]*\)|[\w$]+)\s*(?::[^=]+)?=>|require\()")
+_JS_MEMBER = re.compile(
+    r"^\s*(?:(?:public|private|protected|static|readonly|async|get|set|override|abstract|declare)\s+)*"
+    r"[\w$#]+\s*(?:<[^>]*>)?\s*(?:\(|[?!]?\s*[:=]|,|$)")
+_JS_CONTROL = re.compile(r"^\s*(?:if|for|while|switch|catch|return|else|do|try|super|this)\b")
+
+
+def _js_signature(raw, code):
+    line = raw.rstrip()
+    if code.rstrip().endswith("{"):
+        return line[:line.rindex("{")].rstrip() + " { ... }"
+    return line
+
+
+def js_skeleton(source):
+    """
+    Parser leggero per JS/TS: import/export, dichiarazioni di primo livello (funzioni, classi,
+    interfacce, tipi, arrow function) e membri al primo livello di classi e interfacce.
+    Le graffe sono contate dopo aver tolto stringhe e commenti.
+    """
+    out = []
+    depth = 0
+    container_depths = []  # profondità dei corpi di classi/interfacce aperti
+    keep_until = None      # import/export multi-riga: copiati finché le graffe non si chiudono
+    in_comment = False
+    for raw in source.splitlines():
+        line = raw
+        if in_comment:
+            end = line.find("*/")
+            if end < 0:
+                continue
+            line = line[end + 2:]
+            in_comment = False
+        code = _JS_STRIP.sub('""', line)
+        if "/*" in code:
+            code = code[:code.index("/*")]
+            in_comment = True
+        opened = code.count("{") - code.count("}")
+        if keep_until is not None:
+            out.append(raw.rstrip())
+        elif depth == 0 and code.strip():
+            if _JS_CONTAINER.match(code) and opened > 0:
+                out.append(raw.rstrip())
+                container_depths.append(depth + opened)
+            elif re.match(r"^\s*(?:import|export)\s*(?:type\s*)?\{", code) and opened > 0:
+                out.append(raw.rstrip())
+                keep_until = depth
+            elif _JS_CONTAINER.match(code) or _JS_DECL.match(code) or _JS_ARROW.match(code):
+                out.append(_js_signature(raw, code))
+        elif container_depths and depth == container_depths[-1] and code.strip():
+            if _JS_MEMBER.match(code) and not _JS_CONTROL.match(code):
+                out.append(_js_signature(raw, code))
+        depth = max(depth + opened, 0)
+        if keep_until is not None and depth <= keep_until:
+            keep_until = None
+        while container_depths and depth < container_depths[-1]:
+            container_depths.pop()
+            out.append("    " * len(container_depths) + "}")
+    return "\n".join(out)
+
+
+SKELETON_BUILDERS = {
+    ".py": python_skeleton, ".pyi": python_skeleton,
+    ".js": js_skeleton, ".jsx": js_skeleton, ".mjs": js_skeleton, ".cjs": js_skeleton,
+    ".ts": js_skeleton, ".tsx": js_skeleton, ".mts": js_skeleton, ".cts": js_skeleton,
+}
+
+
+def build_skeleton(name, content):
+    """Scheletro strutturale del file, o None se il linguaggio non è supportato/il parsing fallisce."""
+    builder = SKELETON_BUILDERS.get(os.path.splitext(name)[1].lower())
+    if builder is None:
+        return None
+    try:
+        skeleton = builder(content)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    return skeleton if skeleton.strip() else None
+
+
+def get_slot_skeleton(slot):
+    """Scheletro dello slot, in cache per hash del contenuto."""
+    key = (get_slot_name(slot), get_slot_hash(slot))
+    if key not in skeleton_cache:
+        skeleton_cache[key] = build_skeleton(key[0], get_slot_content(slot))
+    return skeleton_cache[key]
+
+
+def section_tokens(slot, mode=PACK_FULL):
+    key, section = render_file_section(slot, mode)
+    tokens = section_token_cache.get(key)
+    if tokens is None:
+        tokens = section_token_cache[key] = estimate_tokens(section)
+    return tokens
+
+
+def plan_prompt_budget(slots, fixed_text, budget):
+    """
+    Sceglie la resa di ogni slot ({id: PACK_FULL | PACK_SKELETON | PACK_OMITTED}) perché il prompt
+    stia in `budget` token: riduce prima i file più grandi a scheletro, poi (se ancora non basta)
+    omette il contenuto degli scheletri più grandi. Ritorna (piano, report).
+    """
+    plan = {slot["id"]: PACK_FULL for slot in slots}
+    full = {slot["id"]: section_tokens(slot) for slot in slots}
+    fixed = estimate_tokens(fixed_text)
+    total_full = fixed + sum(full.values())
+    total = total_full
+    for slot in sorted(slots, key=lambda s: full[s["id"]], reverse=True):
+        if total <= budget:
+            break
+        if slot["id"] in binary_slots or get_slot_skeleton(slot) is None:
+            continue
+        skeleton_tokens = section_tokens(slot, PACK_SKELETON)
+        if skeleton_tokens < full[slot["id"]]:
+            plan[slot["id"]] = PACK_SKELETON
+            total -= full[slot["id"]] - skeleton_tokens
+    if total > budget:
+        by_id = {slot["id"]: slot for slot in slots}
+        current = {sid: (full[sid] if mode == PACK_FULL else section_tokens(by_id[sid], mode))
+                   for sid, mode in plan.items()}
+        for slot in sorted(slots, key=lambda s: current[s["id"]], reverse=True):
+            if total <= budget:
+                break
+            omitted_tokens = section_tokens(slot, PACK_OMITTED)
+            if omitted_tokens < current[slot["id"]]:
+                total -= current[slot["id"]] - omitted_tokens
+                plan[slot["id"]] = PACK_OMITTED
+    report = {
+        "budget": budget,
+        "total": total,
+        "total_full": total_full,
+        "saved": total_full - total,
+        "skeleton": [get_slot_name(s) for s in slots if plan[s["id"]] == PACK_SKELETON],
+        "omitted": [get_slot_name(s) for s in slots if plan[s["id"]] == PACK_OMITTED],
+        "tokenizer": tokenizer_name,
+    }
+    return plan, report
+
+
+def describe_budget_report(report):
+    text = (f"≈ {format_tokens(report['total'])} / {format_tokens(report['budget'])} token "
+            f"({report['tokenizer']})")
+    downgraded = report["skeleton"] + report["omitted"]
+    if downgraded:
+        text += f" · risparmiati {format_tokens(report['saved'])}"
+    if report["skeleton"]:
+        names = ", ".join(report["skeleton"][:5])
+        more = len(report["skeleton"]) - 5
+        text += f" · scheletro: {names}" + (f" e altri {more}" if more > 0 else "")
+    if report["omitted"]:
+        names = ", ".join(report["omitted"][:5])
+        more = len(report["omitted"]) - 5
+        text += f" · omessi: {names}" + (f" e altri {more}" if more > 0 else "")
+    if report["total"] > report["budget"]:
+        text += " · OLTRE IL BUDGET"
+    return text
+
+
+def prompt_plan(slots, tail, user_request=None, fit_budget=False, budget=TOKEN_BUDGET):
+    """
+    Piano di resa del prompt e stima dei token: tutto completo, o adattato a `budget` se
+    `fit_budget`. Ritorna (piano o None, report per describe_budget_report).
+    """
+    with span("prompt_plan", files=len(slots)) as sp:
+        fixed_text = "User has these files:\n\nContents of the files are:\n" + tail + (user_request or "")
+        fixed_text += "".join(prompt_file_label(slot) + "\n" for slot in slots)
+        if fit_budget:
+            plan, report = plan_prompt_budget(slots, fixed_text, budget)
+        else:
+            total = estimate_tokens(fixed_text) + sum(section_tokens(slot) for slot in slots)
+            plan, report = None, {"budget": budget, "total": total, "total_full": total, "saved": 0,
+                                  "skeleton": [], "omitted": [], "tokenizer": tokenizer_name}
+        sp.set(tokens=report["total"])
+    return plan, report
+
+
+# ========================== PROMPT DI FOLLOW-UP (SOLO DIFFERENZE) ==========================
+# Per ogni canale ("prompt" = clipboard/file/socket, "api" = DeepSeek) si ricorda cosa è stato
+# inviato l’ultima volta: {nome file: (hash, contenuto)}. In modalità follow-up il prompt
+# contiene solo i diff unificati dei file cambiati, i file nuovi e l’elenco degli invariati.
+
+def build_sent_snapshot(slots, plan=None):
+    """Contenuti degli slot come entrano nel prompt; scheletri/omessi non contano come inviati."""
+    plan = plan or {}
+    snapshot = {}
+    for slot in slots:
+        name = get_slot_name(slot)
+        if not name or slot["id"] in binary_slots or plan.get(slot["id"], PACK_FULL) != PACK_FULL:
+            continue
+        snapshot[name] = (get_slot_hash(slot), prompt_file_content(slot))
+    return snapshot
+
+
+def record_sent_snapshot(channel, slots, plan=None):
+    """Registra i contenuti appena inviati (vedi build_sent_snapshot)."""
+    sent_snapshots[channel] = build_sent_snapshot(slots, plan)
+
+
+def compare_with_snapshot(slots, snapshot):
+    """Divide gli slot in (modificati, invariati, nuovi) rispetto all’ultimo invio, più i nomi rimossi."""
+    changed, unchanged, added = [], [], []
+    present = set()
+    for slot in slots:
+        name = get_slot_name(slot)
+        present.add(name)
+        previous = snapshot.get(name)
+        if previous is None or slot["id"] in binary_slots:
+            added.append(slot)
+        elif previous[0] == get_slot_hash(slot):
+            unchanged.append(slot)
+        else:
+            changed.append(slot)
+    removed = [name for name in snapshot if name not in present]
+    return changed, unchanged, added, removed
+
+
+def render_file_diff(slot, previous_content):
+    """Diff unificato tra il contenuto inviato l’ultima volta e quello attuale dello slot."""
+    name = get_slot_name(slot)
+    diff = difflib.unified_diff(
+        previous_content.splitlines(), prompt_file_content(slot).splitlines(),
+        fromfile=f"a/{name}", tofile=f"b/{name}", lineterm="", n=FOLLOWUP_DIFF_CONTEXT)
+    return "\n".join(diff) + "\n\n"
+
+
+class TokenCountingWriter:
+    """Inoltra i pezzi a un altro writer contando i token stimati."""
+
+    def __init__(self, target):
+        self.target = target
+        self.tokens = 0
+
+    def write(self, text):
+        self.tokens += estimate_tokens(text)
+        self.target.write(text)
+
+    def close(self):
+        self.target.close()
+
+
+def write_followup_prompt(writer, slots, snapshot, tail, user_request=None, plan=None):
+    """
+    Scrive un prompt di follow-up su `writer`: diff dei file modificati, contenuto dei file nuovi,
+    nomi dei file invariati e rimossi. Ritorna le statistiche per il riepilogo.
+    """
+    plan = plan or {}
+    changed, unchanged, added, removed = compare_with_snapshot(slots, snapshot)
+    writer.write("Follow-up: the files below are the same ones I sent in my previous message.\n")
+    if changed:
+        writer.write("\nThese files changed since then (unified diffs against the version I sent):\n\n")
+        for slot in changed:
+            writer.write(render_file_diff(slot, snapshot[get_slot_name(slot)][1]))
+    if added:
+        writer.write("\nNew files:\n")
+        for slot in added:
+            writer.write(render_file_section(slot, plan.get(slot["id"], PACK_FULL))[1])
+    if unchanged:
+        writer.write("\nUnchanged files (same content as in my previous message):\n")
+        writer.write("".join(f"{get_slot_name(slot)}\n" for slot in unchanged))
+    if removed:
+        writer.write("\nFiles no longer included (ignore them):\n")
+        writer.write("".join(f"{name}\n" for name in removed))
+    writer.write("\n" + tail)
+    if user_request is not None:
+        writer.write("\n" + user_request)
+    return {"changed": len(changed), "unchanged": len(unchanged),
+            "added": len(added), "removed": len(removed)}
+
+
+def describe_followup_stats(stats, followup_tokens, full_tokens, history_tokens=0):
+    text = (f"follow-up: {stats['changed']} modificati (diff), {stats['added']} nuovi, "
+            f"{stats['unchanged']} invariati · ≈ {format_tokens(followup_tokens)} token ")
+    if history_tokens:
+        text += f"(+ {format_tokens(history_tokens)} di conversazione) "
+    return text + f"invece di {format_tokens(full_tokens)}"
+
+
+# ========================== API DEEPSEEK E STREAMING (SSE) ==========================
+# Con "stream": true DeepSeek invia la risposta come server-sent events (righe "data: {...}"
+# separate da una riga vuota, chiusura con "data: [DONE]"); i blocchi "nome file + ``` ... ```"
+# completi si possono applicare man mano (IncrementalFileParser).
+
+def build_chat_payload(prompt_text, history=()):
+    """Corpo della richiesta chat-completions: system prompt, conversazione precedente, prompt."""
+    return {
+        "model": DEEPSEEK_MODEL,
+        "messages": [
+            {"role": "system", "content": DEEPSEEK_SYSTEM_PROMPT},
+            *history,
+            {"role": "user", "content": prompt_text},
+        ],
+        "temperature": 0.2,
+    }
+
+
+def response_text(data):
+    try:
+        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    except Exception:
+        return ""
+
+
+def response_usage(data):
+    """Token di prompt e risposta riportati dall’API ("usage"), per gli span HTTP."""
+    usage = data.get("usage") if isinstance(data, dict) else None
+    if not isinstance(usage, dict):
+        return {}
+    return {"tokens": usage.get("total_tokens", 0), "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0)}
+
+
+class SSEDecoder:
+    """Decoder incrementale di server-sent events: feed(bytes) -> lista dei campi data completi."""
+
+    def __init__(self):
+        self._buffer = b""
+        self._data_lines = []
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        events = []
+        while True:
+            newline = self._buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = self._buffer[:newline].rstrip(b"\r").decode("utf-8", errors="replace")
+            self._buffer = self._buffer[newline + 1:]
+            if not line:
+                if self._data_lines:
+                    events.append("\n".join(self._data_lines))
+                    self._data_lines = []
+            elif line.startswith("data:"):
+                value = line[5:]
+                self._data_lines.append(value[1:] if value.startswith(" ") else value)
+            # altri campi (event:, id:, retry:) e commenti ":" non servono
+        return events
+
+
+# stessa forma del passo 1 di parse_deepseek_files: nome file su una riga + blocco ``` ... ```
+STREAM_FENCED_FILE_RE = re.compile(
+    r'(?m)^\s*([^\n\r]+?\.[A-Za-z0-9]{1,10})\s*\n```[^`\n]*\n(.*?)\n```', re.DOTALL)
+
+
+class IncrementalFileParser:
+    """
+    Riconosce durante lo streaming le coppie "nome file + blocco recintato" già chiuse.
+    Un blocco è considerato completo solo quando dopo la ``` di chiusura è arrivato un
+    altro carattere (la riga potrebbe ancora diventare ````...).
+    I delta restano in `parts` e vengono uniti solo quando serve; la ricerca riparte solo
+    quando la coda ricevuta contiene una nuova riga ``` (o subito dopo una chiusura in
+    sospeso), così i blocchi lunghi non vengono riscansionati a ogni delta.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.received = 0   # caratteri ricevuti finora
+        self._tail = ""     # ultimi 3 caratteri: la ``` può arrivare a cavallo di due delta
+        self._pos = 0
+        self._pending = False
+
+    @property
+    def text(self):
+        """Risposta ricevuta finora (i pezzi vengono fusi in uno alla prima lettura)."""
+        if len(self.parts) > 1:
+            self.parts[:] = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    def feed(self, delta):
+        self.parts.append(delta)
+        self.received += len(delta)
+        tail = self._tail + delta
+        self._tail = tail[-3:]
+        completed = []
+        if not (self._pending or ("`" in delta and "\n```" in tail)):
+            return completed
+        self._pending = False
+        text = self.text
+        while True:
+            m = STREAM_FENCED_FILE_RE.search(text, self._pos)
+            if not m:
+                break
+            if m.end() >= len(text):
+                self._pending = True
+                break
+            completed.append((m.group(1).strip(), m.group(2)))
+            self._pos = m.end()
+        return completed
+
+
+def iter_stream_deltas(resp, cancel_event):
+    """Testi "delta" di una risposta chat-completions in streaming (si ferma su [DONE] o annullamento)."""
+    decoder = SSEDecoder()
+    for chunk in resp.iter_content(chunk_size=None):
+        if cancel_event.is_set():
+            return
+        for data in decoder.feed(chunk):
+            if data.strip() == "[DONE]":
+                return
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            choices = event.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+
+# ========================== RIGA DI COMANDO ==========================
+
+def scan_file_list(base_dir, use_index=True):
+    """
+    Scansione completa (sincrona) di base_dir. Ritorna (path relativi, {path: tipo} dei file non
+    di testo, nuovo indice); l’indice persistente evita di rileggere le directory invariate.
+    """
+    files, kinds = [], {}
+
+    def emit(batch, batch_kinds):
+        files.extend(batch)
+        kinds.update(batch_kinds)
+
+    with span("scan") as sp:
+        index = scan_directory(base_dir, emit, index=load_file_index(base_dir) if use_index else None)
+        sp.set(files=len(files), dirs_reread=index.pop("reread_dirs", 0))
+    if use_index:
+        save_file_index(base_dir, index)
+    return files, kinds, index
+
+
+def select_files(base_dir, fileset=None):
+    """
+    File da mettere negli slot, come all’avvio della GUI: il file_set N (o l’ultimo se `fileset`
+    è None), altrimenti tutti i file di testo della directory ("all" forza la scansione).
+    Ritorna (path relativi, descrizione della provenienza, indice o None).
+    """
+    set_dir = file_set_dir_for(base_dir)
+    index = load_file_index(base_dir)
+    path = None
+    if fileset not in (None, "all"):
+        path = file_set_path(set_dir, int(fileset))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"file_set {fileset} non trovato: {path}")
+    elif fileset is None:
+        path, _ = latest_file_set(set_dir)
+    if path is not None:
+        # nessuna scansione qui: l’indice su disco può essere più vecchio, una stat per file
+        rels, drifted, missing = check_file_set(base_dir, read_file_set_data(path))
+        if missing:
+            print(f"[WARN] {len(missing)} file del file_set non esistono più.", file=sys.stderr)
+        if drifted:
+            print(f"[WARN] {len(drifted)} file cambiati dopo il salvataggio del file_set: "
+                  + ", ".join(drifted[:10]) + (" …" if len(drifted) > 10 else ""), file=sys.stderr)
+        return rels, os.path.basename(path), index
+    files, kinds, index = scan_file_list(base_dir)
+    return [rel for rel in files if rel not in kinds], "tutti i file di testo", index
+
+
+def _cli_slots(args):
+    base_dir = os.path.abspath(args.dir)
+    rels, origin, index = select_files(base_dir, args.fileset)
+    slots = load_slots(base_dir, rels, 0 if args.full_files else None, index)
+    print(f"[INFO] {len(slots)} file da {origin}.", file=sys.stderr)
+    return base_dir, slots
+
+
+def _cli_prompt_text(args, slots):
+    tail = prompt_tail(args.mode, slots)
+    user_request = args.request
+    plan, report = prompt_plan(slots, tail, user_request, fit_budget=args.budget)
+    print(f"[INFO] Token prompt: {describe_budget_report(report)}", file=sys.stderr)
+    return build_prompt(slots, tail, user_request, plan), plan
+
+
+def cmd_prompt(args):
+    _, slots = _cli_slots(args)
+    text, _ = _cli_prompt_text(args, slots)
+    if args.output in (None, "-"):
+        sys.stdout.write(text)
+        return 0
+    writer = open_prompt_writer(args.output)
+    try:
+        writer.write(text)
+    finally:
+        writer.close()
+    print(f"[INFO] Prompt scritto {describe_prompt_target(args.output)}.", file=sys.stderr)
+    return 0
+
+
+def cmd_scan(args):
+    base_dir = os.path.abspath(args.dir)
+    t0 = time.perf_counter()
+    files, kinds, _ = scan_file_list(base_dir, use_index=not args.no_index)
+    for rel in files:
+        label = file_kind_label(kinds.get(rel))
+        print(f"{rel}\t{label}" if label else rel)
+    print(f"[INFO] {len(files)} file ({len(kinds)} binari/generati) in "
+          f"{time.perf_counter() - t0:.2f}s.", file=sys.stderr)
+    return 0
+
+
+def cmd_filesets(args):
+    set_dir = file_set_dir_for(os.path.abspath(args.dir))
+    if not os.path.isdir(set_dir):
+        return 0
+    for entry in load_file_set_index(set_dir)["sets"]:
+        print(f"{entry['n']}\t{entry['count']} file\t{entry['created'] or '?'}\t"
+              f"{os.path.join(set_dir, entry['name'])}")
+    return 0
+
+
+# nome di file "vero" in una risposta: componenti senza spazi né simboli da prosa (**x.py**, x.py:)
+RESPONSE_FILE_NAME_RE = re.compile(r"[\w.+@-]+(?:/[\w.+@-]+)*")
+
+
+def resolve_response_path(base_dir, name):
+    """
+    Percorso reale del file `name` indicato dal modello, oppure None se non va scritto: nome
+    assoluto, con "..", che non sembra un path relativo (spazi e simboli sono ammessi solo per
+    un file che esiste già) o che, anche seguendo i symlink, esce da base_dir.
+    """
+    name = name.strip()
+    if not name or os.path.isabs(name) or ".." in re.split(r"[\\/]", name):
+        return None
+    root = os.path.realpath(base_dir)
+    if not RESPONSE_FILE_NAME_RE.fullmatch(name) and not os.path.isfile(os.path.join(root, name)):
+        return None
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+def apply_response_to_dir(base_dir, content, write=False):
+    """
+    Applica una risposta del modello (file completi e modifiche mirate) ai file di base_dir.
+    Senza `write` mostra solo cosa cambierebbe. I nomi che resolve_response_path rifiuta
+    vengono saltati. Ritorna il numero di modifiche fallite o saltate.
+    """
+    from deepseek_parser import parse_deepseek_files
+    from deepseek_patch import apply_edits, parse_patches
+    with span("response_parse", chars=len(content)) as sp:
+        patches, remaining = parse_patches(content)
+        files_map, _ = parse_deepseek_files(remaining)
+        sp.set(files=len(files_map), patches=len(patches))
+    failed = 0
+    updates = {}
+    encodings = {}  # file esistenti: si riscrivono nella codifica in cui sono stati letti
+    for name, body in files_map.items():
+        updates[name.strip()] = body
+    for patch in patches:
+        if patch.path is None:
+            failed += len(patch.edits)
+            print(f"[WARN] {len(patch.edits)} modifiche senza nome di file.", file=sys.stderr)
+            continue
+        name = patch.path.strip()
+        path = resolve_response_path(base_dir, name)
+        if path is None:
+            failed += len(patch.edits)
+            print(f"[WARN] saltato (nome non valido o fuori dalla directory): {name}", file=sys.stderr)
+            continue
+        current = updates.get(name)
+        if current is None:
+            try:
+                current, _, _, _, encodings[name] = read_text_file(path, 0)
+            except FileNotFoundError:
+                current = ""
+        new_text, results = apply_edits(current, patch.edits)
+        for n, result in enumerate(results, 1):
+            if not result.applied:
+                failed += 1
+                print(f"[WARN] {name} #{n} non applicata ({result.how}).", file=sys.stderr)
+        if any(result.applied for result in results):
+            updates[name] = new_text
+    for name, body in updates.items():
+        path = resolve_response_path(base_dir, name)
+        if path is None:
+            failed += 1
+            print(f"[WARN] saltato (nome non valido o fuori dalla directory): {name}", file=sys.stderr)
+            continue
+        print(f"{'scritto' if write else 'da scrivere'}: {name} ({len(body)} caratteri)")
+        if write:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if not os.path.exists(path):
+                open(path, "a").close()  # file nuovo: permessi secondo umask (mkstemp userebbe 0600)
+            write_file_atomic(path, body, encodings.get(name, "utf-8"))
+    return failed
+
+
+def cmd_send(args):
+    from deepseek_client import ClientConfig, DeepSeekClient, ResponseCache
+    base_dir, slots = _cli_slots(args)
+    prompt_text, _ = _cli_prompt_text(args, slots)
+    config = ClientConfig.from_env()
+    if not config.api_key:
+        print("[ERRORE] API key mancante (variabile DEEPSEEK_API_KEY).", file=sys.stderr)
+        return 2
+    payload = build_chat_payload(prompt_text)
+    cache = None if args.no_cache else ResponseCache(
+        os.path.join(cache_dir_for(base_dir), "responses"),
+        int(float(os.getenv("CODESHOW_RESPONSE_CACHE_MB", "50")) * 1024 * 1024))
+    key = ResponseCache.key_for(payload)
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        client = DeepSeekClient(config)
+        try:
+            with span("http_request", chars=len(prompt_text)) as sp:
+                resp = client.post(payload)
+                data = resp.json()
+                sp.set(bytes=len(resp.content), **response_usage(data))
+        finally:
+            client.close()
+        if cache is not None and response_text(data):
+            cache.put(key, data)
+    else:
+        print("[INFO] Risposta dalla cache.", file=sys.stderr)
+    content = response_text(data)
+    sys.stdout.write(content + "\n")
+    if args.apply:
+        return 1 if apply_response_to_dir(base_dir, content, write=True) else 0
+    return 0
+
+
+def cmd_apply(args):
+    with open(args.response, "r", encoding="utf-8") as f:
+        content = f.read()
+    failed = apply_response_to_dir(os.path.abspath(args.dir), content, write=args.write)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    load_dotenv_into_environ()
+    parser = argparse.ArgumentParser(prog="codeshow", description="CodeShow senza interfaccia grafica.")
+    parser.add_argument("--trace", metavar="FILE", help="registra i tempi delle fasi e li salva come Chrome trace")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_selection(p):
+        p.add_argument("--dir", default=".", help="directory di lavoro (default: corrente)")
+        p.add_argument("--fileset", help="numero del file_set (default: l’ultimo; \"all\" = tutti i file di testo)")
+        p.add_argument("--mode", choices=PROMPT_MODES, default="full", help="output preference (default: full)")
+        p.add_argument("--request", help="richiesta da accodare al prompt")
+        p.add_argument("--budget", action="store_true", help="adatta il prompt a CODESHOW_TOKEN_BUDGET")
+        p.add_argument("--full-files", action="store_true", help="niente anteprime per i file grandi")
+
+    p = commands.add_parser("prompt", help="scrive il prompt (stdout o destinazione come CODESHOW_PROMPT_OUTPUT)")
+    add_selection(p)
+    p.add_argument("--output", "-o", help="\"-\" (stdout, default), clipboard, file:<path> o tcp:<host>:<port>")
+    p.set_defaults(func=cmd_prompt)
+
+    p = commands.add_parser("scan", help="elenca i file della directory (regole di ignore applicate)")
+    p.add_argument("--dir", default=".")
+    p.add_argument("--no-index", action="store_true", help="ignora e non aggiorna .codeshow/file_index.json")
+    p.set_defaults(func=cmd_scan)
+
+    p = commands.add_parser("filesets", help="elenca i file_set salvati")
+    p.add_argument("--dir", default=".")
+    p.set_defaults(func=cmd_filesets)
+
+    p = commands.add_parser("send", help="invia il prompt a DeepSeek e stampa la risposta")
+    add_selection(p)
+    p.add_argument("--apply", action="store_true", help="scrive su disco i file e le modifiche della risposta")
+    p.add_argument("--no-cache", action="store_true", help="non usare la cache delle risposte")
+    p.set_defaults(func=cmd_send)
+
+    p = commands.add_parser("apply", help="applica ai file una risposta salvata (file completi e patch)")
+    p.add_argument("response", help="file di testo con la risposta del modello")
+    p.add_argument("--dir", default=".")
+    p.add_argument("--write", action="store_true", help="scrive davvero (default: mostra solo cosa cambierebbe)")
+    p.set_defaults(func=cmd_apply)
+
+    args = parser.parse_args(argv)
+    if args.trace:
+        set_tracing(True)
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as e:
+        # file_set mancante o illeggibile, directory inesistente, errori di rete/HTTP, JSON non valido
+        print(f"[ERRORE] {e}", file=sys.stderr)
+        return 2
+    finally:
+        if args.trace:
+            count = export_chrome_trace(args.trace)
+            for row in trace_summary():
+                print(f"[TRACE] {row['name']:16} {row['count']:6}x {row['total_ms']:10.1f} ms", file=sys.stderr)
+            print(f"[INFO] {count} span scritti in {args.trace} (Chrome trace).", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
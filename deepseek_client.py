@@ -0,0 +1,368 @@
+"""
+Client HTTP per l’API chat-completions di DeepSeek usato da "Esegui".
+
+- una sola requests.Session con pool di connessioni (keep-alive riutilizzato tra le chiamate);
+- timeout separati di connessione e lettura;
+- retry su 429/5xx e sulle connessioni mai stabilite con backoff esponenziale con jitter,
+  rispettando l’header Retry-After (mai dopo l’invio, ad esempio su un timeout di lettura:
+  il server potrebbe aver già elaborato, e fatturato, la richiesta);
+- limitazione lato client del numero di richieste al secondo (token bucket);
+- cache su disco delle risposte, indirizzata per contenuto (ResponseCache).
+
+La configurazione di default arriva dalle variabili d’ambiente (vedi ClientConfig.from_env).
+Eseguito come script fa un piccolo test di carico, ad esempio contro mock_deepseek_server.py:
+
+    python deepseek_client.py --url http://127.0.0.1:8765/v1/chat/completions -n 200 -c 8
+"""
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_URL = "https://api.deepseek.com/v1/chat/completions"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RequestCancelled(Exception):
+    """La richiesta è stata annullata dall’utente (durante l’attesa di un retry o del rate limit)."""
+
+
+@dataclass
+class ClientConfig:
+    url: str = DEFAULT_API_URL
+    api_key: str = ""
+    connect_timeout: float = 5.0
+    read_timeout: float = 90.0
+    max_retries: int = 3
+    backoff_base: float = 0.5     # primo ritardo (s), raddoppia a ogni tentativo
+    backoff_max: float = 30.0
+    rate_limit: float = 0.0       # richieste al secondo, 0 = nessun limite
+    rate_burst: int = 2
+    pool_size: int = 4
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Configurazione da DEEPSEEK_API_URL, DEEPSEEK_API_KEY, DEEPSEEK_CONNECT_TIMEOUT,
+        DEEPSEEK_READ_TIMEOUT, DEEPSEEK_MAX_RETRIES e DEEPSEEK_RATE_LIMIT."""
+        env = os.environ
+        config = cls(
+            url=env.get("DEEPSEEK_API_URL") or DEFAULT_API_URL,
+            api_key=env.get("DEEPSEEK_API_KEY") or "",
+            connect_timeout=float(env.get("DEEPSEEK_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(env.get("DEEPSEEK_READ_TIMEOUT", cls.read_timeout)),
+            max_retries=int(env.get("DEEPSEEK_MAX_RETRIES", cls.max_retries)),
+            rate_limit=float(env.get("DEEPSEEK_RATE_LIMIT", cls.rate_limit)),
+        )
+        for key, value in overrides.items():
+            setattr(config, key, value)
+        return config
+
+
+class RateLimiter:
+    """Token bucket thread-safe: al massimo `rate` richieste al secondo, con un piccolo burst."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Prenota un token e ritorna quanti secondi aspettare prima di usarlo."""
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def parse_retry_after(value):
+    """Secondi indicati da Retry-After (numero di secondi oppure data HTTP), None se assente."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def never_connected(error):
+    """
+    True se un requests.ConnectionError è avvenuto prima di inviare la richiesta (connessione
+    rifiutata, DNS, timeout di connessione). Lo stesso tipo avvolge anche il timeout durante la
+    lettura del corpo e la chiusura della connessione dopo l’invio: lì non si può ripetere.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)  # MaxRetryError -> causa originale
+    # NewConnectionError e NameResolutionError derivano da ConnectTimeoutError
+    return isinstance(reason, urllib3.exceptions.ConnectTimeoutError)
+
+
+class DeepSeekClient:
+    def __init__(self, config=None):
+        self.config = config or ClientConfig.from_env()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiter = RateLimiter(self.config.rate_limit, self.config.rate_burst)
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _wait(self, seconds, cancel_event):
+        if seconds <= 0:
+            return
+        if cancel_event is None:
+            time.sleep(seconds)
+        elif cancel_event.wait(seconds):
+            raise RequestCancelled()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Ritardo prima del tentativo `attempt` (1, 2, ...): Retry-After se presente,
+        altrimenti backoff esponenziale con jitter pieno."""
+        if retry_after is not None:
+            return min(retry_after, self.config.backoff_max)
+        ceiling = min(self.config.backoff_max, self.config.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def post(self, payload, stream=False, cancel_event=None):
+        """
+        POST del payload chat-completions. Ritorna la requests.Response (con stream=True il corpo
+        va letto dal chiamante). Solleva requests.HTTPError per gli errori non ritentabili o
+        dopo l’ultimo tentativo, RequestCancelled se `cancel_event` viene impostato durante un’attesa.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.config.api_key}",
+            "Content-Type": "application/json",
+        }
+        timeout = (self.config.connect_timeout, self.config.read_timeout)
+        attempt = 0
+        while True:
+            self._wait(self.limiter.reserve(), cancel_event)
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            self._count("requests")
+            try:
+                resp = self.session.post(self.config.url, headers=headers, json=payload,
+                                         timeout=timeout, stream=stream)
+            except requests.ConnectionError as e:
+                # la POST non è idempotente: si ritenta solo se non è partito nulla
+                if not never_connected(e) or attempt >= self.config.max_retries:
+                    self._count("errors")
+                    raise
+                retry_after = None
+            except requests.Timeout:
+                # timeout di lettura
+                self._count("errors")
+                raise
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt >= self.config.max_retries:
+                    if resp.status_code >= 400:
+                        self._count("errors")
+                        if stream:
+                            # legge il corpo dell’errore (resta disponibile per i dettagli)
+                            # e restituisce la connessione al pool
+                            resp.content
+                            resp.close()
+                    resp.raise_for_status()
+                    return resp
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                resp.close()
+            attempt += 1
+            self._count("retries")
+            self._wait(self.backoff_delay(attempt, retry_after), cancel_event)
+
+    def close(self):
+        self.session.close()
+
+
+class ResponseCache:
+    """
+    Cache su disco delle risposte chat-completions: un file compresso (zlib) per chiave, dove la
+    chiave è l’hash di modello, messaggi (system incluso) e temperatura. Oltre `max_bytes` si
+    eliminano le voci usate meno di recente (l’mtime del file viene aggiornato a ogni hit).
+    """
+
+    SUFFIX = ".json.z"
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.entries = {}  # chiave -> [dimensione, ultimo uso]
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith(self.SUFFIX):
+                        st = entry.stat()
+                        self.entries[entry.name[:-len(self.SUFFIX)]] = [st.st_size, st.st_mtime]
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def key_for(payload):
+        """Chiave della richiesta: il flag stream non cambia la risposta e non conta."""
+        material = {
+            "model": payload.get("model"),
+            "messages": payload.get("messages"),
+            "temperature": payload.get("temperature"),
+        }
+        data = json.dumps(material, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    @property
+    def total_bytes(self):
+        return sum(size for size, _ in self.entries.values())
+
+    def get(self, key):
+        """Risposta (dict JSON) in cache, o None."""
+        with self.lock:
+            if key not in self.entries:
+                self.stats["misses"] += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+                os.utime(path)
+            except (OSError, ValueError, zlib.error):
+                self.entries.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+            self.entries[key][1] = time.time()
+            self.stats["hits"] += 1
+            return data
+
+    def put(self, key, data):
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"), 6)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            self.entries[key] = [len(blob), time.time()]
+            self.stats["stores"] += 1
+            self._evict()
+
+    def _evict(self):
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self.entries.clear()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_load_test(client, requests_count, concurrency, stream=False):
+    """Esegue `requests_count` chiamate con `concurrency` thread; ritorna le statistiche."""
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [{"role": "user", "content": "User has these files:\nbench.py\n\n"
+                                                  "Contents of the files are:\nbench.py\nprint('ok')\n\n"}],
+        "stream": stream,
+    }
+    latencies, failures = [], []
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            resp = client.post(payload, stream=stream)
+            with resp:
+                for _chunk in resp.iter_content(chunk_size=None):
+                    pass
+        except Exception as e:
+            failures.append(e)
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - started
+    return {
+        "ok": len(latencies),
+        "failed": len(failures),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        **client.stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico del client DeepSeek (es. contro il server mock).")
+    parser.add_argument("--url", default=os.environ.get("DEEPSEEK_API_URL") or "http://127.0.0.1:8765/v1/chat/completions")
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="limite richieste/s lato client")
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args(argv)
+    config = ClientConfig.from_env(url=args.url, api_key=os.environ.get("DEEPSEEK_API_KEY") or "test",
+                                   rate_limit=args.rate, pool_size=args.concurrency)
+    client = DeepSeekClient(config)
+    try:
+        result = run_load_test(client, args.requests, args.concurrency, args.stream)
+    finally:
+        client.close()
+    for key, value in result.items():
+        print(f"{key:>15}: {value:.2f}" if isinstance(value, float) else f"{key:>15}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Parsing delle risposte di DeepSeek: estrae i file restituiti dal modello.
+
+Formati riconosciuti (come la versione originale basata su regex, ma in una sola passata
+per righe, in tempo lineare anche su risposte di diversi MB):
+  1) nome file su una riga (eventualmente seguita da righe vuote) + blocco ``` ... ```
+  2) nome file su una riga + corpo fino al prossimo nome file o fine testo
+Un "nome file" è una riga che, tolti gli spazi, termina con .<estensione> (1-10 caratteri
+alfanumerici ASCII) preceduta da almeno un carattere.
+"""
+import heapq
+
+
+def _header_name(line):
+    """Nome del file se la riga è un'intestazione "qualcosa.ext", altrimenti None."""
+    name = line.strip()
+    if not name or "\r" in name:
+        return None
+    dot = name.rfind(".")
+    ext = name[dot + 1:]
+    if not 1 <= len(ext) <= 10 or not (ext.isascii() and ext.isalnum()):
+        return None
+    if dot < 1 and not (dot == 0 and line[:1].isspace()):
+        return None  # serve almeno un carattere prima del punto
+    return name
+
+
+def _is_fence_open(line):
+    return line.startswith("```") and "`" not in line[3:]
+
+
+def parse_deepseek_files(content: str):
+    """
+    Estrae un dizionario {filename -> file_content} dal testo del modello.
+    Ritorna anche una stringa 'explanations' con il testo non parsato.
+    """
+    lines = content.split("\n")
+    count = len(lines)
+    starts = [0] * count           # offset di inizio di ogni riga
+    offset = 0
+    for i, line in enumerate(lines):
+        starts[i] = offset
+        offset += len(line) + 1
+
+    # indice della prossima riga che inizia con ``` (da i in poi), calcolato all’indietro
+    next_fence = [count] * (count + 1)
+    for i in range(count - 1, -1, -1):
+        next_fence[i] = i if lines[i].startswith("```") else next_fence[i + 1]
+
+    headers = [None] * count
+    for i, line in enumerate(lines):
+        if "." in line:
+            headers[i] = _header_name(line)
+
+    files_map = {}
+    spans = []                      # intervalli consumati, in ordine di inizio
+    consumed = [False] * count      # righe che cadono dentro un blocco del passo 1
+
+    # --- Passo 1: filename + fenced code block
+    i = 0
+    while i < count:
+        name = headers[i]
+        if name is None:
+            i += 1
+            continue
+        fence = i + 1
+        while fence < count and not lines[fence].strip():
+            fence += 1
+        if fence + 1 >= count or not _is_fence_open(lines[fence]):
+            i += 1
+            continue
+        close = next_fence[fence + 2]
+        if close >= count:
+            i += 1
+            continue
+        files_map[name] = "\n".join(lines[fence + 1:close])
+        spans.append((starts[i], starts[close] + 3))
+        for k in range(i, close + 1):
+            consumed[k] = True
+        i = close + 1
+
+    # --- Passo 2: filename + blocco plain fino al prossimo filename non consumato
+    plain = [i for i in range(count) if headers[i] is not None and not consumed[i]]
+    plain_spans = []
+    for n, i in enumerate(plain):
+        end_line = plain[n + 1] if n + 1 < len(plain) else count
+        end_pos = starts[end_line] if end_line < count else len(content)
+        body = content[starts[i] + len(lines[i]) + 1:end_pos].strip()
+        if body:
+            files_map[headers[i]] = body
+            plain_spans.append((starts[i], end_pos))
+
+    # Spiegazioni = tutto ciò che non è stato consumato (unione ordinata degli intervalli)
+    explanations_parts = []
+    last = 0
+    for a, b in heapq.merge(spans, plain_spans):
+        if last < a:
+            explanations_parts.append(content[last:a])
+        last = max(last, b)
+    if last < len(content):
+        explanations_parts.append(content[last:])
+    explanations_text = "\n".join(p.strip()
+                                  for p in explanations_parts if p.strip())
+
+    return files_map, explanations_text
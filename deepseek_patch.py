@@ -0,0 +1,365 @@
+"""
+Modifiche mirate nelle risposte di DeepSeek ("Give me the patches one by one").
+
+Formati riconosciuti, anche dentro un blocco ``` e più volte per lo stesso file:
+  1) blocchi search/replace preceduti dal nome del file:
+        path/to/file.py
+        <<<<<<< SEARCH
+        righe attuali
+        =======
+        righe nuove
+        >>>>>>> REPLACE
+     (SEARCH vuoto = file nuovo, o aggiunta in coda a un file esistente)
+  2) diff unificati: "--- a/file" / "+++ b/file" seguiti da hunk "@@ -l,n +l,n @@"; basta anche
+     il nome del file su una riga seguito direttamente dagli hunk.
+
+Applicazione (apply_edits) riga per riga, dal match più sicuro al più tollerante:
+  esatto -> ignorando gli spazi (con reindentazione) -> contesto ridotto (solo diff, come
+  il "fuzz" di patch) -> blocco più simile oltre PATCH_SIMILARITY_MIN.
+Un blocco che compare alla lettera in più punti (senza riga attesa) è ambiguo e non si applica.
+Le modifiche non applicabili restano nell’esito, per mostrarle all’utente.
+"""
+import re
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+
+from deepseek_parser import _header_name
+
+PATCH_MAX_FUZZ = 2            # righe di contesto che un hunk può perdere per lato
+PATCH_SIMILARITY_MIN = 0.8    # somiglianza minima per applicare un blocco non trovato alla lettera
+PATCH_SIMILARITY_CANDIDATES = 20
+AMBIGUOUS = "ambiguo"         # motivo del fallimento quando il blocco compare più volte
+
+SEARCH_RE = re.compile(r"^\s*<{5,9} ?SEARCH\s*$")
+DIVIDER_RE = re.compile(r"^\s*={5,9}\s*$")
+REPLACE_RE = re.compile(r"^\s*>{5,9} ?REPLACE\s*$")
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+PATCH_TEXT_RE = re.compile(r"(?m)^(\s*<{5,9} ?SEARCH\s*$|@@ |--- \S.*\n\+\+\+ )")
+FILE_PREFIX_RE = re.compile(r"^(?:file(?:name)?|path)\s*:\s*", re.IGNORECASE)
+
+
+@dataclass
+class PatchEdit:
+    kind: str                  # "replace" (search/replace) oppure "diff" (hunk)
+    old: list                  # righe da cercare nel file
+    new: list                  # righe che le sostituiscono
+    hint: int = None           # riga attesa (0-based) indicata dall’intestazione dell’hunk
+    lead: int = 0              # righe di contesto iniziali/finali dell’hunk (per il fuzz)
+    trail: int = 0
+    text: str = ""             # testo originale del blocco, per il resoconto
+
+
+@dataclass
+class FilePatch:
+    path: str
+    edits: list = field(default_factory=list)
+    creates: bool = False      # diff da /dev/null: il file è nuovo
+
+    @property
+    def only_creates(self):
+        return self.creates or all(not edit.old for edit in self.edits)
+
+
+@dataclass
+class EditResult:
+    edit: PatchEdit
+    applied: bool
+    how: str                   # "esatto", "spazi ignorati", ... oppure il motivo del fallimento
+
+
+def looks_like_patch(text):
+    """True se il testo contiene blocchi search/replace o hunk di diff (non è un file completo)."""
+    return PATCH_TEXT_RE.search(text) is not None
+
+
+def _file_line(line):
+    """Nome del file se la riga lo annuncia ("path/file.py", "**File: `file.py`**:" ...)."""
+    name = line.strip().strip("*`#: ").strip()
+    name = FILE_PREFIX_RE.sub("", name).strip("*`: ")
+    if not name or " " in name:
+        return None
+    return _header_name(name)
+
+
+def _diff_path(line):
+    path = line[4:].split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path[:2] in ("a/", "b/"):
+        path = path[2:]
+    return path
+
+
+def parse_patches(content):
+    """
+    Estrae le modifiche mirate dal testo del modello.
+    Ritorna (lista di FilePatch nell’ordine di apparizione, testo restante) dove il testo restante
+    è la risposta senza i blocchi di patch, da passare a parse_deepseek_files.
+    """
+    lines = content.split("\n")
+    count = len(lines)
+    consumed = [False] * count
+    patches = {}
+    current = None            # file a cui si riferiscono i prossimi blocchi
+    current_line = None       # riga che l’ha annunciato (si consuma solo se usata)
+
+    def target(path, line_no, creates=False):
+        patch = patches.get(path)
+        if patch is None:
+            patch = patches[path] = FilePatch(path)
+        patch.creates = patch.creates or creates
+        if line_no is not None:
+            consumed[line_no] = True
+        return patch
+
+    def consume(a, b):
+        # righe a..b-1 più un’eventuale apertura/chiusura ``` che le racchiude
+        for k in range(a, b):
+            consumed[k] = True
+        before = a - 1
+        while before >= 0 and not lines[before].strip() and not consumed[before]:
+            before -= 1
+        if before >= 0 and lines[before].startswith("```") and not consumed[before]:
+            consumed[before] = True
+        if b < count and lines[b].strip() == "```":
+            consumed[b] = True
+
+    i = 0
+    while i < count:
+        line = lines[i]
+        if SEARCH_RE.match(line):
+            divider = i + 1
+            while divider < count and not DIVIDER_RE.match(lines[divider]):
+                divider += 1
+            end = divider + 1
+            while end < count and not REPLACE_RE.match(lines[end]):
+                end += 1
+            if end >= count:
+                i += 1              # blocco incompleto: resta nel testo
+                continue
+            edit = PatchEdit("replace", lines[i + 1:divider], lines[divider + 1:end],
+                             text="\n".join(lines[i:end + 1]))
+            target(current, current_line).edits.append(edit)
+            consume(i, end + 1)
+            i = end + 1
+            continue
+        if line.startswith("--- ") and i + 1 < count and lines[i + 1].startswith("+++ "):
+            old_path, new_path = _diff_path(line), _diff_path(lines[i + 1])
+            start = i
+            if i > 0 and lines[i - 1].startswith("index "):
+                start -= 1
+            if start > 0 and lines[start - 1].startswith("diff "):
+                start -= 1
+            current, current_line = new_path or old_path, None
+            target(current, None, creates=old_path is None)
+            consume(start, i + 2)
+            i += 2
+            continue
+        if line.startswith("@@") and current is not None:
+            edit, end = _parse_hunk(lines, i)
+            target(current, current_line).edits.append(edit)
+            consume(i, end)
+            i = end
+            continue
+        name = _file_line(line) if "." in line else None
+        if name is not None:
+            current, current_line = name, i
+        i += 1
+
+    rest = "\n".join(line for line, used in zip(lines, consumed) if not used)
+    return [patch for patch in patches.values() if patch.edits], rest
+
+
+def _parse_hunk(lines, i):
+    """Un hunk dalla riga "@@" in posizione i; ritorna (PatchEdit, indice della riga successiva)."""
+    m = HUNK_RE.match(lines[i])
+    hint = old_left = new_left = None
+    if m:
+        hint = max(int(m.group(1)) - 1, 0)
+        old_left = int(m.group(2)) if m.group(2) is not None else 1
+        new_left = int(m.group(4)) if m.group(4) is not None else 1
+    old, new, tags = [], [], []
+    j = i + 1
+    while j < len(lines):
+        line = lines[j]
+        if old_left is not None and old_left <= 0 and new_left <= 0:
+            break               # conteggi dell’intestazione esauriti
+        if line.startswith("@@") or line.startswith("```"):
+            break
+        if line.startswith("--- ") and j + 1 < len(lines) and lines[j + 1].startswith("+++ "):
+            break
+        tag = line[:1]
+        if tag == "\\":        # "\ No newline at end of file"
+            j += 1
+            continue
+        if tag not in ("", " ", "-", "+"):
+            break
+        body = line[1:]
+        if tag in ("", " "):
+            old.append(body)
+            new.append(body)
+        elif tag == "-":
+            old.append(body)
+        else:
+            new.append(body)
+        tags.append(tag or " ")
+        if old_left is not None:
+            old_left -= tag != "+"
+            new_left -= tag != "-"
+        j += 1
+    if old_left is None or old_left > 0 or new_left > 0:
+        # conteggi assenti o sbagliati: le righe vuote finali sono testo, non contesto
+        while tags and tags[-1] == " " and not lines[j - 1]:
+            tags.pop()
+            old.pop()
+            new.pop()
+            j -= 1
+    lead = next((k for k, tag in enumerate(tags) if tag != " "), len(tags))
+    trail = next((k for k, tag in enumerate(reversed(tags)) if tag != " "), 0)
+    edit = PatchEdit("diff", old, new, hint=hint, lead=lead, trail=trail, text="\n".join(lines[i:j]))
+    return edit, j
+
+
+# ========================== APPLICAZIONE ==========================
+
+def _norm(line):
+    return " ".join(line.split())
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _find_exact(lines, old, hint):
+    """Posizioni in cui `old` compare alla lettera; la più vicina a hint (o la prima)."""
+    first = old[0]
+    found = [p for p in range(len(lines) - len(old) + 1)
+             if lines[p] == first and lines[p:p + len(old)] == old]
+    if not found:
+        return None, 0
+    if hint is not None:
+        return min(found, key=lambda p: abs(p - hint)), len(found)
+    return found[0], len(found)
+
+
+def _find_similar(norm_lines, norm_old, hint):
+    """Finestra di righe più simile a `old` (prefiltro per righe in comune, poi SequenceMatcher)."""
+    size = len(norm_old)
+    if size < 2 or size > len(norm_lines):
+        return None, 0.0
+    wanted = {}
+    for line in norm_old:
+        wanted[line] = wanted.get(line, 0) + 1
+    # righe della finestra presenti in `old`, aggiornate scorrendo (O(n))
+    hits = [1 if line in wanted else 0 for line in norm_lines]
+    common = sum(hits[:size])
+    scored = []
+    for p in range(len(norm_lines) - size + 1):
+        if p:
+            common += hits[p + size - 1] - hits[p - 1]
+        if common * 2 >= size:
+            scored.append((-common, abs(p - hint) if hint is not None else 0, p))
+    scored.sort()
+    target = "\n".join(norm_old)
+    best, best_ratio = None, 0.0
+    for _, _, p in scored[:PATCH_SIMILARITY_CANDIDATES]:
+        matcher = SequenceMatcher(None, "\n".join(norm_lines[p:p + size]), target, autojunk=False)
+        if matcher.quick_ratio() <= best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best, best_ratio = p, ratio
+    return best, best_ratio
+
+
+def _reindent(new, old, matched):
+    """Adatta l’indentazione delle righe nuove a quella trovata nel file."""
+    src = next((line for line in old if line.strip()), None)
+    dst = next((line for line in matched if line.strip()), None)
+    if src is None or dst is None or _indent(src) == _indent(dst):
+        return list(new)
+    a, b = _indent(src), _indent(dst)
+    return [b + line[len(a):] if line.startswith(a) and line.strip() else line for line in new]
+
+
+def _locate(lines, norm_lines, old, hint):
+    """
+    (posizione, come) del blocco `old` nel file, oppure (None, motivo). Senza una riga attesa
+    più occorrenze sono ambigue: la modifica fallisce invece di finire nel punto sbagliato.
+    """
+    how = "esatto"
+    pos, occurrences = _find_exact(lines, old, hint)
+    if pos is None:
+        how = "spazi ignorati"
+        pos, occurrences = _find_exact(norm_lines, [_norm(line) for line in old], hint)
+    if pos is None:
+        return None, "non trovato"
+    if occurrences > 1 and hint is None:
+        return None, f"{AMBIGUOUS} ({occurrences} occorrenze)"
+    return pos, how
+
+
+def _apply_one(lines, edit, hint):
+    """Applica una modifica alla lista di righe; ritorna (esito, differenza nel numero di righe)."""
+    if not edit.old:
+        # inserimento puro: nella riga indicata dall’hunk, altrimenti in coda al file
+        if lines == [""]:
+            lines[:] = list(edit.new)
+            return "file nuovo", len(edit.new) - 1
+        pos = hint if hint is not None else len(lines) - (1 if lines[-1] == "" else 0)
+        lines[pos:pos] = edit.new
+        return "inserito", len(edit.new)
+
+    norm_lines = [_norm(line) for line in lines]
+    old, new = edit.old, edit.new
+    pos, how = _locate(lines, norm_lines, old, hint)
+    if pos is None and how.startswith(AMBIGUOUS):
+        return None, how
+    if pos is None and edit.kind == "diff":
+        # come il fuzz di patch: si scartano righe di contesto ai bordi dell’hunk
+        for fuzz in range(1, PATCH_MAX_FUZZ + 1):
+            lead, trail = min(fuzz, edit.lead), min(fuzz, edit.trail)
+            if not lead and not trail:
+                break
+            trimmed_old = old[lead:len(old) - trail]
+            if not trimmed_old:
+                break
+            trimmed_hint = hint + lead if hint is not None else None
+            pos, how = _locate(lines, norm_lines, trimmed_old, trimmed_hint)
+            if pos is None and how.startswith(AMBIGUOUS):
+                return None, how
+            if pos is not None:
+                old, new = trimmed_old, new[lead:len(new) - trail]
+                how = f"contesto ridotto di {fuzz}"
+                break
+    if pos is None:
+        pos, ratio = _find_similar(norm_lines, [_norm(line) for line in edit.old], hint)
+        if pos is None or ratio < PATCH_SIMILARITY_MIN:
+            detail = f" (massima somiglianza {ratio:.0%})" if pos is not None else ""
+            return None, "non trovato" + detail
+        old, new, how = edit.old, edit.new, f"simile al {ratio:.0%}"
+
+    new = _reindent(new, old, lines[pos:pos + len(old)])
+    lines[pos:pos + len(old)] = new
+    return how, len(new) - len(old)
+
+
+def apply_edits(text, edits):
+    """
+    Applica in ordine le modifiche al testo di un file.
+    Ritorna (testo aggiornato, lista di EditResult); le modifiche fallite non toccano il testo.
+    """
+    lines = text.split("\n")
+    results = []
+    delta = 0                  # righe aggiunte/tolte dagli hunk precedenti (sposta le posizioni attese)
+    for edit in edits:
+        hint = edit.hint + delta if edit.hint is not None else None
+        if hint is not None:
+            hint = max(0, min(hint, len(lines)))
+        how, change = _apply_one(lines, edit, hint)
+        if how is None:
+            results.append(EditResult(edit, False, change))  # change = motivo del fallimento
+            continue
+        delta += change
+        results.append(EditResult(edit, True, how))
+    return "\n".join(lines), results
@@ -0,0 +1,148 @@
+"""
+Server locale che imita l’endpoint chat-completions di DeepSeek (formato OpenAI), per provare
+"Esegui" senza rete né API key, anche in streaming (SSE).
+
+Uso:
+    python mock_deepseek_server.py --port 8765
+    DEEPSEEK_API_URL=http://127.0.0.1:8765/v1/chat/completions DEEPSEEK_API_KEY=test \\
+        python "code_show_all_directories - Working Api.py"
+
+La risposta restituisce, per ognuno dei primi file elencati nel prompt ("User has these files:"),
+lo stesso contenuto con un commento in testa, nel formato "nome file + blocco ```".
+Con --fail-rate una parte delle richieste riceve 429/503 con Retry-After, per provare retry e
+backoff del client; per i test di carico vedi `python deepseek_client.py --help`.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def build_reply(prompt, max_files):
+    """Testo della risposta finta costruito dal prompt ricevuto."""
+    names = []
+    match = re.search(r"User has these files:\n(.*?)\n\n", prompt, re.DOTALL)
+    if match:
+        names = [line.split(" [", 1)[0] for line in match.group(1).splitlines() if line.strip()]
+    parts = ["Ecco i file aggiornati (risposta del server mock)."]
+    for name in names[:max_files]:
+        body = ""
+        section = prompt.find(f"\n{name}\n", match.end() if match else 0)
+        if section >= 0:
+            start = section + len(name) + 2
+            end = prompt.find("\n\n", start)
+            body = prompt[start:end if end >= 0 else len(prompt)]
+        parts.append(f"{name}\n```\n# modificato dal server mock\n{body}\n```")
+    parts.append("Fine della risposta.")
+    return "\n\n".join(parts) + "\n"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = None  # argparse.Namespace impostato in main()
+    stats = {"requests": 0, "failed": 0, "connections": 0}
+    stats_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.stats_lock:
+            self.stats["connections"] += 1
+
+    def log_message(self, fmt, *args):
+        if not self.settings.quiet:
+            super().log_message(fmt, *args)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+        with self.stats_lock:
+            self.stats["requests"] += 1
+        if random.random() < self.settings.fail_rate:
+            with self.stats_lock:
+                self.stats["failed"] += 1
+            self._send_json(random.choice((429, 503)), {"error": {"message": "mock overload"}},
+                            {"Retry-After": str(self.settings.retry_after)})
+            return
+        messages = request.get("messages") or [{}]
+        reply = build_reply(messages[-1].get("content", ""), self.settings.files)
+        time.sleep(self.settings.latency)
+        if request.get("stream"):
+            self._send_stream(reply, request.get("model", "deepseek-chat"))
+        else:
+            self._send_json(200, {
+                "id": "mock-1",
+                "object": "chat.completion",
+                "model": request.get("model", "deepseek-chat"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+            })
+
+    def _send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, reply, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = self.settings.chunk
+        try:
+            for i in range(0, len(reply), size):
+                event = {"id": "mock-1", "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": reply[i:i + size]}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+                time.sleep(self.settings.delay)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # il client ha annullato la richiesta
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server mock compatibile con l’API chat-completions di DeepSeek.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="attesa prima della risposta (s)")
+    parser.add_argument("--delay", type=float, default=0.02, help="pausa tra i chunk SSE (s)")
+    parser.add_argument("--chunk", type=int, default=24, help="caratteri per chunk SSE")
+    parser.add_argument("--files", type=int, default=2, help="file restituiti nella risposta")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="frazione di richieste rifiutate con 429/503")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="valore di Retry-After (s)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+    MockHandler.settings = args
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(f"[INFO] Server mock DeepSeek su http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[INFO] Richieste: {MockHandler.stats['requests']}, rifiutate: {MockHandler.stats['failed']}, "
+              f"connessioni: {MockHandler.stats['connections']}")
+
+
+if __name__ == "__main__":
+    main()